@@ -0,0 +1,134 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+from typing import Dict, Optional, Tuple
+from fastapi import Request, Response
+from fastapi.templating import Jinja2Templates
+
+try:
+    import brotli
+except ImportError:
+    # Optional: without it only gzip variants are built
+    brotli = None
+
+STATIC_DIR = "static"
+TEMPLATE_DIR = "templates"
+# Smaller files are not worth a compressed variant
+ASSET_COMPRESS_MIN_BYTES = int(os.environ.get("ASSET_COMPRESS_MIN_BYTES", 512))
+
+# Pages with no per-request data, rendered once at startup
+PAGES = ("index.html", "chat.html")
+
+# Fingerprinted URLs never change content; plain URLs and pages must revalidate
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Preferred first when the client accepts several
+ENCODINGS = ("br", "gzip")
+
+
+def accepted_encodings(header: str) -> set:
+    accepted = set()
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q=") and params[2:] in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(token.strip().lower())
+    return accepted
+
+
+class Asset:
+    """One file's bytes, precompressed variants and content digest."""
+
+    def __init__(self, body: bytes, media_type: str):
+        self.media_type = media_type
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.variants: Dict[str, bytes] = {"identity": body}
+        if len(body) >= ASSET_COMPRESS_MIN_BYTES:
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(body, quality=11)
+            self.variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+            for encoding in ENCODINGS:
+                if len(self.variants.get(encoding, body)) >= len(body):
+                    self.variants.pop(encoding, None)
+
+    def etag(self, encoding: str) -> str:
+        # Each representation gets its own strong validator
+        suffix = "" if encoding == "identity" else f"-{encoding}"
+        return f'"{self.digest[:20]}{suffix}"'
+
+    def response(self, request: Request, cache_control: str) -> Response:
+        accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+        encoding = next((e for e in ENCODINGS if e in self.variants and e in accepted), "identity")
+        headers = {"ETag": self.etag(encoding), "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if self.digest[:20] in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+
+
+class AssetPipeline:
+    """Static files and pages prepared once at startup and served from memory.
+
+    Every file under STATIC_DIR is read, fingerprinted by content hash and
+    precompressed (gzip, plus brotli when installed). Templates link the
+    fingerprinted URL through `asset_url`, which is cached forever; the
+    plain path still works for anything else but must revalidate. PAGES
+    are rendered once, since they carry no per-request data.
+    """
+
+    def __init__(self, static_dir: str = STATIC_DIR, template_dir: str = TEMPLATE_DIR):
+        self.static_dir = static_dir
+        self.templates = Jinja2Templates(directory=template_dir)
+        self.templates.env.globals["asset_url"] = self.url
+        # Request path under /static/ -> (asset, Cache-Control)
+        self.files: Dict[str, Tuple[Asset, str]] = {}
+        # Logical path -> fingerprinted path
+        self.fingerprints: Dict[str, str] = {}
+        self.pages: Dict[str, Asset] = {}
+
+    def build(self):
+        files: Dict[str, Tuple[Asset, str]] = {}
+        fingerprints: Dict[str, str] = {}
+        for root, _, names in os.walk(self.static_dir):
+            for name in names:
+                full_path = os.path.join(root, name)
+                path = os.path.relpath(full_path, self.static_dir).replace(os.sep, "/")
+                with open(full_path, "rb") as f:
+                    asset = Asset(f.read(), mimetypes.guess_type(name)[0] or "application/octet-stream")
+                stem, ext = os.path.splitext(path)
+                fingerprinted = f"{stem}.{asset.digest[:12]}{ext}"
+                files[path] = (asset, REVALIDATE)
+                files[fingerprinted] = (asset, IMMUTABLE)
+                fingerprints[path] = fingerprinted
+        self.files, self.fingerprints = files, fingerprints
+
+        # Rendered after the fingerprints exist, so asset_url resolves
+        self.pages = {
+            name: Asset(self.templates.get_template(name).render().encode(), "text/html; charset=utf-8")
+            for name in PAGES
+        }
+        raw = sum(len(a.variants["identity"]) for a, cc in files.values() if cc == IMMUTABLE)
+        packed = sum(len(a.variants.get("br", a.variants.get("gzip", a.variants["identity"])))
+                     for a, cc in files.values() if cc == IMMUTABLE)
+        print(f"[ASSETS] Built {len(fingerprints)} static files ({raw} -> {packed} bytes compressed) "
+              f"and {len(self.pages)} pages{'' if brotli else ' (gzip only, brotli not installed)'}")
+
+    def url(self, path: str) -> str:
+        return f"/static/{self.fingerprints.get(path, path)}"
+
+    def static(self, path: str, request: Request) -> Optional[Response]:
+        entry = self.files.get(path)
+        if entry is None:
+            return None
+        asset, cache_control = entry
+        return asset.response(request, cache_control)
+
+    def page(self, name: str, request: Request) -> Response:
+        return self.pages[name].response(request, REVALIDATE)
+
+
+asset_pipeline = AssetPipeline()
@@ -0,0 +1,108 @@
+import asyncio
+import os
+from typing import Dict, Optional, Tuple
+from app.metrics import MeteredAsyncServer, metrics
+from app.presence import TYPING_EVENTS_PER_SEC, TYPING_BURST
+from app.ratelimit import RateLimiter
+
+# (events per second, burst) each socket may send; unlisted events are not limited
+INBOUND_LIMITS: Dict[str, Tuple[float, float]] = {
+    'send_message': (float(os.environ.get("INBOUND_MESSAGES_PER_SEC", 5)),
+                     float(os.environ.get("INBOUND_MESSAGE_BURST", 20))),
+    'share_file': (float(os.environ.get("INBOUND_FILES_PER_SEC", 0.5)),
+                   float(os.environ.get("INBOUND_FILE_BURST", 5))),
+    'webrtc_signal': (float(os.environ.get("INBOUND_SIGNALS_PER_SEC", 20)),
+                      float(os.environ.get("INBOUND_SIGNAL_BURST", 60))),
+    'fetch_history': (2, 10),
+    'typing': (TYPING_EVENTS_PER_SEC, TYPING_BURST),
+    'resync_members': (1, 3),
+}
+# Throttled events the sender is told about; the rest are dropped silently
+NOTIFY_THROTTLED = {'send_message', 'share_file'}
+
+# Engine.IO packets waiting for one client before it counts as slow
+OUTBOUND_SHED_PACKETS = int(os.environ.get("OUTBOUND_SHED_PACKETS", 64))
+OUTBOUND_MAX_PACKETS = int(os.environ.get("OUTBOUND_MAX_PACKETS", 1024))
+# What a slow client skips first; the next typing_state supersedes a dropped one
+SHEDDABLE_EVENTS = {'typing_state'}
+
+throttled_total = metrics.counter(
+    "zerochat_socketio_throttled_total", "Inbound events dropped by per-socket rate limits", ("event",))
+shed_total = metrics.counter(
+    "zerochat_socketio_shed_total", "Outbound events skipped for clients with a full queue", ("event",))
+slow_disconnects_total = metrics.counter(
+    "zerochat_slow_consumer_disconnects_total", "Clients disconnected for not reading their outbound queue")
+
+
+def event_name(data) -> Optional[str]:
+    """Event name of an encoded Socket.IO EVENT packet, e.g. '2["typing_state",{...}]'."""
+    if not isinstance(data, str) or data[:1] not in ('2', '5'):
+        return None
+    start = data.find('["')
+    if start == -1:
+        return None
+    end = data.find('"', start + 2)
+    return data[start + 2:end] if end != -1 else None
+
+
+class BackpressureAsyncServer(MeteredAsyncServer):
+    """Per-socket inbound rate limits and bounded outbound queues.
+
+    Inbound events listed in INBOUND_LIMITS go through a token bucket per
+    socket. On the way out, a client whose Engine.IO queue holds
+    OUTBOUND_SHED_PACKETS packets stops receiving SHEDDABLE_EVENTS, and one
+    that reaches OUTBOUND_MAX_PACKETS is disconnected with its queue
+    discarded; it can resume its session and replay what it missed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiters = {event: RateLimiter(rate, burst) for event, (rate, burst) in INBOUND_LIMITS.items()}
+
+    async def _trigger_event(self, event, namespace, *args):
+        limiter = self.limiters.get(event)
+        if limiter is not None and args and not limiter.allow(args[0]):
+            throttled_total.inc(event)
+            if event in NOTIFY_THROTTLED:
+                await self.emit('error', {
+                    'message': 'Too many requests, slow down',
+                    'fatal': False,
+                    'throttled': event
+                }, to=args[0], namespace=namespace)
+            return None
+        try:
+            return await super()._trigger_event(event, namespace, *args)
+        finally:
+            if event == 'disconnect' and args:
+                for limiter in self.limiters.values():
+                    limiter.forget(args[0])
+
+    async def _send_eio_packet(self, eio_sid, eio_pkt):
+        socket = self.eio.sockets.get(eio_sid)
+        depth = socket.queue.qsize() if socket is not None else 0
+        if depth >= OUTBOUND_SHED_PACKETS:
+            if depth >= OUTBOUND_MAX_PACKETS:
+                await self.drop_slow_consumer(socket)
+                return
+            event = event_name(eio_pkt.data)
+            if event in SHEDDABLE_EVENTS:
+                shed_total.inc(event)
+                return
+        await super()._send_eio_packet(eio_sid, eio_pkt)
+
+    async def drop_slow_consumer(self, socket):
+        if socket.closing or socket.closed:
+            return
+        slow_disconnects_total.inc()
+        print(f"[WS] Disconnecting slow consumer {socket.sid} ({socket.queue.qsize()} packets queued)")
+        # Nothing queued would reach it in time; free the memory now
+        while True:
+            try:
+                socket.queue.get_nowait()
+                socket.queue.task_done()
+            except asyncio.QueueEmpty:
+                break
+        await socket.close(wait=False)
+
+    def max_queue_depth(self) -> int:
+        return max((s.queue.qsize() for s in list(self.eio.sockets.values())), default=0)
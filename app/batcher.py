@@ -0,0 +1,119 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from app.metrics import metrics
+
+# Longest a broadcast may wait to share a frame; 0 sends everything immediately
+BROADCAST_BATCH_MAX_MS = float(os.environ.get("BROADCAST_BATCH_MAX_MS", 0))
+BROADCAST_BATCH_MIN_MS = float(os.environ.get("BROADCAST_BATCH_MIN_MS", 5))
+# Window is sized to collect about this many events at the room's current rate
+BROADCAST_BATCH_TARGET = int(os.environ.get("BROADCAST_BATCH_TARGET", 8))
+# A batch this full goes out before its window ends
+BROADCAST_BATCH_MAX_EVENTS = int(os.environ.get("BROADCAST_BATCH_MAX_EVENTS", 64))
+# Weight of the newest gap in each room's smoothed inter-arrival time
+RATE_SMOOTHING = 0.2
+
+Event = Tuple[str, dict]
+SendCallback = Callable[[str, List[Event]], Awaitable[None]]
+
+batch_events = metrics.histogram(
+    "zerochat_broadcast_batch_events", "Room events coalesced into one message_batch frame",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+
+class BroadcastBatcher:
+    """Coalesces a busy room's broadcasts into one `message_batch` per window.
+
+    Each room keeps a smoothed gap between its broadcasts, and a window
+    sized to collect about BROADCAST_BATCH_TARGET events at that rate,
+    between BROADCAST_BATCH_MIN_MS and BROADCAST_BATCH_MAX_MS. While a
+    window would not even catch two events (and after any pause longer
+    than a window), events are sent on their own right away, so quiet
+    rooms see no added latency. In a busy room they queue up in order,
+    whatever their kind, and go out together when the window closes or
+    BROADCAST_BATCH_MAX_EVENTS are waiting.
+    """
+
+    def __init__(self, max_ms: float = BROADCAST_BATCH_MAX_MS, min_ms: float = BROADCAST_BATCH_MIN_MS,
+                 target: int = BROADCAST_BATCH_TARGET, max_events: int = BROADCAST_BATCH_MAX_EVENTS):
+        self.max_window = max_ms / 1000
+        self.min_window = min(min_ms, max_ms) / 1000
+        self.target = target
+        self.max_events = max_events
+        # Room id -> (last event at, smoothed gap in seconds)
+        self._rate: Dict[str, Tuple[float, float]] = {}
+        self._pending: Dict[str, List[Event]] = {}
+        self._full: Dict[str, asyncio.Event] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._send: Optional[SendCallback] = None
+
+        self.immediate = 0
+        self.batched = 0
+        self.batches = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_window > 0 and self._send is not None
+
+    def window(self, gap: float) -> float:
+        return min(self.max_window, max(self.min_window, gap * self.target))
+
+    def add(self, room_id: str, event: str, data: dict) -> bool:
+        """Queue a room-wide event; False means the caller should emit it now."""
+        if not self.enabled:
+            return False
+        at = time.monotonic()
+        last, gap = self._rate.get(room_id, (None, self.max_window))
+        if last is not None:
+            gap += (at - last - gap) * RATE_SMOOTHING
+        self._rate[room_id] = (at, gap)
+
+        pending = self._pending.get(room_id)
+        if pending is None:
+            window = self.window(gap)
+            if last is None or at - last >= window or gap * 2 > window:
+                self.immediate += 1
+                return False
+            pending = self._pending[room_id] = []
+            self._full[room_id] = asyncio.Event()
+            self._tasks[room_id] = asyncio.create_task(self._flush_after(room_id, window))
+        pending.append((event, data))
+        self.batched += 1
+        if len(pending) >= self.max_events:
+            self._full[room_id].set()
+        return True
+
+    def forget(self, room_id: str):
+        """Drop a deleted room's rate; anything still queued is sent first."""
+        self._rate.pop(room_id, None)
+
+    def start(self, send: SendCallback):
+        self._send = send
+
+    async def stop(self):
+        for room_id in list(self._tasks):
+            self._full[room_id].set()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._send = None
+
+    async def _flush_after(self, room_id: str, window: float):
+        try:
+            await asyncio.wait_for(self._full[room_id].wait(), window)
+        except asyncio.TimeoutError:
+            pass
+        events = self._pending.pop(room_id)
+        del self._full[room_id]
+        del self._tasks[room_id]
+        self.batches += 1
+        batch_events.observe(len(events))
+        try:
+            await self._send(room_id, events)
+        except Exception as e:
+            print(f"[BATCH] Failed to send {len(events)} events to room {room_id}: {e}")
+
+    def __len__(self) -> int:
+        return sum(len(events) for events in self._pending.values())
+
+
+broadcast_batcher = BroadcastBatcher()
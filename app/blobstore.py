@@ -0,0 +1,160 @@
+import hashlib
+import os
+import re
+import time
+import uuid
+from typing import AsyncIterator, List, Optional, Tuple
+import aiofiles
+import aiofiles.os
+
+BLOB_DIR = os.environ.get("BLOB_DIR", "./blobs")
+# Encrypted files arrive base64-encoded: 10MB of plaintext is ~13.4MB on the wire
+BLOB_MAX_BYTES = int(os.environ.get("BLOB_MAX_BYTES", 16 * 1024 * 1024))
+# Uploads not shared within this long are deleted, unless a room references the same bytes
+BLOB_UPLOAD_TTL_SECONDS = float(os.environ.get("BLOB_UPLOAD_TTL_SECONDS", 600))
+
+BLOB_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class BlobTooLarge(Exception):
+    """Raised when an upload exceeds BLOB_MAX_BYTES."""
+
+
+class BlobStore:
+    """Content-addressed on-disk store for encrypted file payloads.
+
+    Blobs are named by the SHA-256 of their bytes and fanned out into
+    two-character subdirectories. Uploads stream into a temp file while
+    hashing and are renamed into place once complete, so a blob path only
+    ever holds a finished file.
+
+    Each upload also leaves an empty marker file under
+    `uploads/<blob id>/`, one per (room, uploader). Markers live on disk
+    next to the blobs so that every worker sees them and they survive a
+    restart. `share_file` only accepts blobs its sender has a marker for.
+    Markers older than BLOB_UPLOAD_TTL_SECONDS are swept, and storage
+    then deletes the blobs no room references (see
+    InMemoryStorage.release_blobs).
+    """
+
+    def __init__(self, root: str = BLOB_DIR, max_bytes: int = BLOB_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def start(self):
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "uploads"), exist_ok=True)
+
+    def path_for(self, blob_id: str) -> Optional[str]:
+        if not BLOB_ID_PATTERN.match(blob_id or ""):
+            return None
+        return os.path.join(self.root, blob_id[:2], blob_id)
+
+    def size(self, blob_id: str) -> Optional[int]:
+        path = self.path_for(blob_id)
+        try:
+            return os.path.getsize(path) if path else None
+        except OSError:
+            return None
+
+    async def write_stream(self, chunks: AsyncIterator[bytes]) -> Tuple[str, int]:
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.root, "tmp", uuid.uuid4().hex)
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise BlobTooLarge(f"blob exceeds {self.max_bytes} bytes")
+                    digest.update(chunk)
+                    await f.write(chunk)
+
+            blob_id = digest.hexdigest()
+            path = self.path_for(blob_id)
+            await aiofiles.os.makedirs(os.path.dirname(path), exist_ok=True)
+            await aiofiles.os.replace(tmp_path, path)
+            return blob_id, size
+        finally:
+            if await aiofiles.os.path.exists(tmp_path):
+                await aiofiles.os.remove(tmp_path)
+
+    def write_bytes(self, data: bytes) -> Tuple[str, int]:
+        """Blocking counterpart of write_stream for payloads already in memory."""
+        blob_id = hashlib.sha256(data).hexdigest()
+        path = self.path_for(blob_id)
+        tmp_path = os.path.join(self.root, "tmp", uuid.uuid4().hex)
+        os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return blob_id, len(data)
+
+    def record_upload(self, blob_id: str, room_id: str, user_id: str):
+        path = self._marker_path(blob_id, room_id, user_id)
+        if not path:
+            return
+        for _ in range(2):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                with open(path, "wb"):
+                    pass
+                return
+            except FileNotFoundError:
+                # A sweep removed the emptied directory between the two calls
+                continue
+
+    def uploaded_by(self, blob_id: str, room_id: str, user_id: str) -> bool:
+        path = self._marker_path(blob_id, room_id, user_id)
+        return bool(path) and os.path.exists(path)
+
+    def has_uploads(self, blob_id: str) -> bool:
+        """Whether any upload of these bytes is still waiting to be shared."""
+        try:
+            return bool(os.listdir(os.path.join(self.root, "uploads", blob_id)))
+        except OSError:
+            return False
+
+    def sweep_uploads(self, max_age: float = BLOB_UPLOAD_TTL_SECONDS) -> List[str]:
+        """Remove expired upload markers, returning the blob ids left without any."""
+        cutoff = time.time() - max_age
+        orphaned = []
+        try:
+            entries = list(os.scandir(os.path.join(self.root, "uploads")))
+        except FileNotFoundError:
+            return orphaned
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            try:
+                for marker in os.scandir(entry.path):
+                    if marker.stat().st_mtime < cutoff:
+                        os.remove(marker.path)
+                # Fails while an unexpired marker remains, or one was just recorded
+                os.rmdir(entry.path)
+            except OSError:
+                continue
+            orphaned.append(entry.name)
+        return orphaned
+
+    def _marker_path(self, blob_id: str, room_id: str, user_id: str) -> Optional[str]:
+        if not BLOB_ID_PATTERN.match(blob_id or ""):
+            return None
+        owner = hashlib.sha256(f"{room_id}/{user_id}".encode()).hexdigest()[:32]
+        return os.path.join(self.root, "uploads", blob_id, owner)
+
+    def delete(self, blob_id: str):
+        path = self.path_for(blob_id)
+        if path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+blob_store = BlobStore()
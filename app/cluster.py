@@ -0,0 +1,406 @@
+import asyncio
+import fcntl
+import os
+import pickle
+import struct
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+# Unix socket path shared by the workers of one deployment; empty runs a single process
+CLUSTER_BROKER = os.environ.get("CLUSTER_BROKER", "")
+CLUSTER_SYNC_TIMEOUT = float(os.environ.get("CLUSTER_SYNC_TIMEOUT", 10))
+# A worker this far behind on reading frames is dropped rather than buffered forever
+CLUSTER_PEER_BUFFER_BYTES = int(os.environ.get("CLUSTER_PEER_BUFFER_BYTES", 64 * 1024 * 1024))
+
+HEADER = struct.Struct(">I")
+
+PeerDownCallback = Callable[[List[str]], Awaitable[None]]
+
+
+def encode_frame(message: dict) -> bytes:
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    return HEADER.pack(len(payload)) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> bytes:
+    header = await reader.readexactly(HEADER.size)
+    return await reader.readexactly(HEADER.unpack(header)[0])
+
+
+class BrokerServer:
+    """Fan-out hub that every worker connects to over a Unix socket.
+
+    It runs inside whichever worker wins the lock next to the socket path.
+    Frames are relayed to every other worker byte for byte, in the order
+    they arrive; when a worker's connection drops the rest are told with a
+    `peer_down` frame so they can forget its users.
+    """
+
+    def __init__(self, path: str, host_id: str):
+        self.path = path
+        self.host_id = host_id
+        self.peers: Dict[asyncio.StreamWriter, Optional[str]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        os.chmod(self.path, 0o600)
+        print(f"[CLUSTER] Broker listening on {self.path}")
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            for writer in list(self.peers):
+                writer.close()
+            self._server = None
+
+    def fan_out(self, frame: bytes, sender: Optional[asyncio.StreamWriter] = None):
+        for writer in list(self.peers):
+            if writer is sender:
+                continue
+            if writer.transport.get_write_buffer_size() > CLUSTER_PEER_BUFFER_BYTES:
+                print(f"[CLUSTER] Dropping worker {self.peers.get(writer)}: too far behind")
+                writer.close()
+                continue
+            writer.write(frame)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        worker_id = None
+        try:
+            hello = pickle.loads(await read_frame(reader))
+            worker_id = hello.get('worker')
+            self.peers[writer] = worker_id
+            writer.write(encode_frame({'channel': 'broker', 'op': 'welcome', 'host': self.host_id}))
+            while True:
+                payload = await read_frame(reader)
+                self.fan_out(HEADER.pack(len(payload)) + payload, sender=writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.peers.pop(writer, None)
+            writer.close()
+            if worker_id:
+                self.fan_out(encode_frame({'channel': 'state', 'op': 'peer_down', 'worker': worker_id}))
+
+
+class BrokerClient:
+    """One worker's connection to the broker, hosting it if no one else is.
+
+    Whoever holds an exclusive lock on `<path>.lock` runs the BrokerServer;
+    the lock is released when that process dies, so the next worker to
+    reconnect takes over. Incoming frames are dispatched to per-channel
+    handlers in arrival order.
+    """
+
+    def __init__(self, path: str, worker_id: str):
+        self.path = path
+        self.worker_id = worker_id
+        self.server: Optional[BrokerServer] = None
+        self.host_id: Optional[str] = None
+        self.handlers: Dict[str, Callable[[dict], Awaitable[None]]] = {}
+        self.on_host_lost: Optional[Callable[[str], Awaitable[None]]] = None
+        self._lock_fd: Optional[int] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.published = 0
+        self.received = 0
+
+    @property
+    def is_host(self) -> bool:
+        return self.server is not None
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    def subscribe(self, channel: str, handler: Callable[[dict], Awaitable[None]]):
+        self.handlers[channel] = handler
+
+    def publish(self, channel: str, message: dict):
+        """Send a message to every other worker; never blocks the caller."""
+        if not self.connected:
+            print(f"[CLUSTER] Broker unavailable, dropped {channel} message")
+            return
+        message['channel'] = channel
+        self._writer.write(encode_frame(message))
+        self.published += 1
+
+    async def start(self, timeout: float = CLUSTER_SYNC_TIMEOUT):
+        reader = await self._connect(timeout)
+        self._task = asyncio.create_task(self._run(reader))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        if self.server:
+            await self.server.close()
+            self.server = None
+
+    def _try_host(self) -> bool:
+        if self.server:
+            return True
+        if self._lock_fd is None:
+            self._lock_fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        self.server = BrokerServer(self.path, self.worker_id)
+        return True
+
+    async def _connect(self, timeout: float) -> asyncio.StreamReader:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                if self._try_host() and self.server._server is None:
+                    await self.server.start()
+                reader, self._writer = await asyncio.open_unix_connection(self.path)
+                self._writer.write(encode_frame({'worker': self.worker_id}))
+                welcome = pickle.loads(await read_frame(reader))
+                self.host_id = welcome['host']
+                return reader
+            except (OSError, asyncio.IncompleteReadError):
+                if loop.time() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+    async def _run(self, reader: asyncio.StreamReader):
+        while True:
+            try:
+                while True:
+                    message = pickle.loads(await read_frame(reader))
+                    self.received += 1
+                    handler = self.handlers.get(message.get('channel'))
+                    if handler:
+                        try:
+                            await handler(message)
+                        except Exception as e:
+                            print(f"[CLUSTER] Failed to handle {message.get('channel')} message: {e}")
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+
+            # The broker went away with the worker hosting it
+            print(f"[CLUSTER] Lost broker hosted by worker {self.host_id}, reconnecting")
+            lost_host = self.host_id
+            self._writer = None
+            reader = await self._connect(float("inf"))
+            if lost_host != self.worker_id and self.on_host_lost:
+                await self.on_host_lost(lost_host)
+
+
+class LocalBrokerManager(AsyncPubSubManager):
+    """Socket.IO client manager that relays emits through the bundled broker."""
+
+    name = 'localbroker'
+
+    def __init__(self, broker: BrokerClient, channel: str = 'socketio'):
+        super().__init__(channel=channel)
+        self.broker = broker
+
+    async def _publish(self, data):
+        self.broker.publish(self.channel, data)
+
+    async def _listen(self):
+        # Subscribing lazily means a worker drops relayed emits until it has clients
+        inbox: "asyncio.Queue[dict]" = asyncio.Queue()
+        self.broker.subscribe(self.channel, inbox.put)
+        while True:
+            yield await inbox.get()
+
+
+class StateReplicator:
+    """Mirrors storage and registry mutations to the other workers.
+
+    Every worker keeps the full room state in memory. Local mutations are
+    published as (op, args) on the `state` channel and applied remotely to
+    memory only, so each write still reaches the database exactly once,
+    from the worker that accepted it. A worker joining late asks the broker
+    host for a snapshot before it starts serving.
+
+    `mirrors` are further named objects with the same observer /
+    apply_replicated hooks (typing state, resumption tokens); those with an
+    `export()` method also contribute (op, args) pairs to the snapshot.
+    """
+
+    def __init__(self, broker: BrokerClient, storage, registry, mirrors: Optional[Dict[str, object]] = None,
+                 on_peer_down: Optional[PeerDownCallback] = None):
+        self.broker = broker
+        self.storage = storage
+        self.registry = registry
+        self.mirrors = mirrors or {}
+        self.on_peer_down = on_peer_down
+        # Worker id -> user ids it announced, and the reverse
+        self.owned: Dict[str, Set[str]] = {}
+        self.owner: Dict[str, str] = {}
+        self._synced = asyncio.Event()
+
+    def attach(self):
+        self.storage.observer = lambda op, *args: self._publish('storage', op, args)
+        self.registry.observer = self._registry_changed
+        for name, mirror in self.mirrors.items():
+            mirror.observer = lambda op, *args, name=name: self._publish(name, op, args)
+        self.broker.subscribe('state', self.handle)
+        self.broker.on_host_lost = self.peer_down
+
+    def detach(self):
+        self.storage.observer = None
+        self.registry.observer = None
+        for mirror in self.mirrors.values():
+            mirror.observer = None
+
+    async def sync(self, timeout: float = CLUSTER_SYNC_TIMEOUT):
+        if self.broker.is_host:
+            return
+        self.broker.publish('state', {'op': 'sync_request', 'worker': self.broker.worker_id})
+        try:
+            await asyncio.wait_for(self._synced.wait(), timeout)
+        except asyncio.TimeoutError:
+            print("[CLUSTER] No snapshot from the broker host, starting empty")
+
+    def _registry_changed(self, op: str, *args):
+        if op == 'attach':
+            # A user resumed here; whoever held them before no longer does
+            self._forget(args[1])
+        self._publish('registry', op, args)
+
+    def _publish(self, target: str, op: str, args: tuple):
+        self.broker.publish('state', {
+            'op': 'apply',
+            'target': target,
+            'name': op,
+            'args': args,
+            'worker': self.broker.worker_id
+        })
+
+    async def handle(self, message: dict):
+        op = message['op']
+        if op == 'apply':
+            self.apply(message['worker'], message['target'], message['name'], message['args'])
+        elif op == 'sync_request':
+            if self.broker.is_host:
+                self.broker.publish('state', self.snapshot(message['worker']))
+        elif op == 'snapshot':
+            if message['to'] == self.broker.worker_id and not self._synced.is_set():
+                self.restore(message)
+                self._synced.set()
+        elif op == 'peer_down':
+            await self.peer_down(message['worker'])
+
+    def apply(self, worker_id: str, target: str, name: str, args: tuple):
+        if target == 'storage':
+            self.storage.apply_replicated(name, *args)
+            return
+        if target != 'registry':
+            if target in self.mirrors:
+                self.mirrors[target].apply_replicated(name, *args)
+            return
+
+        self.registry.apply_replicated(name, *args)
+        if name in ('add_user', 'attach'):
+            user_id = args[1]['id'] if name == 'add_user' else args[1]
+            self._forget(user_id)
+            self.owner[user_id] = worker_id
+            self.owned.setdefault(worker_id, set()).add(user_id)
+        elif name == 'remove_user':
+            self._forget(args[0])
+        elif name == 'remove_users':
+            for user_id in args[0]:
+                self._forget(user_id)
+
+    def _forget(self, user_id: str):
+        worker_id = self.owner.pop(user_id, None)
+        if worker_id:
+            self.owned.get(worker_id, set()).discard(user_id)
+
+    def snapshot(self, to: str) -> dict:
+        users = []
+        for user_id, user in self.registry.users.items():
+            users.append((self.registry.get_sid(user_id), user, self.owner.get(user_id, self.broker.worker_id)))
+        return {
+            'op': 'snapshot',
+            'to': to,
+            'rooms': self.storage.rooms,
+            'messages': {room_id: list(store) for room_id, store in self.storage.messages.items()},
+            'file_shares': self.storage.file_shares,
+            'users': users,
+            'mirrors': {name: mirror.export() for name, mirror in self.mirrors.items() if hasattr(mirror, 'export')}
+        }
+
+    def restore(self, snapshot: dict):
+        for room_id, room in snapshot['rooms'].items():
+            self.storage.apply_replicated('create_room', room_id, room)
+            for message in snapshot['messages'].get(room_id, []):
+                self.storage.apply_replicated('add_message', room_id, message)
+            for file_share in snapshot['file_shares'].get(room_id, []):
+                self.storage.apply_replicated('add_file_share', room_id, file_share)
+        for sid, user, worker_id in snapshot['users']:
+            self.apply(worker_id, 'registry', 'add_user', (sid, user))
+        for name, ops in snapshot['mirrors'].items():
+            for op, args in ops:
+                self.apply(None, name, op, args)
+        print(f"[CLUSTER] Synced {len(snapshot['rooms'])} rooms and {len(snapshot['users'])} users")
+
+    async def peer_down(self, worker_id: str):
+        """Forget the users of a worker that went away and let the caller tidy their rooms."""
+        user_ids = self.owned.pop(worker_id, set())
+        rooms = set()
+        for user_id in user_ids:
+            self.owner.pop(user_id, None)
+            user = self.registry.apply_replicated('remove_user', user_id)
+            if user:
+                rooms.add(user['room_id'])
+        print(f"[CLUSTER] Worker {worker_id} went away with {len(user_ids)} users")
+        if self.on_peer_down and rooms:
+            await self.on_peer_down(list(rooms))
+
+
+class Cluster:
+    """Everything a worker needs to share state with its siblings.
+
+    Disabled (all no-ops) unless CLUSTER_BROKER is set.
+    """
+
+    def __init__(self, path: str = CLUSTER_BROKER):
+        self.path = path
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.broker = BrokerClient(path, self.worker_id) if path else None
+        self.manager = LocalBrokerManager(self.broker) if path else None
+        self.replicator: Optional[StateReplicator] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.broker is not None
+
+    async def start(self, storage, registry, mirrors: Optional[Dict[str, object]] = None,
+                    on_peer_down: Optional[PeerDownCallback] = None):
+        if not self.enabled:
+            return
+        self.replicator = StateReplicator(self.broker, storage, registry, mirrors, on_peer_down)
+        self.replicator.attach()
+        await self.broker.start()
+        await self.replicator.sync()
+        role = "hosting the broker" if self.broker.is_host else f"broker hosted by {self.broker.host_id}"
+        print(f"[CLUSTER] Worker {self.worker_id} ready ({role})")
+
+    async def stop(self):
+        if not self.enabled:
+            return
+        if self.replicator:
+            self.replicator.detach()
+        await self.broker.stop()
+
+
+cluster = Cluster()
@@ -0,0 +1,86 @@
+import base64
+import os
+from typing import Dict, Optional
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+from cryptography.hazmat.primitives import serialization
+from cryptography.exceptions import InvalidSignature
+from app.workers import WorkerPool
+from app.profiling import traced
+
+# Payloads larger than this are verified off the event loop
+SIGNATURE_OFFLOAD_BYTES = int(os.environ.get("SIGNATURE_OFFLOAD_BYTES", 64 * 1024))
+SIGNATURE_WORKERS = int(os.environ.get("SIGNATURE_WORKERS", 2))
+SIGNATURE_QUEUE_LIMIT = int(os.environ.get("SIGNATURE_QUEUE_LIMIT", 32))
+
+signature_pool = WorkerPool("ed25519", SIGNATURE_WORKERS, SIGNATURE_QUEUE_LIMIT)
+
+
+def load_public_key(public_key_b64: str) -> Optional[Ed25519PublicKey]:
+    """Parse a base64 SPKI (DER) Ed25519 public key, or None if it is not one."""
+    try:
+        public_key = serialization.load_der_public_key(base64.b64decode(public_key_b64))
+    except Exception as e:
+        print(f"[WS] Invalid public key: {e}")
+        return None
+    return public_key if isinstance(public_key, Ed25519PublicKey) else None
+
+
+def verify_signature(public_key: Ed25519PublicKey, message: str, signature_b64: str) -> bool:
+    try:
+        public_key.verify(base64.b64decode(signature_b64), message.encode('utf-8'))
+        return True
+    except (InvalidSignature, Exception) as e:
+        print(f"[WS] Signature verification failed: {e}")
+        return False
+
+
+def verify_ed25519_signature(message: str, signature_b64: str, public_key_b64: str) -> bool:
+    """Verify Ed25519 digital signature server-side, parsing the key every call."""
+    public_key = load_public_key(public_key_b64)
+    return public_key is not None and verify_signature(public_key, message, signature_b64)
+
+
+@traced("ed25519.verify")
+async def verify_payload(public_key: Optional[Ed25519PublicKey], message: str, signature_b64: str) -> bool:
+    """Verify with a pre-parsed key; large payloads go to the worker pool (may raise WorkerPoolBusy)."""
+    if public_key is None:
+        return False
+    if len(message) > SIGNATURE_OFFLOAD_BYTES:
+        return await signature_pool.run(verify_signature, public_key, message, signature_b64)
+    return verify_signature(public_key, message, signature_b64)
+
+
+def verify_file_signature(public_key: Ed25519PublicKey, path: str, signature_b64: str) -> bool:
+    """Blocking: read a stored (base64 text) payload and verify it. Run in `signature_pool`."""
+    with open(path, "r", encoding="utf-8") as f:
+        return verify_signature(public_key, f.read(), signature_b64)
+
+
+async def verify_file(public_key: Optional[Ed25519PublicKey], path: str, signature_b64: str) -> bool:
+    if public_key is None:
+        return False
+    return await signature_pool.run(verify_file_signature, public_key, path, signature_b64)
+
+
+class PublicKeyCache:
+    """Parsed Ed25519 keys per connected user, fixed at join time."""
+
+    def __init__(self):
+        self._keys: Dict[str, Optional[Ed25519PublicKey]] = {}
+
+    def put(self, user_id: str, public_key_b64: Optional[str]) -> Optional[Ed25519PublicKey]:
+        public_key = load_public_key(public_key_b64) if public_key_b64 else None
+        self._keys[user_id] = public_key
+        return public_key
+
+    def get(self, user_id: str) -> Optional[Ed25519PublicKey]:
+        return self._keys.get(user_id)
+
+    def drop(self, user_id: str):
+        self._keys.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+public_keys = PublicKeyCache()
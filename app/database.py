@@ -1,8 +1,103 @@
+from datetime import timedelta
+from typing import List, Tuple
+from sqlalchemy import bindparam, inspect, select, text, update
 from sqlalchemy.orm import Session
-from app.models import Base, engine, SessionLocal
+from app.models import Base, engine, async_engine, SessionLocal
+from app.blobstore import blob_store
+
+# Indexes superseded by wider ones; dropped so writes stop maintaining them
+RETIRED_INDEXES = ("ix_messages_room_timestamp",)
+# Legacy inline uploads moved into the blob store per startup transaction
+LEGACY_FILE_BATCH = 100
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    # create_all skips tables that already exist, so add columns and indexes introduced since
+    with engine.begin() as connection:
+        added = add_missing_columns(connection)
+        relax_file_share_data(connection)
+        if ("messages", "expires_at") in added:
+            backfill_expires_at(connection)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    with engine.begin() as connection:
+        for name in RETIRED_INDEXES:
+            connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    move_legacy_files()
+
+def add_missing_columns(connection) -> List[Tuple[str, str]]:
+    """ALTER TABLE ... ADD COLUMN for model columns the existing tables lack (all such columns are nullable)."""
+    inspector = inspect(connection)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                added.append((table.name, column.name))
+    return added
+
+def backfill_expires_at(connection):
+    """One-off: stamp expires_at on self-destructing messages written before the column existed."""
+    messages = Base.metadata.tables["messages"]
+    rows = connection.execute(
+        select(messages.c.id, messages.c.timestamp, messages.c.ttl_seconds).where(messages.c.ttl_seconds.isnot(None))
+    ).all()
+    updates = [{"message_id": message_id, "stamp": timestamp + timedelta(seconds=ttl)}
+               for message_id, timestamp, ttl in rows]
+    if updates:
+        connection.execute(
+            update(messages).where(messages.c.id == bindparam("message_id")).values(expires_at=bindparam("stamp")),
+            updates
+        )
+        print(f"[DB] Stamped expires_at on {len(updates)} self-destructing messages")
+
+def relax_file_share_data(connection):
+    """file_shares.encrypted_data used to be NOT NULL; blob-backed rows leave it empty."""
+    columns = {column['name']: column for column in inspect(connection).get_columns("file_shares")}
+    if columns["encrypted_data"]["nullable"]:
+        return
+    if connection.dialect.name != "sqlite":
+        connection.execute(text("ALTER TABLE file_shares ALTER COLUMN encrypted_data DROP NOT NULL"))
+        return
+    # SQLite cannot alter a column's constraints: rebuild the table from the model
+    table = Base.metadata.tables["file_shares"]
+    names = ", ".join(column.name for column in table.columns)
+    connection.execute(text("ALTER TABLE file_shares RENAME TO file_shares_legacy"))
+    for index in table.indexes:
+        connection.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    table.create(bind=connection)
+    connection.execute(text(f"INSERT INTO file_shares ({names}) SELECT {names} FROM file_shares_legacy"))
+    connection.execute(text("DROP TABLE file_shares_legacy"))
+
+def move_legacy_files():
+    """Copy inline uploads from before the blob store into it, so every file is served the same way.
+    
+    Rows that fail to move keep their encrypted_data and are still served inline.
+    """
+    moved = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(text(
+                "SELECT id, encrypted_data FROM file_shares "
+                "WHERE blob_id IS NULL AND encrypted_data IS NOT NULL LIMIT :limit"
+            ), {"limit": LEGACY_FILE_BATCH}).all()
+            if not rows:
+                break
+            for file_id, data in rows:
+                try:
+                    blob_id, _ = blob_store.write_bytes(data.encode())
+                except OSError as e:
+                    print(f"[DB] Could not move legacy file {file_id} into the blob store: {e}")
+                    return
+                connection.execute(text(
+                    "UPDATE file_shares SET blob_id = :blob_id, encrypted_data = NULL WHERE id = :id"
+                ), {"blob_id": blob_id, "id": file_id})
+            moved += len(rows)
+    if moved:
+        print(f"[DB] Moved {moved} legacy inline files into the blob store")
 
 def get_db():
     db = SessionLocal()
@@ -10,3 +105,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def close_db():
+    await async_engine.dispose()
+    engine.dispose()
@@ -0,0 +1,81 @@
+import asyncio
+import heapq
+import os
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+EXPIRY_TICK_MS = int(os.environ.get("EXPIRY_TICK_MS", 250))
+
+ExpireCallback = Callable[[str, List[str]], Awaitable[None]]
+
+
+def now() -> float:
+    # Same clock as message timestamps (utcnow-based, in seconds)
+    return datetime.utcnow().timestamp()
+
+
+class ExpiryScheduler:
+    """One timer heap for every self-destructing message on the server.
+
+    Instead of a sleeping task per message, a single loop wakes every tick,
+    pops everything that is due and hands the expired ids to the callback
+    grouped by room, so each room gets one bulk delete and one event.
+    """
+
+    def __init__(self, tick_ms: int = EXPIRY_TICK_MS):
+        self.tick = tick_ms / 1000
+        self._heap: List[Tuple[float, str, str]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._on_expire: Optional[ExpireCallback] = None
+        self.expired = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, room_id: str, message_id: str, expires_at: float):
+        heapq.heappush(self._heap, (expires_at, room_id, message_id))
+
+    def schedule_message(self, message: dict):
+        if message.get('ttl'):
+            self.schedule(message['roomId'], message['id'], message['timestamp'] / 1000 + message['ttl'])
+
+    def arm(self, pending: Iterable[Tuple[str, str, float]]):
+        """Re-arm timers (room id, message id, expires at) recovered on startup."""
+        for room_id, message_id, expires_at in pending:
+            self._heap.append((expires_at, room_id, message_id))
+        heapq.heapify(self._heap)
+
+    def start(self, on_expire: ExpireCallback):
+        self._on_expire = on_expire
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def pop_due(self, at: float) -> Dict[str, List[str]]:
+        due: Dict[str, List[str]] = {}
+        while self._heap and self._heap[0][0] <= at:
+            _, room_id, message_id = heapq.heappop(self._heap)
+            due.setdefault(room_id, []).append(message_id)
+        return due
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            due = self.pop_due(now())
+            for room_id, message_ids in due.items():
+                self.expired += len(message_ids)
+                try:
+                    await self._on_expire(room_id, message_ids)
+                except Exception as e:
+                    print(f"[TTL] Failed to expire {len(message_ids)} messages in room {room_id}: {e}")
+
+
+expiry_scheduler = ExpiryScheduler()
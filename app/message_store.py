@@ -0,0 +1,204 @@
+import os
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+ROOM_MAX_MESSAGES = int(os.environ.get("ROOM_MAX_MESSAGES", 10000))
+ROOM_MAX_BYTES = int(os.environ.get("ROOM_MAX_BYTES", 64 * 1024 * 1024))
+
+
+# Last millisecond of 9999, the latest time the database's datetimes hold
+MAX_CURSOR_MS = 253402300799999.0
+
+# History is ordered by (timestamp, id), so messages stamped in the same millisecond still page cleanly
+Cursor = Tuple[float, str]
+
+
+def message_key(message: dict) -> Cursor:
+    return (message['timestamp'], message['id'])
+
+
+def format_cursor(key: Optional[Cursor]) -> Optional[str]:
+    """The opaque "timestamp:id" string clients send back to get the next page."""
+    return f"{key[0]!r}:{key[1]}" if key is not None else None
+
+
+def parse_cursor(cursor: Union[str, float, None]) -> Optional[Cursor]:
+    """Inverse of format_cursor; a bare timestamp from an older client means "before this time".
+
+    Anything else that does not parse, or is not a time the database can hold, is None.
+    """
+    if isinstance(cursor, bool) or not isinstance(cursor, (str, int, float)) or cursor == '':
+        return None
+    if isinstance(cursor, (int, float)):
+        timestamp, message_id = float(cursor), ''
+    else:
+        timestamp, _, message_id = cursor.partition(':')
+        try:
+            timestamp = float(timestamp)
+        except ValueError:
+            return None
+    return (timestamp, message_id) if 0 <= timestamp <= MAX_CURSOR_MS else None
+
+
+def message_size(message: dict) -> int:
+    """Approximate in-memory footprint of a message (its string payloads)."""
+    return sum(len(value) for value in message.values() if isinstance(value, str))
+
+
+class RoomMessageStore:
+    """Bounded, time-ordered message history for one room.
+
+    Messages live in an append-only slot list with a parallel list of
+    timestamps and an id -> slot index. Deleting by id leaves a tombstone
+    (O(1)); reads bisect the timestamps (O(log n)) and skip tombstones.
+    Pages are ordered by (timestamp, id); messages sharing a millisecond
+    sit next to each other, so only that run is sorted by id.
+    Slots before `head` have been evicted; both regions are compacted
+    away once they outnumber the live messages, so memory stays
+    proportional to what the room actually holds.
+    """
+
+    def __init__(self, max_messages: int = ROOM_MAX_MESSAGES, max_bytes: int = ROOM_MAX_BYTES):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self._slots: List[Optional[dict]] = []
+        self._timestamps: List[float] = []
+        self._index: Dict[str, int] = {}
+        # Slot numbers are absolute; the list position is slot - _base
+        self._base = 0
+        self._head = 0
+        self._live = 0
+        self._tombstones = 0
+        self.bytes = 0
+        # Newest timestamp of any message this store no longer holds: only
+        # history stamped after it is complete here (None if nothing is missing)
+        self.evicted_ts: Optional[float] = None
+
+    @property
+    def truncated(self) -> bool:
+        return self.evicted_ts is not None
+
+    def __len__(self) -> int:
+        return self._live
+
+    def __iter__(self) -> Iterator[dict]:
+        for message in self._slots[self._head:]:
+            if message is not None:
+                yield message
+
+    def __contains__(self, message_id: str) -> bool:
+        return message_id in self._index
+
+    def get(self, message_id: str) -> Optional[dict]:
+        slot = self._index.get(message_id)
+        return self._slots[slot - self._base] if slot is not None else None
+
+    def append(self, message: dict) -> List[dict]:
+        """Add a message, returning any older messages evicted to stay within budget.
+
+        Ids are unique within a room; a second message with a known id is
+        rejected with ValueError rather than replacing the first.
+        """
+        if message['id'] in self._index:
+            raise ValueError(f"duplicate message id {message['id']}")
+        timestamp = message['timestamp'] = self.in_order(message['timestamp'])
+
+        self._index[message['id']] = self._base + len(self._slots)
+        self._slots.append(message)
+        self._timestamps.append(timestamp)
+        self._live += 1
+        self.bytes += message_size(message)
+
+        evicted = []
+        while self._live > 1 and (self._live > self.max_messages or self.bytes > self.max_bytes):
+            evicted.append(self._pop_oldest())
+        self._maybe_compact()
+        return evicted
+
+    def in_order(self, timestamp: float) -> float:
+        """Clamp a new message's timestamp so history stays sorted even if the clock steps back."""
+        return max(timestamp, self._timestamps[-1]) if self._timestamps else timestamp
+
+    def delete(self, message_id: str) -> Optional[dict]:
+        slot = self._index.pop(message_id, None)
+        if slot is None:
+            return None
+        position = slot - self._base
+        message = self._slots[position]
+        self._slots[position] = None
+        self._live -= 1
+        self._tombstones += 1
+        self.bytes -= message_size(message)
+        self._maybe_compact()
+        return message
+
+    def page(self, before: Optional[Cursor] = None, limit: int = 50,
+             after: Optional[float] = None) -> Tuple[List[dict], Optional[Cursor]]:
+        """Newest `limit` messages ordered before `before`, and the cursor for the next page.
+
+        With `after`, only messages stamped later than it are considered.
+        """
+        lo = self._head if after is None else bisect_right(self._timestamps, after, lo=self._head)
+        end = len(self._slots) if before is None else bisect_right(self._timestamps, before[0], lo=lo)
+        found: List[dict] = []
+        position = end - 1
+        while position >= lo:
+            # Past `limit`, keep going only to the end of the oldest millisecond found
+            if len(found) >= limit and self._timestamps[position] < found[-1]['timestamp']:
+                break
+            message = self._slots[position]
+            if message is not None and (before is None or message_key(message) < before):
+                found.append(message)
+            position -= 1
+        found.sort(key=message_key)
+        page = found[-limit:]
+
+        # Only hand out a cursor if something older is still stored
+        if len(found) > limit:
+            return page, message_key(page[0])
+        while position >= lo:
+            if self._slots[position] is not None:
+                return page, message_key(page[0])
+            position -= 1
+        return page, None
+
+    def after(self, message_id: str) -> Optional[List[dict]]:
+        """Messages stored after `message_id`, or None if that message is no longer held."""
+        slot = self._index.get(message_id)
+        if slot is None:
+            return None
+        return [m for m in self._slots[slot - self._base + 1:] if m is not None]
+
+    def range(self, start: float, end: float) -> List[dict]:
+        """Messages with start <= timestamp < end."""
+        lo = bisect_left(self._timestamps, start, lo=self._head)
+        hi = bisect_left(self._timestamps, end, lo=lo)
+        return [m for m in self._slots[lo:hi] if m is not None]
+
+    def clear(self):
+        self.__init__(self.max_messages, self.max_bytes)
+
+    def _pop_oldest(self) -> dict:
+        while self._slots[self._head] is None:
+            self._head += 1
+            self._tombstones -= 1
+        message = self._slots[self._head]
+        self._slots[self._head] = None
+        self._head += 1
+        self.evicted_ts = self._timestamps[self._head - 1]
+        self._index.pop(message['id'], None)
+        self._live -= 1
+        self.bytes -= message_size(message)
+        return message
+
+    def _maybe_compact(self):
+        dead = self._head + self._tombstones
+        if dead < 64 or dead <= self._live:
+            return
+        live_slots = [(m, t) for m, t in zip(self._slots[self._head:], self._timestamps[self._head:]) if m is not None]
+        self._base += len(self._slots)
+        self._slots = [m for m, _ in live_slots]
+        self._timestamps = [t for _, t in live_slots]
+        self._index = {m['id']: self._base + i for i, m in enumerate(self._slots)}
+        self._head = 0
+        self._tombstones = 0
@@ -0,0 +1,213 @@
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import socketio
+from app.profiling import handler_tracer, span
+
+METRICS_LAG_INTERVAL_MS = int(os.environ.get("METRICS_LAG_INTERVAL_MS", 100))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+Labels = Tuple[str, ...]
+GaugeValue = Union[float, Dict[Labels, float]]
+
+
+def format_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self.values.items():
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    """Fixed-bucket histogram; observing is one bisect and two additions."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Labels -> [per-bucket counts (last is +Inf), sum, count]
+        self.series: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in list(self.series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                yield f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{format_labels(self.labelnames, labels)} {count}"
+
+
+class Gauge:
+    """Read at scrape time from a callback, so nothing is paid between scrapes.
+
+    `kind="counter"` exposes a counter some other object already keeps.
+    """
+
+    def __init__(self, name: str, help: str, fn: Callable[[], GaugeValue], labelnames: Sequence[str] = (),
+                 kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        value = self.fn()
+        if isinstance(value, dict):
+            for labels, v in value.items():
+                yield f"{self.name}{format_labels(self.labelnames, labels)} {v}"
+        else:
+            yield f"{self.name} {value}"
+
+
+class MetricsRegistry:
+    """Process-wide metrics rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Union[Counter, Histogram, Gauge]] = {}
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], GaugeValue], labelnames: Sequence[str] = (),
+              kind: str = "gauge") -> Gauge:
+        self._metrics[name] = Gauge(name, help, fn, labelnames, kind)
+        return self._metrics[name]
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                print(f"[METRICS] Failed to render {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+handler_seconds = metrics.histogram(
+    "zerochat_socketio_handler_seconds", "Socket.IO event handler latency", ("event",))
+handler_errors = metrics.counter(
+    "zerochat_socketio_handler_errors_total", "Socket.IO event handlers that raised", ("event",))
+slow_handlers_total = metrics.counter(
+    "zerochat_socketio_slow_handlers_total", "Handlers slower than SLOW_HANDLER_MS", ("event",))
+emits_total = metrics.counter(
+    "zerochat_socketio_emits_total", "Socket.IO emits by event", ("event",))
+emit_recipients_total = metrics.counter(
+    "zerochat_socketio_emit_recipients_total", "Sockets on this worker targeted by emits, by event", ("event",))
+loop_lag_seconds = metrics.histogram(
+    "zerochat_event_loop_lag_seconds", "How late the event loop ran a timer",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+
+class MeteredAsyncServer(socketio.AsyncServer):
+    """AsyncServer that times every handled event and counts emit fan-out.
+
+    Handlers also run under `handler_tracer`, which logs slow ones with the
+    spans (storage, worker pools, emits) they spent their time in.
+    """
+
+    async def _trigger_event(self, event, namespace, *args):
+        # Only events with a handler get a label, so clients cannot inflate cardinality
+        if event not in self.handlers.get(namespace, {}):
+            return await super()._trigger_event(event, namespace, *args)
+        token = handler_tracer.begin()
+        started = time.perf_counter()
+        try:
+            return await super()._trigger_event(event, namespace, *args)
+        except Exception:
+            handler_errors.inc(event)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            handler_seconds.observe(elapsed, event)
+            if handler_tracer.end(token, event, elapsed):
+                slow_handlers_total.inc(event)
+
+    async def emit(self, event, data=None, to=None, room=None, skip_sid=None, namespace=None, callback=None,
+                   ignore_queue=False):
+        target = to or room
+        emits_total.inc(event)
+        emit_recipients_total.inc(event, amount=self.local_recipients(namespace or '/', target))
+        with span(f"emit.{event}"):
+            await super().emit(event, data, to=to, room=room, skip_sid=skip_sid, namespace=namespace,
+                               callback=callback, ignore_queue=ignore_queue)
+
+    def local_recipients(self, namespace: str, room: Optional[str]) -> int:
+        # Every socket is also in the None room, which is what a broadcast targets
+        participants = self.manager.rooms.get(namespace, {}).get(room)
+        return len(participants) if participants is not None else 0
+
+
+class LoopLagMonitor:
+    """Samples event-loop lag by timing a short sleep, like the expiry ticker."""
+
+    def __init__(self, interval_ms: int = METRICS_LAG_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.last = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, loop.time() - started - self.interval)
+            loop_lag_seconds.observe(self.last)
+
+
+loop_lag_monitor = LoopLagMonitor()
+metrics.gauge("zerochat_event_loop_lag_last_seconds", "Most recent event-loop lag sample", lambda: loop_lag_monitor.last)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean, Integer, Text, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, String, Boolean, Integer, Text, DateTime, ForeignKey, Enum, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -24,6 +24,12 @@ class Room(Base):
     
 class Message(Base):
     __tablename__ = "messages"
+    # History loads and keyset pages filter on room and walk back by (timestamp, id)
+    __table_args__ = (
+        Index("ix_messages_room_timestamp_id", "room_id", "timestamp", "id"),
+        # Startup re-arms self-destruct timers from a range scan over this
+        Index("ix_messages_expires_at", "expires_at"),
+    )
     
     id = Column(String(36), primary_key=True)
     room_id = Column(String(36), ForeignKey("rooms.id"), nullable=False)
@@ -33,6 +39,7 @@ class Message(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
     is_system = Column(Boolean, default=False)
     ttl_seconds = Column(Integer, nullable=True)  # Self-destruct timer
+    expires_at = Column(DateTime, nullable=True)  # timestamp + ttl_seconds, for self-destructing messages
     signature = Column(Text, nullable=True)  # Digital signature for verification
     public_key = Column(Text, nullable=True)  # Sender's public key
     verified = Column(Boolean, default=False)  # Server-side signature verification result
@@ -41,22 +48,78 @@ class Message(Base):
 
 class FileShare(Base):
     __tablename__ = "file_shares"
+    __table_args__ = (
+        Index("ix_file_shares_room_timestamp", "room_id", "timestamp"),
+        # Whether any persistent room still shares a blob
+        Index("ix_file_shares_blob_id", "blob_id"),
+    )
     
     id = Column(String(36), primary_key=True)
     room_id = Column(String(36), ForeignKey("rooms.id"), nullable=False)
     user_id = Column(String(36), nullable=False)
     username = Column(String(255), nullable=False)
     filename = Column(String(255), nullable=False)
-    encrypted_data = Column(Text, nullable=False)  # Base64 encrypted file
+    encrypted_data = Column(Text, nullable=True)  # Base64 encrypted file (legacy inline uploads)
+    blob_id = Column(String(64), nullable=True)  # Content address in the on-disk blob store
     mime_type = Column(String(100), nullable=False)
     file_size = Column(Integer, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
     signature = Column(Text, nullable=True)
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 import os
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./zerochat.db")
-engine = create_engine(DATABASE_URL)
+# Per engine; the write-behind thread holds one connection, reads take the rest
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+# Async drivers for the URLs this app is deployed with
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg", "postgres": "postgresql+asyncpg"}
+
+def async_url(url: str) -> str:
+    """The same database through its asyncio driver (aiosqlite / asyncpg)."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    return parsed.set(drivername=ASYNC_DRIVERS.get(backend, parsed.drivername)).render_as_string(hide_password=False)
+
+def engine_options(url: str) -> dict:
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite":
+        # In-memory SQLite lives in a single connection; file databases get a normal pool
+        if parsed.database in (None, "", ":memory:"):
+            return {}
+        return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True
+    }
+
+def tune_sqlite(dbapi_connection, connection_record):
+    # WAL lets readers run while the write-behind thread commits; NORMAL is durable across app crashes
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Reads made from the event loop go through the async engine
+async_engine = create_async_engine(async_url(DATABASE_URL), **engine_options(DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", tune_sqlite)
+    event.listen(async_engine.sync_engine, "connect", tune_sqlite)
@@ -0,0 +1,27 @@
+import os
+from passlib.hash import bcrypt
+from app.workers import WorkerPool, WorkerPoolBusy
+
+PASSPHRASE_WORKERS = int(os.environ.get("PASSPHRASE_WORKERS", 4))
+PASSPHRASE_QUEUE_LIMIT = int(os.environ.get("PASSPHRASE_QUEUE_LIMIT", 64))
+
+# Re-exported so callers only need this module to handle overload
+PassphraseServiceBusy = WorkerPoolBusy
+
+
+class PassphraseService:
+    """Bcrypt hashing/verification that never blocks the event loop."""
+
+    def __init__(self, max_workers: int = PASSPHRASE_WORKERS, max_queue: int = PASSPHRASE_QUEUE_LIMIT):
+        self.pool = WorkerPool("bcrypt", max_workers, max_queue)
+
+    async def hash(self, passphrase: str) -> str:
+        return await self.pool.run(bcrypt.hash, passphrase)
+
+    async def verify(self, passphrase: str, passphrase_hash: str) -> bool:
+        if not passphrase or not passphrase_hash:
+            return False
+        return await self.pool.run(bcrypt.verify, passphrase, passphrase_hash)
+
+
+passphrase_service = PassphraseService()
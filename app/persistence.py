@@ -0,0 +1,232 @@
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.metrics import metrics
+
+PERSIST_QUEUE_SIZE = int(os.environ.get("PERSIST_QUEUE_SIZE", 10000))
+PERSIST_BATCH_SIZE = int(os.environ.get("PERSIST_BATCH_SIZE", 500))
+PERSIST_FLUSH_INTERVAL_MS = int(os.environ.get("PERSIST_FLUSH_INTERVAL_MS", 50))
+
+
+flush_seconds = metrics.histogram("zerochat_db_flush_seconds", "Time to commit one write-behind batch")
+write_delay_seconds = metrics.histogram(
+    "zerochat_db_write_delay_seconds", "Time from queueing the oldest write in a batch to its commit")
+batch_sizes = metrics.histogram(
+    "zerochat_db_flush_batch_size", "Writes committed per batch", buckets=(1, 5, 10, 50, 100, 250, 500, 1000))
+
+
+class PersistenceQueueFull(Exception):
+    """Raised when the write-behind queue cannot accept more work."""
+
+
+class WriteOp:
+    """A queued database write: either a row insert or an arbitrary session call.
+
+    Calls that write outside the session (segment log appends) are not
+    transactional: a rollback cannot undo them, so once applied they are
+    not run again when a failed batch is retried op by op.
+    """
+
+    __slots__ = ('model', 'row', 'fn', 'key', 'transactional', 'applied', 'queued_at')
+
+    def __init__(self, model=None, row: Optional[dict] = None, fn: Optional[Callable[[Session], None]] = None,
+                 key: Optional[str] = None, transactional: bool = True):
+        self.model = model
+        self.row = row
+        self.fn = fn
+        self.key = key
+        self.transactional = transactional
+        self.applied = False
+        self.queued_at = time.monotonic()
+
+    def apply(self, db: Session):
+        if self.fn is not None:
+            self.fn(db)
+            self.applied = not self.transactional
+        else:
+            db.execute(insert(self.model), [self.row])
+
+
+class WriteBehindQueue:
+    """Background writer that group-commits persistence operations.
+
+    Callers enqueue writes and return immediately; a single writer thread
+    drains the queue and commits everything it collected in one transaction
+    once `batch_size` ops are pending or `flush_interval` has elapsed.
+    Operations are applied in submission order, so a purge queued after a
+    batch of inserts always sees those rows.
+    """
+
+    def __init__(self, max_size: int = PERSIST_QUEUE_SIZE, batch_size: int = PERSIST_BATCH_SIZE,
+                 flush_interval_ms: int = PERSIST_FLUSH_INTERVAL_MS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self._queue: "queue.Queue[Optional[WriteOp]]" = queue.Queue(maxsize=max_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # Unflushed ops per key (room id), so callers can tell when a room is fully on disk
+        self._pending: Dict[str, int] = {}
+        # Runs on the writer thread after each batch, before its ops count as flushed
+        self.on_flush: Optional[Callable[[], None]] = None
+
+        self.enqueued = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="persistence-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        """Flush everything still queued and stop the writer thread."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def insert(self, model, row: dict, key: Optional[str] = None):
+        self._submit(WriteOp(model=model, row=row, key=key))
+
+    def call(self, fn: Callable[[Session], None], key: Optional[str] = None, transactional: bool = True):
+        self._submit(WriteOp(fn=fn, key=key, transactional=transactional))
+
+    def pending_for(self, key: str) -> int:
+        return self._pending.get(key, 0)
+
+    def _submit(self, op: WriteOp):
+        if self._thread is None:
+            self.start()
+        # Count the op as pending before the writer can possibly settle it
+        if op.key is not None:
+            with self._lock:
+                self._pending[op.key] = self._pending.get(op.key, 0) + 1
+        try:
+            self._queue.put_nowait(op)
+        except queue.Full:
+            self.rejected += 1
+            self._settle([op])
+            raise PersistenceQueueFull("persistence queue is full")
+        self.enqueued += 1
+
+    def _settle(self, batch: List[WriteOp]):
+        with self._lock:
+            for op in batch:
+                if op.key is None:
+                    continue
+                remaining = self._pending.get(op.key, 0) - 1
+                if remaining > 0:
+                    self._pending[op.key] = remaining
+                else:
+                    self._pending.pop(op.key, None)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            op = self._queue.get()
+            stopping = op is None
+            batch: List[WriteOp] = [] if stopping else [op]
+
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = 0 if stopping else deadline - time.monotonic()
+                try:
+                    op = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if op is None:
+                    stopping = True
+                    continue
+                batch.append(op)
+
+            if batch:
+                self._flush(batch)
+            if stopping and self._queue.empty():
+                return
+
+    def _flush(self, batch: List[WriteOp]):
+        start = time.perf_counter()
+        db = SessionLocal()
+        try:
+            try:
+                self._apply(db, batch)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                print(f"[DB] Batch of {len(batch)} writes failed, retrying individually: {e}")
+                for op in batch:
+                    if op.applied:
+                        continue
+                    try:
+                        op.apply(db)
+                        db.commit()
+                    except Exception as op_error:
+                        db.rollback()
+                        self.failures += 1
+                        print(f"[DB] Dropped write: {op_error}")
+            if self.on_flush is not None:
+                try:
+                    self.on_flush()
+                except Exception as e:
+                    print(f"[DB] Post-flush hook failed: {e}")
+        finally:
+            db.close()
+            self._settle(batch)
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        flush_seconds.observe(elapsed_ms / 1000)
+        write_delay_seconds.observe(time.monotonic() - batch[0].queued_at)
+        batch_sizes.observe(len(batch))
+        self.flushed += len(batch)
+        self.batches += 1
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+
+    def _apply(self, db: Session, batch: List[WriteOp]):
+        # Consecutive inserts into the same table go out as one executemany
+        pending_model = None
+        pending_rows: List[dict] = []
+        for op in batch:
+            if op.fn is None and op.model is pending_model:
+                pending_rows.append(op.row)
+                continue
+            if pending_rows:
+                db.execute(insert(pending_model), pending_rows)
+            pending_model, pending_rows = None, []
+            if op.fn is None:
+                pending_model, pending_rows = op.model, [op.row]
+            else:
+                op.apply(db)
+        if pending_rows:
+            db.execute(insert(pending_model), pending_rows)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'depth': self.depth,
+            'enqueued': self.enqueued,
+            'rejected': self.rejected,
+            'flushed': self.flushed,
+            'batches': self.batches,
+            'failures': self.failures,
+            'last_flush_ms': round(self.last_flush_ms, 3),
+            'max_flush_ms': round(self.max_flush_ms, 3),
+            'avg_flush_ms': round(self.total_flush_ms / self.batches, 3) if self.batches else 0.0
+        }
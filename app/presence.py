@@ -0,0 +1,113 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+TYPING_FLUSH_MS = int(os.environ.get("TYPING_FLUSH_MS", 500))
+TYPING_TIMEOUT_MS = int(os.environ.get("TYPING_TIMEOUT_MS", 3000))
+TYPING_EVENTS_PER_SEC = float(os.environ.get("TYPING_EVENTS_PER_SEC", 2))
+TYPING_BURST = float(os.environ.get("TYPING_BURST", 4))
+
+FlushCallback = Callable[[str, List[dict]], Awaitable[None]]
+
+
+class TypingAggregator:
+    """Collects who is typing per room and publishes one snapshot per interval.
+
+    `touch` only records a deadline; a single loop wakes every flush
+    interval, drops typists whose deadline passed and hands the current
+    list to the callback for each room whose set of typists changed. A
+    room full of people typing therefore costs at most one broadcast per
+    interval, and nothing at all while the set stays the same.
+    """
+
+    def __init__(self, flush_ms: int = TYPING_FLUSH_MS, timeout_ms: int = TYPING_TIMEOUT_MS):
+        self.flush_interval = flush_ms / 1000
+        self.timeout = timeout_ms / 1000
+        # Room id -> {user id: (username, typing until)}
+        self._typing: Dict[str, Dict[str, Tuple[str, float]]] = {}
+        self._dirty: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._on_flush: Optional[FlushCallback] = None
+        # Called as observer(op, *args) after each change (see app.cluster)
+        self.observer: Optional[Callable[..., None]] = None
+
+        self.touches = 0
+        self.flushes = 0
+
+    def touch(self, room_id: str, user_id: str, username: str):
+        typists = self._typing.setdefault(room_id, {})
+        if user_id not in typists:
+            self._dirty.add(room_id)
+        typists[user_id] = (username, time.monotonic() + self.timeout)
+        self.touches += 1
+        self._notify('touch', room_id, user_id, username)
+
+    def clear(self, room_id: str, user_id: str):
+        typists = self._typing.get(room_id)
+        if typists and typists.pop(user_id, None):
+            self._dirty.add(room_id)
+            if not typists:
+                del self._typing[room_id]
+            self._notify('clear', room_id, user_id)
+
+    def users(self, room_id: str) -> List[dict]:
+        return [{'userId': user_id, 'username': username}
+                for user_id, (username, _) in self._typing.get(room_id, {}).items()]
+
+    def collect(self, at: float) -> Dict[str, List[dict]]:
+        """Expire stale typists and return the snapshot of every room that changed."""
+        for room_id in list(self._typing):
+            typists = self._typing[room_id]
+            expired = [user_id for user_id, (_, until) in typists.items() if until <= at]
+            for user_id in expired:
+                del typists[user_id]
+            if expired:
+                self._dirty.add(room_id)
+            if not typists:
+                del self._typing[room_id]
+
+        changed = {room_id: self.users(room_id) for room_id in self._dirty}
+        self._dirty.clear()
+        return changed
+
+    def apply_replicated(self, op: str, *args):
+        observer, self.observer = self.observer, None
+        try:
+            getattr(self, op)(*args)
+        finally:
+            self.observer = observer
+
+    def start(self, on_flush: FlushCallback):
+        self._on_flush = on_flush
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _notify(self, op: str, *args):
+        if self.observer:
+            self.observer(op, *args)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            for room_id, users in self.collect(time.monotonic()).items():
+                self.flushes += 1
+                try:
+                    await self._on_flush(room_id, users)
+                except Exception as e:
+                    print(f"[TYPING] Failed to publish typing state for room {room_id}: {e}")
+
+    def __len__(self) -> int:
+        return sum(len(typists) for typists in self._typing.values())
+
+
+typing_aggregator = TypingAggregator()
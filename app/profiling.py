@@ -0,0 +1,188 @@
+import asyncio
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Handlers slower than this are logged with a breakdown of their spans; 0 turns tracing off
+SLOW_HANDLER_MS = float(os.environ.get("SLOW_HANDLER_MS", 500))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "./profiles")
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 5))
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", 300))
+# Length of a profile started with SIGUSR2
+PROFILE_SIGNAL_SECONDS = float(os.environ.get("PROFILE_SIGNAL_SECONDS", 30))
+
+# Span name -> [seconds, calls] for the handler running in this context, if it is being traced
+_spans: ContextVar[Optional[Dict[str, list]]] = ContextVar("zerochat_spans", default=None)
+
+
+def _record(spans: Dict[str, list], name: str, started: float):
+    entry = spans.get(name)
+    if entry is None:
+        entry = spans[name] = [0.0, 0]
+    entry[0] += time.perf_counter() - started
+    entry[1] += 1
+
+
+class span:
+    """Time a block as part of the current handler's trace; free when nothing is traced."""
+
+    __slots__ = ("name", "spans", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.spans = _spans.get()
+        if self.spans is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.spans is not None:
+            _record(self.spans, self.name, self.started)
+        return False
+
+
+def traced(name: str):
+    """Decorator form of `span` for plain and async functions."""
+    def wrap(fn: Callable):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def run_async(*args, **kwargs):
+                spans = _spans.get()
+                if spans is None:
+                    return await fn(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    _record(spans, name, started)
+            return run_async
+
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            spans = _spans.get()
+            if spans is None:
+                return fn(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(spans, name, started)
+        return run
+    return wrap
+
+
+def instrument(cls, prefix: str, names: Iterable[str]):
+    """Wrap the named methods of `cls` (inherited ones included) in spans called prefix.name."""
+    for name in names:
+        setattr(cls, name, traced(f"{prefix}.{name}")(getattr(cls, name)))
+
+
+class HandlerTracer:
+    """Collects spans for each Socket.IO handler and logs the slow ones.
+
+    `begin` gives the handler's task a fresh span table (tasks it starts
+    inherit it); `end` logs the handler with its breakdown if it ran for
+    at least `slow_ms`. Spans overlap when they nest or run concurrently,
+    so the parts need not add up to the total.
+    """
+
+    def __init__(self, slow_ms: float = SLOW_HANDLER_MS):
+        self.slow_ms = slow_ms
+        self.slow = 0
+
+    def begin(self):
+        return _spans.set({}) if self.slow_ms > 0 else None
+
+    def end(self, token, event: str, seconds: float) -> bool:
+        if token is None:
+            return False
+        spans = _spans.get()
+        _spans.reset(token)
+        if seconds * 1000 < self.slow_ms:
+            return False
+        self.slow += 1
+        parts = sorted(spans.items(), key=lambda item: item[1][0], reverse=True)
+        breakdown = ", ".join(f"{name} {total * 1000:.1f} ms" + (f" x{calls}" if calls > 1 else "")
+                              for name, (total, calls) in parts)
+        print(f"[SLOW] {event} took {seconds * 1000:.1f} ms ({breakdown or 'no spans'})")
+        return True
+
+
+def collapse(frame) -> List[str]:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running."""
+
+
+class SamplingProfiler:
+    """Samples every thread's stack at a fixed interval from a background thread.
+
+    Nothing runs between profiles. Output is one "thread;frame;frame count"
+    line per distinct stack (the collapsed format read by flamegraph.pl and
+    speedscope), written to PROFILE_DIR when the profile ends.
+    """
+
+    def __init__(self, directory: str = PROFILE_DIR, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.directory = directory
+        self.interval = interval_ms / 1000
+        self._thread: Optional[threading.Thread] = None
+        self.last_path: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float) -> str:
+        if self.running:
+            raise ProfilerBusy("a profile is already running")
+        seconds = max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"zerochat-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        self._thread = threading.Thread(target=self._run, args=(seconds, path), name="profiler", daemon=True)
+        self._thread.start()
+        print(f"[PROFILE] Sampling every {self.interval * 1000:g} ms for {seconds:g}s into {path}")
+        return path
+
+    def _run(self, seconds: float, path: str):
+        me = threading.get_ident()
+        stacks: Counter = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    stacks[";".join([names.get(ident, str(ident))] + collapse(frame))] += 1
+            samples += 1
+            time.sleep(self.interval)
+
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self.last_path = path
+        print(f"[PROFILE] Wrote {samples} samples ({len(stacks)} distinct stacks) to {path}")
+
+    def start_from_signal(self):
+        try:
+            self.start(PROFILE_SIGNAL_SECONDS)
+        except ProfilerBusy:
+            print("[PROFILE] Already running; signal ignored")
+
+
+handler_tracer = HandlerTracer()
+profiler = SamplingProfiler()
@@ -0,0 +1,150 @@
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+class ConnectionRegistry:
+    """Connected users indexed by user id, socket id, room and username.
+
+    Every mutation updates all indexes together (there are no awaits in
+    here), so lookups from any direction are O(1) and listing a room costs
+    O(room size) rather than O(users on the server).
+    """
+
+    def __init__(self):
+        self.users: Dict[str, dict] = {}
+        self.sid_to_user: Dict[str, str] = {}
+        self.user_to_sid: Dict[str, str] = {}
+        # Room id -> {user id: user data}, in join order
+        self.room_users: Dict[str, Dict[str, dict]] = {}
+        # Room id -> {username: user id}
+        self.room_usernames: Dict[str, Dict[str, str]] = {}
+        # Room id -> membership version, bumped on every join and leave
+        self.room_versions: Dict[str, int] = {}
+        # Called as observer(op, *args) after each mutation (see app.cluster)
+        self.observer: Optional[Callable[..., None]] = None
+
+    def add_user(self, sid: Optional[str], user_data: dict) -> dict:
+        user_id = user_data['id']
+        room_id = user_data['room_id']
+        self._discard(user_id)
+
+        self.users[user_id] = user_data
+        if sid is not None:
+            self.sid_to_user[sid] = user_id
+            self.user_to_sid[user_id] = sid
+        self.room_users.setdefault(room_id, {})[user_id] = user_data
+        self.room_usernames.setdefault(room_id, {})[user_data['username']] = user_id
+        self._bump(room_id)
+        self._notify('add_user', sid, user_data)
+        return user_data
+
+    def detach(self, sid: str) -> Optional[dict]:
+        """Forget a socket but keep its user in the room (see app.sessions)."""
+        user_id = self.sid_to_user.pop(sid, None)
+        if user_id is None:
+            return None
+        if self.user_to_sid.get(user_id) == sid:
+            del self.user_to_sid[user_id]
+        self._notify('detach', sid)
+        return self.users.get(user_id)
+
+    def attach(self, sid: str, user_id: str) -> Optional[dict]:
+        """Point an existing user at a new socket, releasing the old one."""
+        user_data = self.users.get(user_id)
+        if user_data is None:
+            return None
+        old_sid = self.user_to_sid.get(user_id)
+        if old_sid is not None:
+            self.sid_to_user.pop(old_sid, None)
+        self.user_to_sid[user_id] = sid
+        self.sid_to_user[sid] = user_id
+        self._notify('attach', sid, user_id)
+        return user_data
+
+    def is_attached(self, user_id: str) -> bool:
+        return user_id in self.user_to_sid
+
+    def get_user(self, user_id: str) -> Optional[dict]:
+        return self.users.get(user_id)
+
+    def get_user_by_sid(self, sid: str) -> Optional[dict]:
+        user_id = self.sid_to_user.get(sid)
+        return self.users.get(user_id) if user_id else None
+
+    def get_sid(self, user_id: str) -> Optional[str]:
+        return self.user_to_sid.get(user_id)
+
+    def get_users_by_room(self, room_id: str) -> List[dict]:
+        return list(self.room_users.get(room_id, {}).values())
+
+    def room_version(self, room_id: str) -> int:
+        return self.room_versions.get(room_id, 0)
+
+    def room_size(self, room_id: str) -> int:
+        return len(self.room_users.get(room_id, ()))
+
+    def username_owner(self, room_id: str, username: str) -> Optional[str]:
+        return self.room_usernames.get(room_id, {}).get(username)
+
+    def remove_user(self, user_id: str) -> Optional[dict]:
+        user_data = self._discard(user_id)
+        if user_data:
+            self._bump(user_data['room_id'])
+            self._notify('remove_user', user_id)
+        return user_data
+
+    def remove_users(self, user_ids: Iterable[str]) -> List[dict]:
+        """Remove many users at once: one version bump per room and one notification."""
+        removed = [user_data for user_data in map(self._discard, user_ids) if user_data]
+        for room_id in {user_data['room_id'] for user_data in removed}:
+            self._bump(room_id)
+        if removed:
+            self._notify('remove_users', [user_data['id'] for user_data in removed])
+        return removed
+
+    def _discard(self, user_id: str) -> Optional[dict]:
+        user_data = self.users.pop(user_id, None)
+        if not user_data:
+            return None
+
+        sid = self.user_to_sid.pop(user_id, None)
+        if sid is not None:
+            self.sid_to_user.pop(sid, None)
+
+        room_id = user_data['room_id']
+        members = self.room_users.get(room_id)
+        if members is not None:
+            members.pop(user_id, None)
+            if not members:
+                del self.room_users[room_id]
+        usernames = self.room_usernames.get(room_id)
+        if usernames is not None:
+            if usernames.get(user_data['username']) == user_id:
+                del usernames[user_data['username']]
+            if not usernames:
+                del self.room_usernames[room_id]
+        return user_data
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def apply_replicated(self, op: str, *args):
+        """Apply a membership change made by another worker without re-announcing it."""
+        observer, self.observer = self.observer, None
+        try:
+            return getattr(self, op)(*args)
+        finally:
+            self.observer = observer
+
+    def _bump(self, room_id: str):
+        if room_id in self.room_users:
+            self.room_versions[room_id] = self.room_versions.get(room_id, 0) + 1
+        else:
+            # Nobody left to hold a stale view; the next member starts from a snapshot
+            self.room_versions.pop(room_id, None)
+
+    def _notify(self, op: str, *args):
+        if self.observer:
+            self.observer(op, *args)
+
+
+registry = ConnectionRegistry()
@@ -0,0 +1,98 @@
+import asyncio
+import contextvars
+import os
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Tuple, TypeVar
+
+# Jobs a room may have waiting before new ones are turned away as busy
+ROOM_MAILBOX_SIZE = int(os.environ.get("ROOM_MAILBOX_SIZE", 256))
+
+T = TypeVar("T")
+Job = Callable[[], Awaitable[T]]
+Entry = Tuple[Job, asyncio.Future, contextvars.Context]
+
+
+class RoomBusy(Exception):
+    """Raised when a room's mailbox is full."""
+
+
+class RoomExecutor:
+    """Runs each room's state-changing work one job at a time, in arrival order.
+
+    A room gets a mailbox and a worker task when its first job arrives;
+    both go away once the mailbox is empty, so idle rooms cost nothing.
+    Different rooms' workers interleave freely. Each worker yields to the
+    event loop between jobs, so a hot room takes turns with the others
+    instead of running its whole backlog at once, and a mailbox holding
+    ROOM_MAILBOX_SIZE jobs rejects more with `RoomBusy`.
+
+    Each job runs in its own task, in a copy of the context it was
+    submitted from, so per-handler context variables (profiling spans)
+    follow the job rather than whichever handler started the worker.
+
+    Jobs should do their slow, stateless work (bcrypt, signature checks)
+    before being submitted, and re-check what that work assumed once they
+    run.
+    """
+
+    def __init__(self, mailbox_size: int = ROOM_MAILBOX_SIZE):
+        self.mailbox_size = mailbox_size
+        self._mailboxes: Dict[str, Deque[Entry]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self.executed = 0
+        self.rejected = 0
+
+    def submit(self, room_id: str, job: Job) -> asyncio.Future:
+        mailbox = self._mailboxes.get(room_id)
+        if mailbox is None:
+            mailbox = self._mailboxes[room_id] = deque()
+            self._workers[room_id] = asyncio.create_task(self._drain(room_id, mailbox))
+        elif len(mailbox) >= self.mailbox_size:
+            self.rejected += 1
+            raise RoomBusy(f"room {room_id} has {len(mailbox)} jobs waiting")
+        future = asyncio.get_running_loop().create_future()
+        mailbox.append((job, future, contextvars.copy_context()))
+        return future
+
+    async def run(self, room_id: str, job: Job) -> T:
+        """Run `job` once the room's earlier jobs are done and return its result (may raise RoomBusy)."""
+        if asyncio.current_task() is self._running.get(room_id):
+            # Already inside this room's running job: queueing would wait on ourselves. Tasks a
+            # job spawns are not that job, so they queue like everyone else.
+            return await job()
+        return await self.submit(room_id, job)
+
+    async def _drain(self, room_id: str, mailbox: Deque[Entry]):
+        try:
+            while mailbox:
+                job, future, context = mailbox.popleft()
+                if future.cancelled():
+                    continue
+                task = self._running[room_id] = asyncio.create_task(job(), context=context)
+                try:
+                    result = await task
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                self.executed += 1
+                await asyncio.sleep(0)
+        finally:
+            # Only left non-empty if this worker was cancelled
+            for _, future, _ in mailbox:
+                future.cancel()
+            self._running.pop(room_id, None)
+            del self._mailboxes[room_id]
+            del self._workers[room_id]
+
+    def queued(self) -> int:
+        return sum(len(mailbox) for mailbox in self._mailboxes.values())
+
+    def __len__(self) -> int:
+        return len(self._workers)
+
+
+room_executor = RoomExecutor()
@@ -0,0 +1,38 @@
+import os
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, Query
+from app.profiling import handler_tracer, profiler, ProfilerBusy, PROFILE_MAX_SECONDS
+
+# Operator endpoints are disabled unless this is set; callers send "Authorization: Bearer <token>"
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+router = APIRouter()
+
+def require_admin(authorization: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if authorization != f"Bearer {ADMIN_TOKEN}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+@router.post("/admin/profile", status_code=202)
+async def start_profile(seconds: float = Query(30, gt=0, le=PROFILE_MAX_SECONDS),
+                        authorization: Optional[str] = Header(default=None)):
+    """Sample this worker's stacks for `seconds`; the collapsed-stack file appears at `path` when done."""
+    require_admin(authorization)
+    try:
+        path = profiler.start(seconds)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return {"path": path, "seconds": seconds, "pid": os.getpid()}
+
+@router.get("/admin/profile")
+async def profile_status(authorization: Optional[str] = Header(default=None)):
+    require_admin(authorization)
+    return {"running": profiler.running, "lastPath": profiler.last_path}
+
+@router.put("/admin/slow-handlers")
+async def set_slow_threshold(ms: float = Query(..., ge=0), authorization: Optional[str] = Header(default=None)):
+    """Change the slow-handler log threshold at runtime; 0 stops tracing."""
+    require_admin(authorization)
+    handler_tracer.slow_ms = ms
+    return {"slowHandlerMs": ms, "slowHandlers": handler_tracer.slow}
@@ -0,0 +1,12 @@
+from fastapi import APIRouter, HTTPException, Request
+from app.assets import asset_pipeline
+
+router = APIRouter()
+
+@router.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+async def static_file(path: str, request: Request):
+    """Prebuilt static files; fingerprinted paths (see `asset_url`) are cached forever."""
+    response = asset_pipeline.static(path, request)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return response
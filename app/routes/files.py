@@ -0,0 +1,41 @@
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import FileResponse
+from app.storage import memory_storage
+from app.blobstore import blob_store, BlobTooLarge
+from app.routes.rooms import require_member
+
+router = APIRouter()
+
+@router.post("/rooms/{room_id}/blobs")
+async def upload_blob(room_id: str, request: Request, authorization: Optional[str] = Header(default=None)):
+    """Stream an encrypted file into the blob store; share it afterwards via `share_file`."""
+    user = require_member(room_id, authorization)
+
+    try:
+        blob_id, size = await blob_store.write_stream(request.stream())
+    except BlobTooLarge:
+        raise HTTPException(status_code=413, detail="File too large")
+    # Only its uploader can share it, and only until the upload sweep deletes it unshared
+    blob_store.record_upload(blob_id, room_id, user['id'])
+
+    return {"blobId": blob_id, "size": size}
+
+@router.get("/rooms/{room_id}/blobs/{blob_id}")
+async def download_blob(room_id: str, blob_id: str, authorization: Optional[str] = Header(default=None)):
+    require_member(room_id, authorization)
+
+    if not memory_storage.room_has_blob(room_id, blob_id):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    path = blob_store.path_for(blob_id)
+    if not path or blob_store.size(blob_id) is None:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    # Content-addressed, so the bytes behind a blob id never change; FileResponse
+    # answers Range requests, which lets clients resume interrupted downloads
+    return FileResponse(
+        path,
+        media_type="application/octet-stream",
+        headers={"Cache-Control": "private, max-age=31536000, immutable"}
+    )
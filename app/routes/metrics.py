@@ -0,0 +1,85 @@
+import os
+from typing import Dict, Optional
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from app.metrics import metrics
+from app.storage import memory_storage
+from app.registry import registry
+from app.expiry import expiry_scheduler
+from app.passphrase import passphrase_service
+from app.crypto_utils import signature_pool
+from app.presence import typing_aggregator
+from app.sessions import sessions
+from app.cluster import cluster
+from app.room_executor import room_executor
+from app.routes.websocket import sio
+
+# When set, scrapers must send "Authorization: Bearer <token>"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+router = APIRouter()
+
+def by_storage_mode(measure) -> Dict[tuple, float]:
+    totals = {('ephemeral',): 0, ('persistent',): 0}
+    for room_id, room in list(memory_storage.rooms.items()):
+        mode = 'persistent' if room.get('storage_mode') == 'persistent' else 'ephemeral'
+        totals[(mode,)] += measure(room_id)
+    return totals
+
+def history_messages(room_id: str) -> int:
+    store = memory_storage.messages.get(room_id)
+    return len(store) if store is not None else 0
+
+def history_bytes(room_id: str) -> int:
+    store = memory_storage.messages.get(room_id)
+    return store.bytes if store is not None else 0
+
+metrics.gauge("zerochat_connected_sockets", "Engine.IO connections on this worker", lambda: len(sio.eio.sockets))
+metrics.gauge("zerochat_outbound_queue_max_packets", "Longest Engine.IO send queue of any client on this worker",
+              lambda: sio.max_queue_depth())
+metrics.gauge("zerochat_users", "Room members; detached ones are inside their resume grace period",
+              lambda: {('attached',): len(registry.user_to_sid),
+                       ('detached',): len(registry) - len(registry.user_to_sid)}, ("state",))
+metrics.gauge("zerochat_rooms", "Rooms held in memory", lambda: by_storage_mode(lambda room_id: 1), ("storage",))
+metrics.gauge("zerochat_history_messages", "Messages held in memory",
+              lambda: by_storage_mode(history_messages), ("storage",))
+metrics.gauge("zerochat_history_bytes", "Approximate bytes of message history held in memory",
+              lambda: by_storage_mode(history_bytes), ("storage",))
+metrics.gauge("zerochat_hydrated_rooms", "Persistent rooms loaded from the database", lambda: len(memory_storage.lru))
+
+metrics.gauge("zerochat_db_write_queue_depth", "Writes waiting for the write-behind queue",
+              lambda: memory_storage.writer.depth)
+metrics.gauge("zerochat_db_writes_total", "Writes by outcome",
+              lambda: {('flushed',): memory_storage.writer.flushed,
+                       ('failed',): memory_storage.writer.failures,
+                       ('rejected',): memory_storage.writer.rejected}, ("outcome",), kind="counter")
+
+metrics.gauge("zerochat_ttl_timers_pending", "Self-destruct timers not yet due", lambda: len(expiry_scheduler))
+metrics.gauge("zerochat_ttl_expired_total", "Messages deleted by the expiry scheduler",
+              lambda: expiry_scheduler.expired, kind="counter")
+
+metrics.gauge("zerochat_worker_pool_in_flight", "Jobs running or queued in a worker pool",
+              lambda: {('bcrypt',): passphrase_service.pool.in_flight,
+                       ('ed25519',): signature_pool.in_flight}, ("pool",))
+metrics.gauge("zerochat_worker_pool_rejected_total", "Jobs turned away as busy",
+              lambda: {('bcrypt',): passphrase_service.pool.rejected,
+                       ('ed25519',): signature_pool.rejected}, ("pool",), kind="counter")
+
+metrics.gauge("zerochat_room_executors_active", "Rooms with state changes running or waiting", lambda: len(room_executor))
+metrics.gauge("zerochat_room_mailbox_jobs", "State changes waiting in room mailboxes", lambda: room_executor.queued())
+metrics.gauge("zerochat_room_jobs_total", "Room state changes by outcome",
+              lambda: {('executed',): room_executor.executed,
+                       ('rejected',): room_executor.rejected}, ("outcome",), kind="counter")
+
+metrics.gauge("zerochat_typing_users", "Users currently shown as typing", lambda: len(typing_aggregator))
+metrics.gauge("zerochat_resume_tokens", "Outstanding session resumption tokens", lambda: len(sessions))
+metrics.gauge("zerochat_cluster_frames_total", "Broker frames by direction",
+              lambda: {('published',): cluster.broker.published if cluster.enabled else 0,
+                       ('received',): cluster.broker.received if cluster.enabled else 0}, ("direction",),
+              kind="counter")
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def scrape(authorization: Optional[str] = Header(default=None)):
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
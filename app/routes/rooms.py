@@ -1,8 +1,12 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
 from pydantic import BaseModel, Field
-from passlib.hash import bcrypt
+from typing import Optional
 import uuid
-from app.storage import memory_storage
+from app.storage import memory_storage, HISTORY_PAGE_SIZE, HISTORY_PAGE_MAX
+from app.passphrase import passphrase_service, PassphraseServiceBusy
+from app.persistence import PersistenceQueueFull
+from app.registry import registry
+from app.sessions import sessions
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models import Room, StorageMode
@@ -19,10 +23,35 @@ class VerifyRoomRequest(BaseModel):
     roomId: str
     passphrase: str
 
+def require_member(room_id: str, authorization: Optional[str]) -> dict:
+    """The caller's seat in the room, proven by the resume token of its session.
+    
+    Every member sees every other member's user id, so an id alone proves
+    nothing; the token is only known to its own client and dies when the
+    seat is given up or the room is rekeyed.
+    """
+    if not memory_storage.get_room(room_id):
+        raise HTTPException(status_code=404, detail="Room not found")
+    
+    token = authorization[len("Bearer "):] if authorization and authorization.startswith("Bearer ") else None
+    user_id = sessions.user_for(token)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Missing or expired session token")
+    user = registry.get_user(user_id)
+    if not user or user.get('room_id') != room_id:
+        raise HTTPException(status_code=403, detail="Not a member of this room")
+    return user
+
+def busy_error() -> HTTPException:
+    return HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+
 @router.post("/rooms/create")
 async def create_room(request: CreateRoomRequest, db: Session = Depends(get_db)):
     room_id = str(uuid.uuid4())
-    passphrase_hash = bcrypt.hash(request.passphrase)
+    try:
+        passphrase_hash = await passphrase_service.hash(request.passphrase)
+    except PassphraseServiceBusy:
+        raise busy_error()
     
     # DualStorage handles both memory and database storage
     room_data = {
@@ -32,18 +61,39 @@ async def create_room(request: CreateRoomRequest, db: Session = Depends(get_db))
         "created_by": request.createdBy,
         "storage_mode": request.storageMode
     }
-    memory_storage.create_room(room_id, room_data)
+    try:
+        memory_storage.create_room(room_id, room_data)
+    except PersistenceQueueFull:
+        raise busy_error()
     
     return {"roomId": room_id, "roomName": request.roomName}
 
 @router.post("/rooms/verify")
 async def verify_room(request: VerifyRoomRequest):
-    room = memory_storage.get_room(request.roomId)
+    room = await memory_storage.load_room(request.roomId)
     
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
     
-    if not bcrypt.verify(request.passphrase, room['passphrase_hash']):
+    try:
+        valid = await passphrase_service.verify(request.passphrase, room['passphrase_hash'])
+    except PassphraseServiceBusy:
+        raise busy_error()
+    
+    if not valid:
         return {"valid": False, "roomName": room['name']}
     
     return {"valid": True, "roomName": room['name']}
+
+@router.get("/rooms/{room_id}/messages")
+async def get_room_messages(
+    room_id: str,
+    before: Optional[str] = None,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_PAGE_MAX),
+    authorization: Optional[str] = Header(default=None)
+):
+    # History is only served to current members, who send "Authorization: Bearer <resumeToken>"
+    require_member(room_id, authorization)
+    
+    messages, cursor = await memory_storage.fetch_messages_page(room_id, before=before, limit=limit)
+    return {"messages": messages, "cursor": cursor}
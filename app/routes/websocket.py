@@ -1,35 +1,50 @@
-import socketio
-from passlib.hash import bcrypt
-from app.storage import memory_storage
+from app.storage import memory_storage, HISTORY_PAGE_SIZE, HISTORY_PAGE_MAX
+from app.message_store import parse_cursor
+from app.passphrase import passphrase_service, PassphraseServiceBusy
+from app.persistence import PersistenceQueueFull
+from app.registry import registry
+from app.expiry import expiry_scheduler
+from app.crypto_utils import public_keys, verify_payload, verify_file
+from app.blobstore import blob_store
+from app.workers import WorkerPoolBusy
+from app.cluster import cluster
+from app.presence import typing_aggregator
+from app.sessions import sessions
+from app.backpressure import BackpressureAsyncServer
+from app.wire import wire_room, to_binary
+from app.batcher import broadcast_batcher
+from app.room_executor import room_executor, RoomBusy
+from app.metrics import metrics
 from datetime import datetime
 import asyncio
-import base64
-from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
-from cryptography.hazmat.primitives import serialization
-from cryptography.exceptions import InvalidSignature
+import os
+import time
+import uuid
 
-sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+# How long members evicted by a passphrase change have to receive the notice before their sockets close
+REKEY_GRACE_MS = float(os.environ.get("REKEY_GRACE_MS", 200))
 
-# Store active connections
-clients = {}
+rekey_seconds = metrics.histogram(
+    "zerochat_rekey_seconds", "Passphrase change from the room update until every evicted socket is closed",
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+
+# With CLUSTER_BROKER set, emits reach clients connected to any worker
+# Inbound events are rate limited per socket and slow readers shed load (see app.backpressure).
+# Handlers do slow checks (bcrypt, signatures) first, then make their state changes
+# through the room's executor, one at a time per room (see app.room_executor)
+sio = BackpressureAsyncServer(async_mode='asgi', cors_allowed_origins='*', client_manager=cluster.manager)
 
 @sio.event
-async def connect(sid, environ):
+async def connect(sid, environ, auth=None):
     print(f"[WS] Client connected: {sid}")
 
 @sio.event
 async def disconnect(sid):
     print(f"[WS] Client disconnected: {sid}")
-    if sid in clients:
-        user_data = clients[sid]
-        room_id = user_data.get('room_id')
-        user_id = user_data.get('user_id')
-        username = user_data.get('username')
-        
-        if room_id and user_id:
-            user = memory_storage.get_user(user_id)
-            if user:
-                await handle_user_leave(sid, user_id, room_id, username)
+    user = registry.detach(sid)
+    if user:
+        # Keep the seat for a grace period so a reconnecting client can resume
+        sessions.start_grace(user['id'], lambda: expire_session(user['id']))
 
 @sio.event
 async def join_room(sid, data):
@@ -39,60 +54,78 @@ async def join_room(sid, data):
     user_id = data.get('userId')
     is_admin = data.get('isAdmin', False)
     public_key = data.get('publicKey')
+    # Opt in to binary message broadcasts (see app.wire)
+    binary = bool(data.get('binary', False))
     
-    room = memory_storage.get_room(room_id)
+    room = await memory_storage.load_room(room_id)
     
     if not room:
         await sio.emit('error', {'message': 'Room not found', 'fatal': True}, room=sid)
         return
     
-    if not bcrypt.verify(passphrase, room['passphrase_hash']):
-        await sio.emit('error', {'message': 'Invalid passphrase', 'fatal': True}, room=sid)
-        return
-    
-    existing_users = memory_storage.get_users_by_room(room_id)
-    
-    # Enforce username uniqueness
-    if any(u['username'] == username and u['id'] != user_id for u in existing_users):
-        await sio.emit('error', {'message': 'Username already taken in this room'}, room=sid)
+    try:
+        valid = await passphrase_service.verify(passphrase, room['passphrase_hash'])
+    except PassphraseServiceBusy:
+        await emit_busy(sid, 'join_room')
         return
     
-    # CRITICAL: Enforce userId uniqueness to prevent public key overwrite attacks
-    existing_user_with_same_id = memory_storage.get_user(user_id)
-    if existing_user_with_same_id:
-        # REJECT duplicate userId to prevent identity hijacking
-        await sio.emit('error', {
-            'message': 'User ID already in use. Please refresh and try again.',
-            'fatal': True
-        }, room=sid)
+    if not valid:
+        await sio.emit('error', {'message': 'Invalid passphrase', 'fatal': True}, room=sid)
         return
     
-    user_data = {
-        'id': user_id,
-        'username': username,
-        'room_id': room_id,
-        'is_admin': is_admin,
-        'public_key': public_key,
-        'joined_at': datetime.utcnow().isoformat()
-    }
-    memory_storage.add_user(user_id, user_data)
-    
-    clients[sid] = {
-        'user_id': user_id,
-        'username': username,
-        'room_id': room_id
-    }
-    
-    await sio.enter_room(sid, room_id)
-    
-    messages = memory_storage.get_messages(room_id)
-    for msg in messages:
-        await sio.emit('message_broadcast', msg, room=sid)
-    
-    await sio.emit('user_joined', {'userId': user_id, 'username': username}, room=room_id, skip_sid=sid)
-    await send_user_list_update(room_id)
+    async def admit():
+        # Deleted or rekeyed while the passphrase was being checked
+        current = memory_storage.get_room(room_id)
+        if not current or current['passphrase_hash'] != room['passphrase_hash']:
+            await sio.emit('error', {'message': 'Invalid passphrase' if current else 'Room not found', 'fatal': True}, room=sid)
+            return
+        
+        # Enforce username uniqueness
+        username_owner = registry.username_owner(room_id, username)
+        if username_owner and username_owner != user_id:
+            await sio.emit('error', {'message': 'Username already taken in this room'}, room=sid)
+            return
+        
+        # CRITICAL: Enforce userId uniqueness to prevent public key overwrite attacks
+        existing_user_with_same_id = registry.get_user(user_id)
+        if existing_user_with_same_id:
+            # REJECT duplicate userId to prevent identity hijacking
+            await sio.emit('error', {
+                'message': 'User ID already in use. Please refresh and try again.',
+                'fatal': True
+            }, room=sid)
+            return
+        
+        user_data = {
+            'id': user_id,
+            'username': username,
+            'room_id': room_id,
+            'is_admin': is_admin,
+            'public_key': public_key,
+            'binary': binary,
+            'joined_at': datetime.utcnow().isoformat()
+        }
+        registry.add_user(sid, user_data)
+        # Taken before any await so the snapshot matches its version exactly
+        snapshot = members_snapshot(room_id)
+        resume_token = sessions.issue(user_id)
+        # Parse the signing key once; every later signature check reuses it
+        public_keys.put(user_id, public_key)
+        
+        await sio.enter_room(sid, room_id)
+        await sio.enter_room(sid, wire_room(room_id, binary))
+        
+        messages, cursor = await memory_storage.fetch_messages_page(room_id, None, HISTORY_PAGE_SIZE)
+        await sio.emit('history_batch', {'messages': messages, 'cursor': cursor, 'before': None}, room=sid)
+        
+        await sio.emit('members_snapshot', snapshot, room=sid)
+        await sio.emit('session_token', {'resumeToken': resume_token, 'graceSeconds': sessions.grace}, room=sid)
+        await sio.emit('user_joined', {'userId': user_id, 'username': username}, room=room_id, skip_sid=sid)
+        await send_members_delta(room_id, snapshot['version'], added=[member_info(user_data)], skip_sid=sid)
+        
+        print(f"[WS] User {username} joined room {room_id}")
     
-    print(f"[WS] User {username} joined room {room_id}")
+    await in_room(room_id, admit, sid, 'join_room')
 
 @sio.event
 async def send_message(sid, data):
@@ -104,7 +137,7 @@ async def send_message(sid, data):
     signature = data.get('signature')
     
     # Get user's stored public key (from join time) to prevent spoofing
-    user = memory_storage.get_user(user_id)
+    user = registry.get_user(user_id)
     if not user:
         await sio.emit('error', {
             'message': 'User not found in room',
@@ -117,7 +150,11 @@ async def send_message(sid, data):
     # Verify digital signature server-side using STORED public key
     verified = False
     if signature and stored_public_key and content:
-        verified = verify_ed25519_signature(content, signature, stored_public_key)
+        try:
+            verified = await verify_payload(public_keys.get(user_id), content, signature)
+        except WorkerPoolBusy:
+            await emit_busy(sid, 'send_message')
+            return
         if not verified:
             await sio.emit('error', {
                 'message': 'Message signature verification failed - message rejected',
@@ -125,31 +162,80 @@ async def send_message(sid, data):
             }, room=sid)
             return
     
-    message = {
-        'id': data.get('id', str(asyncio.get_event_loop().time())),
-        'roomId': room_id,
-        'userId': user_id,
-        'username': username,
-        'content': content,
-        'timestamp': datetime.utcnow().timestamp() * 1000,
-        'isSystem': False,
-        'ttl': ttl_seconds,
-        'signature': signature,
-        'publicKey': stored_public_key,  # Use stored key, not client-provided
-        'verified': verified
-    }
+    async def publish():
+        # Everyone may have left while the signature was being checked
+        if not memory_storage.get_room(room_id):
+            return
+        # Stamped in room order, so timestamps never go backwards within a room; the
+        # server picks the id so no member can reuse (and overwrite) someone else's
+        message = {
+            'id': str(uuid.uuid4()),
+            'roomId': room_id,
+            'userId': user_id,
+            'username': username,
+            'content': content,
+            'timestamp': datetime.utcnow().timestamp() * 1000,
+            'isSystem': False,
+            'ttl': ttl_seconds,
+            'signature': signature,
+            'publicKey': stored_public_key,  # Use stored key, not client-provided
+            'verified': verified
+        }
+        
+        try:
+            memory_storage.add_message(room_id, message)
+        except PersistenceQueueFull:
+            await emit_busy(sid, 'send_message')
+            return
+        
+        typing_aggregator.clear(room_id, user_id)
+        await broadcast_message(room_id, message)
+        
+        expiry_scheduler.schedule_message(message)
     
-    memory_storage.add_message(room_id, message)
+    await in_room(room_id, publish, sid, 'send_message')
+
+async def expire_messages(room_id: str, message_ids: list):
+    """Expiry scheduler callback: bulk delete and notify the room once."""
+    async def expire():
+        try:
+            deleted = memory_storage.delete_messages(room_id, message_ids)
+        except PersistenceQueueFull:
+            retry()
+            return
+        
+        if deleted:
+            await broadcast_event(room_id, 'message_deleted', {'messageIds': deleted})
     
-    await sio.emit('message_broadcast', message, room=room_id)
+    def retry():
+        # Try again on the next tick rather than leaving rows behind
+        for message_id in message_ids:
+            expiry_scheduler.schedule(room_id, message_id, 0)
     
-    if ttl_seconds:
-        asyncio.create_task(auto_delete_message(room_id, message['id'], ttl_seconds))
+    # Not awaited: one room's backlog must not hold up expiries in other rooms
+    try:
+        room_executor.submit(room_id, expire)
+    except RoomBusy:
+        retry()
 
-async def auto_delete_message(room_id: str, message_id: str, ttl_seconds: int):
-    await asyncio.sleep(ttl_seconds)
-    memory_storage.delete_message(room_id, message_id)
-    await sio.emit('message_deleted', {'messageId': message_id}, room=room_id)
+@sio.event
+async def fetch_history(sid, data):
+    room_id = data.get('roomId')
+    # A cursor that does not parse asks for the newest page, like no cursor at all
+    before = data.get('before') if parse_cursor(data.get('before')) is not None else None
+    try:
+        limit = int(data.get('limit') or HISTORY_PAGE_SIZE)
+    except (TypeError, ValueError, OverflowError):
+        limit = HISTORY_PAGE_SIZE
+    limit = max(1, min(limit, HISTORY_PAGE_MAX))
+    
+    user = registry.get_user_by_sid(sid)
+    if not user or user.get('room_id') != room_id:
+        await sio.emit('error', {'message': 'Not a member of this room', 'fatal': False}, room=sid)
+        return
+    
+    messages, cursor = await memory_storage.fetch_messages_page(room_id, before=before, limit=limit)
+    await sio.emit('history_batch', {'messages': messages, 'cursor': cursor, 'before': before}, room=sid)
 
 @sio.event
 async def change_passphrase(sid, data):
@@ -157,41 +243,44 @@ async def change_passphrase(sid, data):
     user_id = data.get('userId')
     new_passphrase = data.get('newPassphrase')
     
-    user = memory_storage.get_user(user_id)
+    user = registry.get_user(user_id)
     if not user or not user.get('is_admin') or user.get('room_id') != room_id:
         await sio.emit('error', {'message': 'Unauthorized - Admin only'}, room=sid)
         return
     
-    passphrase_hash = bcrypt.hash(new_passphrase)
-    memory_storage.update_room_passphrase(room_id, passphrase_hash)
-    
-    all_users = memory_storage.get_users_by_room(room_id)
+    try:
+        passphrase_hash = await passphrase_service.hash(new_passphrase)
+    except PassphraseServiceBusy:
+        await emit_busy(sid, 'change_passphrase')
+        return
     
-    for u in all_users:
-        user_sid = get_sid_for_user(u['id'])
-        if not user_sid:
-            continue
+    async def rekey():
+        # Nobody joins, posts or leaves this room while its passphrase changes
+        admin = registry.get_user(user_id)
+        if not admin or admin.get('room_id') != room_id:
+            return
         
-        await sio.emit('clear_history', {}, room=user_sid)
+        try:
+            memory_storage.update_room_passphrase(room_id, passphrase_hash)
+        except PersistenceQueueFull:
+            await emit_busy(sid, 'change_passphrase')
+            return
         
-        if u['id'] != user_id:
-            await sio.emit('passphrase_changed', {}, room=user_sid)
-            await asyncio.sleep(0.2)
-            await sio.disconnect(user_sid)
-            memory_storage.remove_user(u['id'])
-            if user_sid in clients:
-                del clients[user_sid]
-    
-    await send_user_list_update(room_id)
+        await evict_members(room_id, admin)
+    
+    await in_room(room_id, rekey, sid, 'change_passphrase')
 
 @sio.event
 async def leave_room(sid, data):
     room_id = data.get('roomId')
     user_id = data.get('userId')
     
-    user = memory_storage.get_user(user_id)
-    if user and user.get('room_id') == room_id:
-        await handle_user_leave(sid, user_id, room_id, user['username'])
+    async def leave():
+        user = registry.get_user(user_id)
+        if user and user.get('room_id') == room_id:
+            await handle_user_leave(sid, user_id, room_id, user['username'])
+    
+    await in_room(room_id, leave, sid, 'leave_room')
 
 @sio.event
 async def share_file(sid, data):
@@ -199,25 +288,40 @@ async def share_file(sid, data):
     user_id = data.get('userId')
     username = data.get('username')
     filename = data.get('filename')
-    encrypted_data = data.get('encryptedData')
+    blob_id = data.get('blobId')
     mime_type = data.get('mimeType')
     file_size = data.get('fileSize')
     signature = data.get('signature')
     
     # Get user's stored public key to prevent spoofing
-    user = memory_storage.get_user(user_id)
-    if not user:
+    user = registry.get_user(user_id)
+    if not user or user.get('room_id') != room_id:
         await sio.emit('error', {
             'message': 'User not found in room',
             'fatal': False
         }, room=sid)
         return
     
+    # The encrypted payload was uploaded out of band; the event only carries metadata.
+    # Blobs are shared across rooms by content, so only the sender's own uploads qualify.
+    blob_size = blob_store.size(blob_id)
+    owned = blob_store.uploaded_by(blob_id, room_id, user_id) or memory_storage.room_has_blob(room_id, blob_id)
+    if blob_size is None or not owned:
+        await sio.emit('error', {
+            'message': 'Uploaded file not found',
+            'fatal': False
+        }, room=sid)
+        return
+    
     stored_public_key = user.get('public_key')
     
     # Verify file signature server-side using STORED public key
-    if signature and encrypted_data and stored_public_key:
-        verified = verify_ed25519_signature(encrypted_data, signature, stored_public_key)
+    if signature and stored_public_key:
+        try:
+            verified = await verify_file(public_keys.get(user_id), blob_store.path_for(blob_id), signature)
+        except WorkerPoolBusy:
+            await emit_busy(sid, 'share_file')
+            return
         if not verified:
             await sio.emit('error', {
                 'message': 'File signature verification failed - file rejected',
@@ -225,33 +329,47 @@ async def share_file(sid, data):
             }, room=sid)
             return
     
-    file_share = {
-        'id': str(asyncio.get_event_loop().time()),
-        'roomId': room_id,
-        'userId': user_id,
-        'username': username,
-        'filename': filename,
-        'encryptedData': encrypted_data,
-        'mimeType': mime_type,
-        'fileSize': file_size,
-        'timestamp': datetime.utcnow().timestamp() * 1000,
-        'signature': signature
-    }
+    async def publish():
+        if not memory_storage.get_room(room_id):
+            return
+        
+        file_share = {
+            'id': str(uuid.uuid4()),
+            'roomId': room_id,
+            'userId': user_id,
+            'username': username,
+            'filename': filename,
+            'blobId': blob_id,
+            'blobSize': blob_size,
+            'mimeType': mime_type,
+            'fileSize': file_size,
+            'timestamp': datetime.utcnow().timestamp() * 1000,
+            'signature': signature
+        }
+        
+        try:
+            memory_storage.add_file_share(room_id, file_share)
+        except PersistenceQueueFull:
+            await emit_busy(sid, 'share_file')
+            return
+        
+        await broadcast_event(room_id, 'file_shared', file_share)
     
-    memory_storage.add_file_share(room_id, file_share)
-    await sio.emit('file_shared', file_share, room=room_id)
+    await in_room(room_id, publish, sid, 'share_file')
 
 @sio.event
 async def typing(sid, data):
     room_id = data.get('roomId')
     user_id = data.get('userId')
     
-    user = memory_storage.get_user(user_id)
-    if user and user.get('room_id') == room_id:
-        await sio.emit('user_typing', {
-            'userId': user_id,
-            'username': user['username']
-        }, room=room_id, skip_sid=sid)
+    # Keystrokes only mark the user as typing; the aggregator broadcasts `typing_state`
+    user = registry.get_user_by_sid(sid)
+    if user and user['id'] == user_id and user.get('room_id') == room_id:
+        typing_aggregator.touch(room_id, user_id, user['username'])
+
+async def send_typing_state(room_id: str, users: list):
+    """Typing aggregator callback; every worker holds the full typing state, so emit locally."""
+    await sio.emit('typing_state', {'roomId': room_id, 'users': users}, room=room_id, ignore_queue=True)
 
 @sio.event
 async def webrtc_signal(sid, data):
@@ -260,7 +378,7 @@ async def webrtc_signal(sid, data):
     signal_data = data.get('data')
     sender_id = data.get('senderId')
     
-    target_sid = get_sid_for_user(target_user_id)
+    target_sid = registry.get_sid(target_user_id)
     if target_sid:
         await sio.emit('webrtc_signal', {
             'type': signal_type,
@@ -268,43 +386,201 @@ async def webrtc_signal(sid, data):
             'senderId': sender_id
         }, room=target_sid)
 
+@sio.event
+async def resume_session(sid, data):
+    """Reattach a reconnecting socket to its user and replay only what it missed."""
+    user_id = sessions.user_for(data.get('resumeToken'))
+    user = registry.get_user(user_id) if user_id else None
+    if not user:
+        await sio.emit('resume_failed', {}, room=sid)
+        return
+    
+    async def resume():
+        # The seat may have been given up while this waited its turn
+        if not registry.get_user(user_id):
+            await sio.emit('resume_failed', {}, room=sid)
+            return
+        
+        room_id = user['room_id']
+        old_sid = registry.get_sid(user_id)
+        sessions.cancel_grace(user_id)
+        registry.attach(sid, user_id)
+        public_keys.put(user_id, user.get('public_key'))
+        resume_token = sessions.issue(user_id)
+        snapshot = members_snapshot(room_id)
+        
+        await sio.enter_room(sid, room_id)
+        await sio.enter_room(sid, wire_room(room_id, user.get('binary', False)))
+        if old_sid and old_sid != sid:
+            # The server had not noticed the old socket drop yet; retire it
+            await sio.disconnect(old_sid)
+        
+        last_message_id = data.get('lastMessageId')
+        missed = memory_storage.get_messages_after(room_id, last_message_id) if last_message_id else None
+        if missed is not None and len(missed) <= HISTORY_PAGE_MAX:
+            history = {'replay': True, 'messages': missed, 'cursor': None}
+        else:
+            # Too far behind (or the last message is gone): start over from the newest page
+            messages, cursor = await memory_storage.fetch_messages_page(room_id, None, HISTORY_PAGE_SIZE)
+            history = {'replay': False, 'messages': messages, 'cursor': cursor}
+        
+        await sio.emit('session_resumed', {'resumeToken': resume_token, 'graceSeconds': sessions.grace, **history}, room=sid)
+        await sio.emit('members_snapshot', snapshot, room=sid)
+        sessions.resumed += 1
+        print(f"[WS] User {user['username']} resumed session in room {room_id}")
+    
+    await in_room(user['room_id'], resume, sid, 'resume_session')
+
+async def expire_session(user_id: str):
+    """Grace period over without a resume: the user leaves for real."""
+    user = registry.get_user(user_id)
+    if not user:
+        return
+    
+    async def expire():
+        user = registry.get_user(user_id)
+        if user and not registry.is_attached(user_id):
+            await handle_user_leave(None, user_id, user['room_id'], user['username'])
+    
+    try:
+        await room_executor.run(user['room_id'], expire)
+    except RoomBusy:
+        # Try again after another grace period rather than keeping the seat forever
+        sessions.start_grace(user_id, lambda: expire_session(user_id))
+
+@sio.event
+async def resync_members(sid, data):
+    """A client saw a gap in `members_delta` versions and wants a fresh snapshot."""
+    user = registry.get_user_by_sid(sid)
+    if not user or user.get('room_id') != data.get('roomId'):
+        return
+    
+    await sio.emit('members_snapshot', members_snapshot(user['room_id']), room=sid)
+
 async def handle_user_leave(sid: str, user_id: str, room_id: str, username: str):
-    memory_storage.remove_user(user_id)
-    if sid in clients:
-        del clients[sid]
+    registry.remove_user(user_id)
+    version = registry.room_version(room_id)
+    public_keys.drop(user_id)
+    sessions.revoke(user_id)
+    typing_aggregator.clear(room_id, user_id)
     
     await sio.emit('user_left', {'userId': user_id, 'username': username}, room=room_id)
-    await send_user_list_update(room_id)
+    await send_members_delta(room_id, version, removed=[user_id])
     
-    remaining_users = memory_storage.get_users_by_room(room_id)
-    if len(remaining_users) == 0:
+    if registry.room_size(room_id) == 0:
         memory_storage.delete_room(room_id)
+        broadcast_batcher.forget(room_id)
+
+async def evict_members(room_id: str, admin: dict):
+    """After a passphrase change, remove everyone but the admin in one step.
+    
+    Runs in the room's executor. Evicted members get one room-wide
+    `passphrase_changed`, stop receiving the room's broadcasts at once and
+    leave the member list in a single delta; their sockets are closed
+    together after REKEY_GRACE_MS, outside the executor.
+    """
+    started = time.perf_counter()
+    admin_sid = registry.get_sid(admin['id'])
+    evicted = [u['id'] for u in registry.get_users_by_room(room_id) if u['id'] != admin['id']]
+    evicted_sids = [user_sid for user_sid in map(registry.get_sid, evicted) if user_sid]
+    
+    # Queued behind any batched broadcasts, so the admin drops those as well (chat.js handles it inside message_batch)
+    await broadcast_event(room_id, 'clear_history', {})
+    await sio.emit('passphrase_changed', {}, room=room_id, skip_sid=admin_sid)
+    for room in (room_id, wire_room(room_id, False), wire_room(room_id, True)):
+        await sio.close_room(room)
+    if admin_sid:
+        await sio.enter_room(admin_sid, room_id)
+        await sio.enter_room(admin_sid, wire_room(room_id, admin.get('binary', False)))
+    
+    # Closing a socket would only start its resume grace period; members who
+    # knew the old passphrase (connected or not) must not be able to resume
+    registry.remove_users(evicted)
+    sessions.revoke_many(evicted)
+    for user_id in evicted:
+        public_keys.drop(user_id)
+        typing_aggregator.clear(room_id, user_id)
+    if evicted:
+        await send_members_delta(room_id, registry.room_version(room_id), removed=evicted)
+    
+    asyncio.ensure_future(close_evicted(room_id, admin_sid, evicted_sids, len(evicted), started))
+
+async def close_evicted(room_id: str, admin_sid: str, sids: list, evicted: int, started: float):
+    """Close evicted sockets at one shared deadline and report how long the rekey took."""
+    await asyncio.sleep(REKEY_GRACE_MS / 1000)
+    # A socket that has since joined again holds a new seat
+    sids = [sid for sid in sids if not registry.get_user_by_sid(sid)]
+    await asyncio.gather(*(sio.disconnect(sid) for sid in sids), return_exceptions=True)
+    
+    seconds = time.perf_counter() - started
+    rekey_seconds.observe(seconds)
+    print(f"[WS] Rekeyed room {room_id}: {evicted} members evicted in {seconds * 1000:.0f} ms")
+    if admin_sid:
+        await sio.emit('passphrase_change_complete', {'evicted': evicted, 'ms': round(seconds * 1000)}, room=admin_sid)
 
-async def send_user_list_update(room_id: str):
-    users = memory_storage.get_users_by_room(room_id)
-    await sio.emit('user_list_update', {'users': users}, room=room_id)
+async def broadcast_message(room_id: str, message: dict):
+    """One emit per encoding; an encoding nobody in the room uses costs an empty emit."""
+    if broadcast_batcher.add(room_id, 'message_broadcast', message):
+        return
+    await sio.emit('message_broadcast', message, room=wire_room(room_id, False))
+    await sio.emit('message_broadcast', to_binary(message), room=wire_room(room_id, True))
+
+async def broadcast_event(room_id: str, event: str, data: dict):
+    """Room-wide event that keeps its place among batched message broadcasts."""
+    if not broadcast_batcher.add(room_id, event, data):
+        await sio.emit(event, data, room=room_id)
 
-def get_sid_for_user(user_id: str):
-    for sid, data in clients.items():
-        if data.get('user_id') == user_id:
-            return sid
-    return None
+async def send_batch(room_id: str, events: list):
+    """Broadcast batcher callback: one `message_batch` frame per encoding."""
+    await sio.emit('message_batch', {'roomId': room_id, 'events': events}, room=wire_room(room_id, False))
+    packed = [(event, to_binary(data) if event == 'message_broadcast' else data) for event, data in events]
+    await sio.emit('message_batch', {'roomId': room_id, 'events': packed}, room=wire_room(room_id, True))
+
+def member_info(user: dict) -> dict:
+    # Each member's key is sent once here, so binary broadcasts can leave it out
+    return {
+        'id': user['id'],
+        'username': user['username'],
+        'is_admin': user.get('is_admin', False),
+        'publicKey': user.get('public_key')
+    }
+
+def members_snapshot(room_id: str) -> dict:
+    return {
+        'roomId': room_id,
+        'version': registry.room_version(room_id),
+        'members': [member_info(u) for u in registry.get_users_by_room(room_id)]
+    }
 
-def verify_ed25519_signature(message: str, signature_b64: str, public_key_b64: str) -> bool:
-    """Verify Ed25519 digital signature server-side."""
+async def send_members_delta(room_id: str, version: int, added: list = None, removed: list = None, skip_sid: str = None):
+    """Tell the room what changed; clients apply it only on top of version - 1."""
+    delta = {'roomId': room_id, 'version': version}
+    if added:
+        delta['added'] = added
+    if removed:
+        delta['removed'] = removed
+    await sio.emit('members_delta', delta, room=room_id, skip_sid=skip_sid)
+
+async def handle_peer_down(room_ids: list):
+    """Another worker died: forget its users and refresh the rooms they were in for our clients."""
+    for room_id in room_ids:
+        if registry.room_size(room_id) == 0:
+            # Every worker runs this, so delete locally instead of re-announcing
+            memory_storage.apply_replicated('delete_room', room_id)
+        else:
+            # Several members vanished at once: resend the whole list
+            await sio.emit('members_snapshot', members_snapshot(room_id), room=room_id, ignore_queue=True)
+
+async def in_room(room_id: str, job, sid: str, event: str):
+    """Run a state-changing job in the room's executor; a full mailbox asks the client to retry `event`."""
     try:
-        # Decode base64 public key and signature
-        public_key_bytes = base64.b64decode(public_key_b64)
-        signature_bytes = base64.b64decode(signature_b64)
-        
-        # Import the public key (SPKI format)
-        public_key = serialization.load_der_public_key(public_key_bytes)
-        
-        # Verify signature
-        message_bytes = message.encode('utf-8')
-        public_key.verify(signature_bytes, message_bytes)
-        
-        return True
-    except (InvalidSignature, Exception) as e:
-        print(f"[WS] Signature verification failed: {e}")
-        return False
+        await room_executor.run(room_id, job)
+    except RoomBusy:
+        await emit_busy(sid, event)
+
+async def emit_busy(sid: str, event: str):
+    await sio.emit('error', {
+        'message': 'Server busy, please retry',
+        'fatal': False,
+        'retry': event
+    }, room=sid)
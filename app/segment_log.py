@@ -0,0 +1,513 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+from app.expiry import now as expiry_now
+from app.message_store import Cursor, message_key
+
+LOG_DIR = os.environ.get("LOG_DIR", "./roomlog")
+LOG_SEGMENT_BYTES = int(os.environ.get("LOG_SEGMENT_BYTES", 8 * 1024 * 1024))
+# One sparse index entry per this many bytes of segment
+LOG_INDEX_INTERVAL_BYTES = int(os.environ.get("LOG_INDEX_INTERVAL_BYTES", 64 * 1024))
+LOG_COMPACT_INTERVAL_SECONDS = float(os.environ.get("LOG_COMPACT_INTERVAL_SECONDS", 300))
+# Sealed segments are rewritten once this share of their bytes has expired
+LOG_COMPACT_MIN_RATIO = float(os.environ.get("LOG_COMPACT_MIN_RATIO", 0.3))
+# Segments untouched for longer cannot hold a pending self-destruct timer (see pending_expiries)
+LOG_TTL_LOOKBACK_SECONDS = float(os.environ.get("LOG_TTL_LOOKBACK_SECONDS", 86400))
+# Room logs kept open; the least recently used beyond this are closed and reopened on demand
+LOG_OPEN_ROOMS_MAX = int(os.environ.get("LOG_OPEN_ROOMS_MAX", 256))
+# Active segment files not appended to for this long give their file descriptor back
+LOG_IDLE_CLOSE_SECONDS = float(os.environ.get("LOG_IDLE_CLOSE_SECONDS", 60))
+
+# length, crc32 of the payload, timestamp (ms), expires at (ms, 0 = never)
+HEADER = struct.Struct(">IIdd")
+# offset, timestamp (ms), byte position
+INDEX_ENTRY = struct.Struct(">QdQ")
+
+
+def now_ms() -> float:
+    # Same clock as message timestamps and the expiry scheduler
+    return expiry_now() * 1000
+
+
+def expires_at(message: dict) -> float:
+    ttl = message.get('ttl')
+    return message['timestamp'] + ttl * 1000 if ttl else 0.0
+
+
+def scan_records(buffer, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, float, float, bytes]]:
+    limit = len(buffer) if end is None else min(end, len(buffer))
+    position = start
+    while position + HEADER.size <= limit:
+        length, crc, timestamp, expiry = HEADER.unpack_from(buffer, position)
+        body_end = position + HEADER.size + length
+        if body_end > limit:
+            return
+        payload = buffer[position + HEADER.size:body_end]
+        if zlib.crc32(payload) != crc:
+            return
+        yield position, timestamp, expiry, payload
+        position = body_end
+
+
+def latest_segments(directory: str) -> Tuple[Dict[int, Tuple[int, str]], List[str]]:
+    """Newest generation of each segment in `directory` as base -> (generation, path), plus superseded paths."""
+    newest: Dict[int, Tuple[int, str]] = {}
+    superseded: List[str] = []
+    for name in os.listdir(directory):
+        if not name.endswith(".log"):
+            continue
+        base, generation = (int(part) for part in name[:-len(".log")].split("-"))
+        path = os.path.join(directory, name)
+        if base in newest and newest[base][0] > generation:
+            superseded.append(path)
+            continue
+        if base in newest:
+            superseded.append(newest[base][1])
+        newest[base] = (generation, path)
+    return newest, superseded
+
+
+class Segment:
+    """One segment file and its sparse (offset, timestamp) -> position index."""
+
+    def __init__(self, path: str, base: int, generation: int = 0):
+        self.path = path
+        self.base = base
+        self.generation = generation
+        self.index: List[Tuple[int, float, int]] = []
+        # Parallel list for bisecting by time
+        self.index_times: List[float] = []
+        self.size = 0
+        self.count = 0
+        self.last_timestamp = 0.0
+        self.last_write = os.path.getmtime(path) if os.path.exists(path) else time.time()
+
+    @property
+    def index_path(self) -> str:
+        return self.path[:-len(".log")] + ".idx"
+
+    def add_index(self, offset: int, timestamp: float, position: int):
+        timestamp = max(timestamp, self.index_times[-1]) if self.index_times else timestamp
+        self.index.append((offset, timestamp, position))
+        self.index_times.append(timestamp)
+
+    def note_record(self, offset: int, position: int, length: int, timestamp: float):
+        """Account for record `offset`, written or found at `position`."""
+        if not self.index or position - self.index[-1][2] >= LOG_INDEX_INTERVAL_BYTES:
+            self.add_index(offset, timestamp, position)
+        self.count = offset - self.base + 1
+        self.size = position + length
+        self.last_timestamp = max(self.last_timestamp, timestamp)
+
+    def scan(self, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, float, float, bytes]]:
+        """(position, timestamp, expires at, payload) for complete, intact records in [start, end)."""
+        with self.mapped() as mm:
+            yield from scan_records(mm, start, end)
+
+    @contextmanager
+    def mapped(self):
+        """The segment memory-mapped read-only (an empty buffer if it is empty or gone)."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            # Replaced by compaction or dropped by a passphrase change
+            yield b""
+            return
+        with f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield mm
+
+    def load_index(self) -> bool:
+        try:
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return False
+        for i in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+            self.add_index(*INDEX_ENTRY.unpack_from(data, i))
+        return bool(self.index)
+
+    def write_index(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "wb") as f:
+            for entry in self.index:
+                f.write(INDEX_ENTRY.pack(*entry))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.index_path)
+
+    def rebuild(self):
+        """Recover size, count and index by scanning; drops a torn tail record."""
+        self.index, self.index_times, self.count, self.size = [], [], 0, 0
+        for position, timestamp, _, payload in self.scan():
+            self.note_record(self.base + self.count, position, HEADER.size + len(payload), timestamp)
+        if os.path.exists(self.path) and os.path.getsize(self.path) > self.size:
+            with open(self.path, "r+b") as f:
+                f.truncate(self.size)
+
+
+class RoomLog:
+    """Append-only segments for one room, oldest first; the last one is active."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.segments: List[Segment] = []
+        # Offsets keep growing across clear(), so segment names are never reused
+        self.cleared_at = 0
+        self._file = None
+        self.dirty = False
+        # Set once SegmentLogStore evicts this log; a fresh RoomLog takes over the directory
+        self.retired = False
+        self._open()
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                os.remove(os.path.join(self.directory, name))
+        # A crash mid-compaction can leave both generations of a segment behind
+        newest, superseded = latest_segments(self.directory)
+        for path in superseded:
+            self._remove_files(path)
+        for base in sorted(newest):
+            generation, path = newest[base]
+            segment = Segment(path, base, generation)
+            is_active = base == max(newest)
+            if is_active or not segment.load_index():
+                segment.rebuild()
+            else:
+                self._restore_counts(segment)
+            self.segments.append(segment)
+
+    def _restore_counts(self, segment: Segment):
+        # Sealed segments only need their record count to place the next base offset
+        segment.size = os.path.getsize(segment.path)
+        segment.count = 0
+        for _ in segment.scan(segment.index[-1][2]):
+            segment.count += 1
+        segment.count += segment.index[-1][0] - segment.base
+        segment.last_timestamp = segment.index_times[-1]
+
+    @staticmethod
+    def _remove_files(path: str):
+        for p in (path, path[:-len(".log")] + ".idx"):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+    def _segment_path(self, base: int, generation: int = 0) -> str:
+        return os.path.join(self.directory, f"{base:020d}-{generation:04d}.log")
+
+    def next_offset(self) -> int:
+        last = self.segments[-1] if self.segments else None
+        return last.base + last.count if last else self.cleared_at
+
+    def append(self, message: dict) -> bool:
+        """Append a message; False if this log was retired and the caller must look the room up again."""
+        payload = json.dumps(message, separators=(",", ":")).encode()
+        record = HEADER.pack(len(payload), zlib.crc32(payload), message['timestamp'], expires_at(message)) + payload
+        with self.lock:
+            if self.retired:
+                return False
+            active = self.segments[-1] if self.segments else None
+            if active is None or (active.size and active.size + len(record) > LOG_SEGMENT_BYTES):
+                active = self._roll()
+            if self._file is None:
+                self._file = open(active.path, "ab")
+            self._file.write(record)
+            active.note_record(active.base + active.count, active.size, len(record), message['timestamp'])
+            active.last_write = time.time()
+            self.dirty = True
+        return True
+
+    def _roll(self) -> Segment:
+        """Seal the active segment (persisting its index) and start a new one."""
+        self._close_file()
+        if self.segments:
+            self.segments[-1].write_index()
+        segment = Segment(self._segment_path(self.next_offset()), self.next_offset())
+        open(segment.path, "ab").close()
+        self.segments.append(segment)
+        return segment
+
+    def sync(self):
+        with self.lock:
+            if self._file is not None and self.dirty:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self.dirty = False
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self.lock:
+            self._close_file()
+
+    def close_idle(self, cutoff: float):
+        """Close the active file if nothing was appended since `cutoff` (the next append reopens it)."""
+        with self.lock:
+            if self._file is not None and self.segments and self.segments[-1].last_write < cutoff:
+                self._close_file()
+                self.dirty = False
+
+    def retire(self):
+        with self.lock:
+            self.retired = True
+            self._close_file()
+            self.dirty = False
+
+    def clear(self) -> bool:
+        with self.lock:
+            if self.retired:
+                return False
+            self._close_file()
+            self.cleared_at = self.next_offset()
+            for segment in self.segments:
+                self._remove_files(segment.path)
+            self.segments = []
+        return True
+
+    def page(self, before: Optional[Cursor], limit: int, now: float) -> Tuple[List[dict], Optional[Cursor]]:
+        """Newest `limit` unexpired messages ordered before `before` by (timestamp, id), and the next cursor."""
+        with self.lock:
+            if self._file is not None:
+                self._file.flush()
+            segments = list(self.segments)
+        before_ts = before[0] if before is not None else None
+        found: List[dict] = []
+
+        def complete() -> bool:
+            # Records are in time order, so once something older than the page's
+            # oldest millisecond turns up, nothing unread can belong in the page
+            if len(found) <= limit:
+                return False
+            found.sort(key=message_key)
+            return found[0]['timestamp'] < found[-limit]['timestamp']
+
+        for segment in reversed(segments):
+            if not segment.index or (before_ts is not None and segment.index_times[0] > before_ts):
+                continue
+            # Walk the sparse index backwards one chunk at a time
+            stop = len(segment.index) if before_ts is None else bisect_right(segment.index_times, before_ts)
+            chunk_end = segment.index[stop][2] if stop < len(segment.index) else None
+            with segment.mapped() as mm:
+                for i in range(stop - 1, -1, -1):
+                    for _, timestamp, expiry, payload in scan_records(mm, segment.index[i][2], chunk_end):
+                        if (before_ts is not None and timestamp > before_ts) or (expiry and expiry <= now):
+                            continue
+                        message = json.loads(payload)
+                        if before is None or message_key(message) < before:
+                            found.append(message)
+                    chunk_end = segment.index[i][2]
+                    if complete():
+                        break
+            if complete():
+                break
+        found.sort(key=message_key)
+        page = found[-limit:]
+        return page, (message_key(page[0]) if len(found) > limit else None)
+
+    def compact(self, now: float, min_ratio: float) -> int:
+        """Rewrite sealed segments without their expired messages; returns bytes reclaimed."""
+        reclaimed = 0
+        for segment in list(self.segments[:-1]):
+            expired = sum(HEADER.size + len(payload) for _, _, expiry, payload in segment.scan()
+                          if expiry and expiry <= now)
+            if not expired or expired < segment.size * min_ratio:
+                continue
+            with self.lock:
+                # An evicted log's successor has already read this segment list
+                if self.retired:
+                    break
+                if segment not in self.segments:
+                    continue
+                replacement = Segment(self._segment_path(segment.base, segment.generation + 1), segment.base,
+                                      segment.generation + 1)
+                tmp = replacement.path + ".tmp"
+                with open(tmp, "wb") as f:
+                    offset = segment.base
+                    for _, timestamp, expiry, payload in segment.scan():
+                        offset += 1
+                        if expiry and expiry <= now:
+                            continue
+                        record = HEADER.pack(len(payload), zlib.crc32(payload), timestamp, expiry) + payload
+                        replacement.note_record(offset - 1, f.tell(), len(record), timestamp)
+                        f.write(record)
+                    f.flush()
+                    os.fsync(f.fileno())
+                # Keep the offset range of the segment so later base offsets stay valid
+                replacement.count = segment.count
+                replacement.last_write = segment.last_write
+                if not replacement.index:
+                    os.remove(tmp)
+                    self.segments.remove(segment)
+                else:
+                    os.replace(tmp, replacement.path)
+                    replacement.write_index()
+                    self.segments[self.segments.index(segment)] = replacement
+                self._remove_files(segment.path)
+            reclaimed += expired
+        return reclaimed
+
+
+class SegmentLogStore:
+    """Per-room append-only message logs under LOG_DIR.
+
+    Each room is a directory of segment files named by the offset of their
+    first record. Records are length-prefixed JSON with a CRC and their
+    timestamp and expiry in the header, so scans and compaction never parse
+    a payload they skip. Segments roll at LOG_SEGMENT_BYTES and keep a
+    sparse index of (offset, timestamp, position) every
+    LOG_INDEX_INTERVAL_BYTES; history reads bisect it and scan only the
+    chunks they need through a memory map. Expired messages are filtered
+    on read and removed when a sealed segment is compacted.
+
+    Appends come from the write-behind thread and are fsynced once per
+    batch by `sync`; reads run in worker threads. At most
+    LOG_OPEN_ROOMS_MAX room logs stay loaded, least recently used out
+    first, and active files idle for LOG_IDLE_CLOSE_SECONDS are closed.
+    """
+
+    def __init__(self, directory: str = LOG_DIR, max_open: int = LOG_OPEN_ROOMS_MAX):
+        self.directory = directory
+        self.max_open = max_open
+        # Least recently used first
+        self.rooms: "OrderedDict[str, RoomLog]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.compacted_bytes = 0
+
+    def room(self, room_id: str, touch: bool = True) -> RoomLog:
+        """The room's log, loading it if needed; `touch=False` (housekeeping) leaves it first in line for eviction."""
+        with self._lock:
+            log = self.rooms.get(room_id)
+            if log is None:
+                log = self.rooms[room_id] = RoomLog(os.path.join(self.directory, room_id))
+                self.rooms.move_to_end(room_id, last=touch)
+            elif touch:
+                self.rooms.move_to_end(room_id)
+            self._evict(keep=room_id)
+        return log
+
+    def _evict(self, keep: str):
+        for room_id in list(self.rooms):
+            if len(self.rooms) <= self.max_open:
+                break
+            if room_id != keep:
+                self.rooms.pop(room_id).retire()
+
+    def room_ids(self) -> List[str]:
+        try:
+            return [name for name in os.listdir(self.directory) if os.path.isdir(os.path.join(self.directory, name))]
+        except FileNotFoundError:
+            return []
+
+    def append(self, room_id: str, message: dict):
+        # A log evicted between the lookup and the append is reloaded
+        while not self.room(room_id).append(message):
+            pass
+
+    def loaded(self) -> List[RoomLog]:
+        with self._lock:
+            return list(self.rooms.values())
+
+    def sync(self):
+        for log in self.loaded():
+            if log.dirty:
+                log.sync()
+
+    def clear(self, room_id: str):
+        while not self.room(room_id).clear():
+            pass
+
+    def close_idle(self, idle: float = LOG_IDLE_CLOSE_SECONDS):
+        cutoff = time.time() - idle
+        for log in self.loaded():
+            log.close_idle(cutoff)
+
+    def page(self, room_id: str, before: Optional[Cursor], limit: int) -> Tuple[List[dict], Optional[Cursor]]:
+        if room_id not in self.rooms and not os.path.isdir(os.path.join(self.directory, room_id)):
+            return [], None
+        return self.room(room_id).page(before, limit, now_ms())
+
+    def pending_expiries(self, lookback: float = LOG_TTL_LOOKBACK_SECONDS) -> List[Tuple[str, str, float]]:
+        """(room id, message id, expires at in seconds) across all rooms, like DualStorage.
+
+        Reads recently written segment files directly instead of loading
+        every room's log; rooms are loaded on first use as usual.
+        """
+        now = now_ms()
+        cutoff = time.time() - lookback
+        pending = []
+        for room_id in self.room_ids():
+            try:
+                newest, _ = latest_segments(os.path.join(self.directory, room_id))
+            except FileNotFoundError:
+                continue
+            for _, path in newest.values():
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                # Torn tails end the scan like they do on load
+                for _, _, expiry, payload in Segment(path, 0).scan():
+                    if expiry and expiry > now:
+                        pending.append((room_id, json.loads(payload)['id'], expiry / 1000))
+        return pending
+
+    def compact(self) -> int:
+        now = now_ms()
+        reclaimed = 0
+        for room_id in self.room_ids():
+            reclaimed += self.room(room_id, touch=False).compact(now, LOG_COMPACT_MIN_RATIO)
+        self.compacted_bytes += reclaimed
+        return reclaimed
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="log-compactor", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        last_compact = time.monotonic()
+        while not self._stop.wait(min(LOG_IDLE_CLOSE_SECONDS, LOG_COMPACT_INTERVAL_SECONDS)):
+            self.close_idle()
+            if time.monotonic() - last_compact < LOG_COMPACT_INTERVAL_SECONDS:
+                continue
+            last_compact = time.monotonic()
+            try:
+                reclaimed = self.compact()
+                if reclaimed:
+                    print(f"[LOG] Compaction reclaimed {reclaimed} bytes")
+            except Exception as e:
+                print(f"[LOG] Compaction failed: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        for log in self.loaded():
+            log.close()
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import secrets
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# How long a dropped connection keeps its seat in the room
+RESUME_GRACE_SECONDS = float(os.environ.get("RESUME_GRACE_SECONDS", 30))
+
+
+class SessionResumption:
+    """Resumption tokens and disconnect grace timers for joined users.
+
+    A token is issued at join and lets a new socket take over the user's
+    registry entry without another passphrase check. When a socket drops,
+    the user stays in the room for `grace` seconds; if nobody resumes the
+    session by then, `on_expire` runs the normal leave.
+    """
+
+    def __init__(self, grace: float = RESUME_GRACE_SECONDS):
+        self.grace = grace
+        self._tokens: Dict[str, str] = {}
+        self._token_users: Dict[str, str] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        # Called as observer(op, *args) after each change (see app.cluster)
+        self.observer: Optional[Callable[..., None]] = None
+
+        self.resumed = 0
+        self.expired = 0
+
+    def issue(self, user_id: str) -> str:
+        token = secrets.token_urlsafe(32)
+        self.set_token(user_id, token)
+        return token
+
+    def set_token(self, user_id: str, token: str):
+        self._drop_token(user_id)
+        self._tokens[user_id] = token
+        self._token_users[token] = user_id
+        self._notify('set_token', user_id, token)
+
+    def user_for(self, token: Optional[str]) -> Optional[str]:
+        return self._token_users.get(token) if token else None
+
+    def revoke(self, user_id: str):
+        self.cancel_grace(user_id)
+        if self._drop_token(user_id):
+            self._notify('revoke', user_id)
+
+    def revoke_many(self, user_ids: List[str]):
+        revoked = []
+        for user_id in user_ids:
+            self.cancel_grace(user_id)
+            if self._drop_token(user_id):
+                revoked.append(user_id)
+        if revoked:
+            self._notify('revoke_many', revoked)
+
+    def start_grace(self, user_id: str, on_expire: Callable[[], Awaitable[None]]):
+        self.cancel_grace(user_id)
+
+        def expire():
+            self._timers.pop(user_id, None)
+            self.expired += 1
+            asyncio.ensure_future(on_expire())
+
+        self._timers[user_id] = asyncio.get_running_loop().call_later(self.grace, expire)
+
+    def cancel_grace(self, user_id: str) -> bool:
+        timer = self._timers.pop(user_id, None)
+        if timer:
+            timer.cancel()
+        return timer is not None
+
+    def apply_replicated(self, op: str, *args):
+        observer, self.observer = self.observer, None
+        try:
+            getattr(self, op)(*args)
+        finally:
+            self.observer = observer
+
+    def export(self) -> List[Tuple[str, tuple]]:
+        """Tokens as replayable ops, for a worker syncing from a snapshot."""
+        return [('set_token', (user_id, token)) for user_id, token in self._tokens.items()]
+
+    def _drop_token(self, user_id: str) -> bool:
+        token = self._tokens.pop(user_id, None)
+        if token:
+            self._token_users.pop(token, None)
+        return token is not None
+
+    def _notify(self, op: str, *args):
+        if self.observer:
+            self.observer(op, *args)
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+
+sessions = SessionResumption()
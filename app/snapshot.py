@@ -0,0 +1,152 @@
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+from app.expiry import now
+
+# Where ephemeral state is saved on graceful shutdown; empty disables snapshots
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", "")
+# Startup restores rooms for at most this long before accepting connections; the rest load in the background
+SNAPSHOT_WARM_MS = int(os.environ.get("SNAPSHOT_WARM_MS", 200))
+# Older snapshots, and rooms nobody has used for longer, are dropped rather than resurrecting long-gone rooms
+SNAPSHOT_MAX_AGE_SECONDS = float(os.environ.get("SNAPSHOT_MAX_AGE_SECONDS", 3600))
+
+MAGIC = b"ZCSNAP1\n"
+# header length, crc32 of the header
+PREAMBLE = struct.Struct(">QI")
+
+
+def room_state(room: dict, messages: List[dict], file_shares: List[dict], active_at: float) -> dict:
+    return {'room': room, 'messages': messages, 'fileShares': file_shares, 'activeAt': active_at}
+
+
+def write_snapshot(path: str, rooms: Iterable[Tuple[str, dict]]) -> int:
+    """Write (room id, room state) pairs to `path` atomically, returning how many rooms were saved.
+
+    The file is a small JSON header (room id -> byte range and last
+    activity, pending self-destruct timers) followed by one JSON document per room, so a
+    reader can map it and decode rooms one at a time.
+    """
+    bodies: List[bytes] = []
+    index: List[list] = []
+    expiries: List[list] = []
+    offset = 0
+    for room_id, state in rooms:
+        body = json.dumps(state, separators=(',', ':'), default=str).encode()
+        index.append([room_id, offset, len(body), zlib.crc32(body), state['activeAt']])
+        bodies.append(body)
+        offset += len(body)
+        for message in state['messages']:
+            if message.get('ttl'):
+                expiries.append([room_id, message['id'], message['timestamp'] / 1000 + message['ttl']])
+
+    header = json.dumps({'savedAt': time.time(), 'rooms': index, 'expiries': expiries},
+                        separators=(',', ':')).encode()
+    # Per process, since every cluster worker saves the same state on its way down
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(PREAMBLE.pack(len(header), zlib.crc32(header)))
+        f.write(header)
+        for body in bodies:
+            f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(index)
+
+
+class Snapshot:
+    """A mapped snapshot file whose rooms are decoded on demand.
+
+    Opening reads only the header. The file is unlinked right away (the
+    mapping stays valid), so a crash later cannot restore this state a
+    second time. Rooms last active more than `max_age` seconds ago are
+    dropped then too; re-saving a room nobody rejoined keeps its old
+    activity time, so restarts alone do not keep it alive.
+    """
+
+    def __init__(self, path: str, max_age: float = SNAPSHOT_MAX_AGE_SECONDS):
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        os.remove(path)
+        try:
+            if self.buffer[:len(MAGIC)] != MAGIC:
+                raise ValueError("not a snapshot file")
+            length, crc = PREAMBLE.unpack_from(self.buffer, len(MAGIC))
+            start = len(MAGIC) + PREAMBLE.size
+            header = self.buffer[start:start + length]
+            if len(header) != length or zlib.crc32(header) != crc:
+                raise ValueError("truncated header")
+        except Exception:
+            self.buffer.close()
+            raise
+        header = json.loads(header)
+        self.saved_at: float = header['savedAt']
+        body_start = start + length
+        cutoff = time.time() - max_age
+        # Room id -> (position, length, crc), in the order they were saved
+        self.pending: "OrderedDict[str, Tuple[int, int, int]]" = OrderedDict()
+        self.expired = 0
+        for room_id, offset, size, crc, *active_at in header['rooms']:
+            # Snapshots from before activity was recorded count every room as active when saved
+            if (active_at[0] if active_at else self.saved_at) < cutoff:
+                self.expired += 1
+            else:
+                self.pending[room_id] = (body_start + offset, size, crc)
+        self.expiries: List[Tuple[str, str, float]] = [tuple(e) for e in header['expiries'] if e[0] in self.pending]
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def __contains__(self, room_id: str) -> bool:
+        return room_id in self.pending
+
+    def take(self, room_id: str) -> Optional[dict]:
+        """Decode a room's state and forget it, or None if it is not pending (or damaged)."""
+        entry = self.pending.pop(room_id, None)
+        if entry is None:
+            return None
+        position, size, crc = entry
+        body = self.buffer[position:position + size]
+        if len(body) != size or zlib.crc32(body) != crc:
+            print(f"[SNAPSHOT] Skipping damaged room {room_id}")
+            return None
+        state = json.loads(body)
+        # Messages that self-destructed while the server was down stay gone
+        cutoff = now()
+        state['messages'] = [m for m in state['messages']
+                             if not (m.get('ttl') and m['timestamp'] / 1000 + m['ttl'] <= cutoff)]
+        return state
+
+    def discard(self, room_id: str):
+        self.pending.pop(room_id, None)
+
+    def next_room(self) -> Optional[str]:
+        return next(iter(self.pending), None)
+
+    def close(self):
+        self.pending.clear()
+        self.buffer.close()
+
+
+def open_snapshot(path: str = SNAPSHOT_PATH, max_age: float = SNAPSHOT_MAX_AGE_SECONDS) -> Optional[Snapshot]:
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        snapshot = Snapshot(path, max_age)
+    except Exception as e:
+        print(f"[SNAPSHOT] Ignoring unreadable snapshot {path}: {e}")
+        return None
+    age = time.time() - snapshot.saved_at
+    if age > max_age:
+        print(f"[SNAPSHOT] Ignoring snapshot saved {age:.0f}s ago")
+        snapshot.close()
+        return None
+    if snapshot.expired:
+        print(f"[SNAPSHOT] Dropped {snapshot.expired} rooms idle for over {max_age:.0f}s")
+    return snapshot
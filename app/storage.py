@@ -1,73 +1,261 @@
-from typing import Dict, List, Optional
-from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+from collections import OrderedDict
+import asyncio
+import os
+import time
 import uuid
+from sqlalchemy import or_, select
 from sqlalchemy.orm import Session
-from app.database import SessionLocal
-from app.models import Room, Message, FileShare
+from app.models import AsyncSessionLocal
+from app.models import Room, Message, FileShare, StorageMode
+from app.persistence import WriteBehindQueue, PersistenceQueueFull
+from app.registry import registry
+from app.message_store import RoomMessageStore, ROOM_MAX_MESSAGES, message_key, format_cursor, parse_cursor
+from app.blobstore import blob_store, BLOB_UPLOAD_TTL_SECONDS
+from app.segment_log import SegmentLogStore
+from app.profiling import instrument
+from app.snapshot import Snapshot, SNAPSHOT_PATH, SNAPSHOT_WARM_MS, room_state, write_snapshot
+
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", 50))
+HISTORY_PAGE_MAX = int(os.environ.get("HISTORY_PAGE_MAX", 200))
+HYDRATED_ROOMS_MAX = int(os.environ.get("HYDRATED_ROOMS_MAX", 1000))
+HYDRATED_MESSAGES_MAX = int(os.environ.get("HYDRATED_MESSAGES_MAX", 500000))
+# Where persistent rooms keep their messages: "sql" rows or "log" segment files (rooms stay in SQL)
+PERSISTENCE_BACKEND = os.environ.get("PERSISTENCE_BACKEND", "sql")
 
 class InMemoryStorage:
     def __init__(self):
         self.rooms: Dict[str, dict] = {}
-        self.messages: Dict[str, List[dict]] = {}
-        self.users: Dict[str, dict] = {}
+        self.messages: Dict[str, RoomMessageStore] = {}
         self.file_shares: Dict[str, List[dict]] = {}
+        # Shares of each blob held by ephemeral rooms; persistent rooms' shares are in the database
+        self.blob_refs: Dict[str, int] = {}
+        # Called as observer(op, *args) after each mutation (see app.cluster)
+        self.observer: Optional[Callable[..., None]] = None
+        # Rooms from the last shutdown's snapshot that are not restored yet
+        self.snapshot: Optional[Snapshot] = None
+        self._restore_task: Optional[asyncio.Task] = None
+        self._sweep_task: Optional[asyncio.Task] = None
     
     def create_room(self, room_id: str, room_data: dict) -> dict:
         self.rooms[room_id] = room_data
-        self.messages[room_id] = []
+        self.messages[room_id] = RoomMessageStore()
         self.file_shares[room_id] = []
+        self._notify('create_room', room_id, room_data)
         return room_data
     
     def get_room(self, room_id: str) -> Optional[dict]:
-        return self.rooms.get(room_id)
+        room = self.rooms.get(room_id)
+        if room is None and self.snapshot is not None and room_id in self.snapshot:
+            room = self.restore_room(room_id)
+        return room
     
     def update_room_passphrase(self, room_id: str, passphrase_hash: str):
         if room_id in self.rooms:
             self.rooms[room_id]['passphrase_hash'] = passphrase_hash
-            self.messages[room_id] = []
+            self.messages[room_id] = RoomMessageStore()
+            self._notify('update_room_passphrase', room_id, passphrase_hash)
     
     def delete_room(self, room_id: str):
-        self.rooms.pop(room_id, None)
+        if self.snapshot is not None:
+            self.snapshot.discard(room_id)
+        room = self.rooms.pop(room_id, None)
         self.messages.pop(room_id, None)
-        self.file_shares.pop(room_id, None)
-        users_to_remove = [uid for uid, u in self.users.items() if u.get('room_id') == room_id]
-        for uid in users_to_remove:
-            del self.users[uid]
+        file_shares = self.file_shares.pop(room_id, [])
+        # Ephemeral rooms leave nothing behind, including uploaded files other rooms do not share
+        if room and room.get('storage_mode') != 'persistent':
+            blob_ids = [f['blobId'] for f in file_shares if f.get('blobId')]
+            for blob_id in blob_ids:
+                remaining = self.blob_refs.get(blob_id, 0) - 1
+                if remaining > 0:
+                    self.blob_refs[blob_id] = remaining
+                else:
+                    self.blob_refs.pop(blob_id, None)
+            self.release_blobs(blob_ids)
+        self._notify('delete_room', room_id)
     
     def add_message(self, room_id: str, message: dict) -> dict:
         if room_id not in self.messages:
-            self.messages[room_id] = []
+            self.messages[room_id] = RoomMessageStore()
+        # Oldest messages beyond the room's budget are dropped from memory
         self.messages[room_id].append(message)
+        self._notify('add_message', room_id, message)
         return message
     
     def get_messages(self, room_id: str) -> List[dict]:
-        return self.messages.get(room_id, [])
+        store = self.messages.get(room_id)
+        return list(store) if store else []
     
-    def delete_message(self, room_id: str, message_id: str):
-        if room_id in self.messages:
-            self.messages[room_id] = [m for m in self.messages[room_id] if m['id'] != message_id]
+    def get_messages_page(self, room_id: str, before: Optional[str] = None, limit: int = HISTORY_PAGE_SIZE) -> Tuple[List[dict], Optional[str]]:
+        """Return up to `limit` newest messages before the `before` cursor, plus the cursor for the next page."""
+        store = self.messages.get(room_id)
+        if not store:
+            return [], None
+        messages, older = store.page(parse_cursor(before), max(1, min(limit, HISTORY_PAGE_MAX)))
+        return messages, format_cursor(older)
+    
+    async def load_room(self, room_id: str) -> Optional[dict]:
+        """Like get_room, for callers that may be the first to touch a stored room."""
+        return self.get_room(room_id)
     
-    def add_user(self, user_id: str, user_data: dict) -> dict:
-        self.users[user_id] = user_data
-        return user_data
+    async def fetch_messages_page(self, room_id: str, before: Optional[str] = None, limit: int = HISTORY_PAGE_SIZE) -> Tuple[List[dict], Optional[str]]:
+        """Like get_messages_page, for callers that may page past what memory holds."""
+        return self.get_messages_page(room_id, before, limit)
     
-    def get_user(self, user_id: str) -> Optional[dict]:
-        return self.users.get(user_id)
+    def get_messages_after(self, room_id: str, message_id: str) -> Optional[List[dict]]:
+        """Messages newer than `message_id`, or None if it is unknown (evicted or deleted)."""
+        store = self.messages.get(room_id)
+        return store.after(message_id) if store else None
     
-    def get_users_by_room(self, room_id: str) -> List[dict]:
-        return [u for u in self.users.values() if u.get('room_id') == room_id]
+    def delete_message(self, room_id: str, message_id: str):
+        self.delete_messages(room_id, [message_id])
     
-    def remove_user(self, user_id: str):
-        self.users.pop(user_id, None)
+    def delete_messages(self, room_id: str, message_ids: List[str]) -> List[str]:
+        """Delete messages by id, returning the ids that were actually held."""
+        # Other workers may hold the room even when this one does not
+        self._notify('delete_messages', room_id, message_ids)
+        store = self.messages.get(room_id)
+        if not store:
+            return []
+        return [message_id for message_id in message_ids if store.delete(message_id) is not None]
+    
+    async def load_pending_expiries(self) -> List[Tuple[str, str, float]]:
+        return []
     
     def add_file_share(self, room_id: str, file_data: dict) -> dict:
         if room_id not in self.file_shares:
             self.file_shares[room_id] = []
         self.file_shares[room_id].append(file_data)
+        room = self.rooms.get(room_id)
+        if file_data.get('blobId') and room and room.get('storage_mode') != 'persistent':
+            self.blob_refs[file_data['blobId']] = self.blob_refs.get(file_data['blobId'], 0) + 1
+        self._notify('add_file_share', room_id, file_data)
         return file_data
     
     def get_file_shares(self, room_id: str) -> List[dict]:
         return self.file_shares.get(room_id, [])
+    
+    def room_has_blob(self, room_id: str, blob_id: str) -> bool:
+        return any(f.get('blobId') == blob_id for f in self.file_shares.get(room_id, []))
+    
+    def blob_unreferenced(self, blob_id: str) -> bool:
+        return not self.blob_refs.get(blob_id) and not blob_store.has_uploads(blob_id)
+    
+    def release_blobs(self, blob_ids: List[str]):
+        """Delete the blobs among `blob_ids` that no room shares and no upload is waiting on."""
+        for blob_id in set(blob_ids):
+            if self.blob_unreferenced(blob_id):
+                blob_store.delete(blob_id)
+    
+    async def _sweep_uploads(self):
+        """Delete uploads that were never shared, once their markers expire."""
+        while True:
+            await asyncio.sleep(min(60.0, BLOB_UPLOAD_TTL_SECONDS))
+            # Rooms still in the snapshot may share some of them
+            if self.snapshot is not None:
+                continue
+            try:
+                orphaned = await asyncio.to_thread(blob_store.sweep_uploads)
+                if orphaned:
+                    self.release_blobs(orphaned)
+            except Exception as e:
+                print(f"[BLOBS] Upload sweep failed: {e}")
+    
+    def apply_replicated(self, op: str, *args):
+        """Apply a mutation made by another worker to this worker's memory only."""
+        observer, self.observer = self.observer, None
+        try:
+            return getattr(InMemoryStorage, op)(self, *args)
+        finally:
+            self.observer = observer
+    
+    def _notify(self, op: str, *args):
+        if self.observer:
+            self.observer(op, *args)
+    
+    def restore_snapshot(self, snapshot: Snapshot, warm_ms: int = SNAPSHOT_WARM_MS) -> List[Tuple[str, str, float]]:
+        """Restore saved rooms for up to `warm_ms`, returning the snapshot's pending self-destruct timers.
+        
+        Whatever is left after the warm-up loads in a background task, or
+        immediately when someone asks for that room, so startup time does not
+        grow with the amount of saved state.
+        """
+        self.snapshot = snapshot
+        total = len(snapshot)
+        deadline = time.monotonic() + warm_ms / 1000
+        while len(snapshot) and time.monotonic() < deadline:
+            self.restore_room(snapshot.next_room())
+        print(f"[SNAPSHOT] Restored {total - len(snapshot)} of {total} rooms before accepting connections")
+        expiries = snapshot.expiries
+        if len(snapshot):
+            self._restore_task = asyncio.create_task(self._restore_remaining())
+        else:
+            self.close_snapshot()
+        return expiries
+    
+    def restore_room(self, room_id: str) -> Optional[dict]:
+        state = self.snapshot.take(room_id) if self.snapshot is not None else None
+        if state is None or room_id in self.rooms:
+            return self.rooms.get(room_id)
+        # Through the regular mutations, so other workers pick the room up too; each of
+        # them saves it on the way down, so the room carries its last activity itself
+        self.create_room(room_id, dict(state['room'], idleSince=state.get('activeAt', self.snapshot.saved_at)))
+        for message in state['messages']:
+            self.add_message(room_id, message)
+        for file_share in state['fileShares']:
+            self.add_file_share(room_id, file_share)
+        return self.rooms[room_id]
+    
+    async def _restore_remaining(self):
+        started = time.monotonic()
+        restored = 0
+        while self.snapshot is not None and len(self.snapshot):
+            self.restore_room(self.snapshot.next_room())
+            restored += 1
+            await asyncio.sleep(0)
+        print(f"[SNAPSHOT] Restored {restored} more rooms in the background ({time.monotonic() - started:.1f}s)")
+        self.close_snapshot()
+    
+    def close_snapshot(self):
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+    
+    def save_snapshot(self, path: str = SNAPSHOT_PATH) -> int:
+        """Save every ephemeral room to `path`; persistent rooms are already on disk."""
+        if not path:
+            return 0
+        # Rooms never restored from the previous snapshot belong in this one
+        while self.snapshot is not None and len(self.snapshot):
+            self.restore_room(self.snapshot.next_room())
+        rooms = []
+        saved_at = time.time()
+        for room_id, room in list(self.rooms.items()):
+            if room.get('storage_mode') == 'persistent':
+                continue
+            messages = self.get_messages(room_id)
+            # Empty ephemeral rooms are deleted, so a room is in use unless it was restored and nobody came back
+            active_at = saved_at
+            if room.get('idleSince') is not None and not registry.room_size(room_id):
+                active_at = max([room['idleSince']] + [m['timestamp'] / 1000 for m in messages[-1:]])
+            rooms.append((room_id, room_state(room, messages, self.get_file_shares(room_id), active_at)))
+        # Most recently active first, so the warm-up on the next start covers them
+        rooms.sort(key=lambda item: item[1]['messages'][-1]['timestamp'] if item[1]['messages'] else 0, reverse=True)
+        saved = write_snapshot(path, rooms)
+        print(f"[SNAPSHOT] Saved {saved} ephemeral rooms to {path}")
+        return saved
+    
+    def start(self):
+        if self._sweep_task is None or self._sweep_task.done():
+            self._sweep_task = asyncio.create_task(self._sweep_uploads())
+    
+    def shutdown(self):
+        if self._restore_task is not None:
+            self._restore_task.cancel()
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+        self.close_snapshot()
 
 
 class DualStorage(InMemoryStorage):
@@ -75,187 +263,341 @@ class DualStorage(InMemoryStorage):
     
     def __init__(self):
         super().__init__()
-        self.load_from_database()
+        self.writer = WriteBehindQueue()
+        # Hydrated persistent rooms, least recently used first
+        self.lru: "OrderedDict[str, None]" = OrderedDict()
+        self.log: Optional[SegmentLogStore] = None
+        if PERSISTENCE_BACKEND == "log":
+            self.log = SegmentLogStore()
+            # One fsync per write-behind batch instead of per message
+            self.writer.on_flush = self.log.sync
     
-    def load_from_database(self):
-        """Load all persistent rooms and messages from database on startup."""
-        db = SessionLocal()
-        try:
-            # Load all persistent rooms (convert enum to string)
-            from app.models import StorageMode
-            db_rooms = db.query(Room).filter(Room.storage_mode == StorageMode.PERSISTENT).all()
-            for room in db_rooms:
-                self.rooms[room.id] = {
-                    'id': room.id,
-                    'name': room.name,
-                    'passphrase_hash': room.passphrase_hash,
-                    'created_at': room.created_at,
-                    'storage_mode': room.storage_mode.value if hasattr(room.storage_mode, 'value') else room.storage_mode,  # Convert enum to string
-                    'created_by': room.created_by
-                }
-                self.messages[room.id] = []
-                self.file_shares[room.id] = []
-            
-            # Load all messages for persistent rooms (convert to camelCase for frontend)
-            for room_id in self.rooms.keys():
-                db_messages = db.query(Message).filter(Message.room_id == room_id).all()
-                for msg in db_messages:
-                    self.messages[room_id].append({
-                        'id': msg.id,
-                        'roomId': msg.room_id,
-                        'userId': msg.user_id,
-                        'username': msg.username,
-                        'content': msg.content,  # Correct field name
-                        'timestamp': msg.timestamp.timestamp() * 1000 if hasattr(msg.timestamp, 'timestamp') else msg.timestamp,
-                        'ttl': msg.ttl_seconds,  # Correct field name
-                        'signature': msg.signature,
-                        'publicKey': msg.public_key,
-                        'verified': msg.verified if hasattr(msg, 'verified') else False,
-                        'isSystem': msg.is_system  # Correct field name
-                    })
-            
-                # Load file shares (convert to camelCase for frontend)
-                db_files = db.query(FileShare).filter(FileShare.room_id == room_id).all()
-                for file in db_files:
-                    self.file_shares[room_id].append({
-                        'id': file.id,
-                        'roomId': file.room_id,
-                        'userId': file.user_id,
-                        'username': file.username,
-                        'filename': file.filename,
-                        'encryptedData': file.encrypted_data,
-                        'mimeType': file.mime_type,
-                        'fileSize': file.file_size,
-                        'signature': file.signature,
-                        'timestamp': file.timestamp.timestamp() * 1000 if hasattr(file.timestamp, 'timestamp') else file.timestamp
-                    })
-        finally:
-            db.close()
+    async def load_room(self, room_id: str) -> Optional[dict]:
+        """Return a room, hydrating it from the database on first access."""
+        room = self.get_room(room_id)
+        if room or not room_id:
+            return room
+        
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(select(Room).where(Room.id == room_id))).scalar_one_or_none()
+            if not row:
+                return None
+            # Only the newest messages fit in the room's in-memory budget
+            if self.log is not None:
+                newest, older = await asyncio.to_thread(self.log.page, room_id, None, ROOM_MAX_MESSAGES)
+                truncated = older is not None
+            else:
+                db_messages = (await db.execute(
+                    select(Message).where(Message.room_id == room_id)
+                    .order_by(Message.timestamp.desc(), Message.id.desc()).limit(ROOM_MAX_MESSAGES)
+                )).scalars().all()
+                newest = [message_from_row(msg) for msg in reversed(db_messages)]
+                truncated = len(db_messages) >= ROOM_MAX_MESSAGES
+            db_files = (await db.execute(
+                select(FileShare).where(FileShare.room_id == room_id).order_by(FileShare.timestamp)
+            )).scalars().all()
+        
+        if room_id in self.rooms:
+            # Someone else hydrated or recreated it while we were reading
+            return self.rooms[room_id]
+        
+        messages = RoomMessageStore()
+        for message in newest:
+            messages.append(message)
+        if truncated and newest:
+            # Older messages may share the oldest loaded millisecond; pages read that one from the database
+            messages.evicted_ts = newest[0]['timestamp']
+        
+        room_data = room_from_row(row)
+        self.rooms[room_id] = room_data
+        self.messages[room_id] = messages
+        self.file_shares[room_id] = [file_share_from_row(f) for f in db_files]
+        self.lru[room_id] = None
+        self.evict_cold_rooms(keep=room_id)
+        return room_data
     
-    def create_room(self, room_id: str, room_data: dict) -> dict:
-        # Create in memory
-        result = super().create_room(room_id, room_data)
+    async def fetch_messages_page(self, room_id: str, before: Optional[str] = None, limit: int = HISTORY_PAGE_SIZE) -> Tuple[List[dict], Optional[str]]:
+        """History page from memory, continuing into the database where memory runs out.
+        
+        Memory holds only a room's newest messages and is complete only for
+        those stamped after the newest one it dropped; older pages of a
+        persistent room are keyset queries on (room_id, timestamp, id), or
+        sparse-index lookups in its segment log.
+        """
+        limit = max(1, min(limit, HISTORY_PAGE_MAX))
+        store = self.messages.get(room_id)
+        if not (store and store.truncated and self.is_persistent(room_id)):
+            return self.get_messages_page(room_id, before, limit)
+        
+        key = parse_cursor(before)
+        messages, older = store.page(key, limit, after=store.evicted_ts)
+        if older is not None:
+            return messages, format_cursor(older)
+        boundary = message_key(messages[0]) if messages else key
+        if len(messages) >= limit:
+            # Memory ends exactly here; the next page comes from the database
+            return messages, format_cursor(boundary)
+        
+        wanted = limit - len(messages)
+        if self.log is not None:
+            older_messages, older = await asyncio.to_thread(self.log.page, room_id, boundary, wanted)
+            return older_messages + messages, format_cursor(older)
+        query = select(Message).where(Message.room_id == room_id)
+        if boundary is not None:
+            stamp = datetime.utcfromtimestamp(boundary[0] / 1000)
+            query = query.where(Message.timestamp <= stamp, or_(Message.timestamp < stamp, Message.id < boundary[1]))
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(wanted + 1)
+            )).scalars().all()
         
-        # If persistent mode, also save to database
+        older_messages = [message_from_row(row) for row in reversed(rows[:wanted])]
+        older = message_key(older_messages[0]) if len(rows) > wanted else None
+        return older_messages + messages, format_cursor(older)
+    
+    def evict_cold_rooms(self, keep: Optional[str] = None):
+        """Drop least recently used persistent rooms until back under budget.
+        
+        Only rooms with nobody connected and no queued writes are evicted;
+        they are hydrated again from the database on next access.
+        """
+        total_messages = sum(len(self.messages.get(room_id, [])) for room_id in self.lru)
+        for room_id in list(self.lru):
+            if len(self.lru) <= HYDRATED_ROOMS_MAX and total_messages <= HYDRATED_MESSAGES_MAX:
+                break
+            if room_id == keep or registry.room_size(room_id) or self.writer.pending_for(room_id):
+                continue
+            total_messages -= len(self.messages.get(room_id, []))
+            self.evict_room(room_id)
+    
+    def evict_room(self, room_id: str):
+        self.lru.pop(room_id, None)
+        self.rooms.pop(room_id, None)
+        self.messages.pop(room_id, None)
+        self.file_shares.pop(room_id, None)
+    
+    def apply_replicated(self, op: str, *args):
+        room_id = args[0]
+        if op in ('add_message', 'add_file_share') and room_id not in self.rooms:
+            # Not hydrated here; the database has it for the next access
+            return
+        super().apply_replicated(op, *args)
+        if op == 'create_room' and args[1].get('storage_mode') == 'persistent':
+            self.lru[room_id] = None
+        elif op == 'delete_room':
+            self.lru.pop(room_id, None)
+    
+    def start(self):
+        super().start()
+        self.writer.start()
+        if self.log is not None:
+            self.log.start()
+    
+    def shutdown(self):
+        """Flush pending writes; called from the app lifespan on shutdown."""
+        super().shutdown()
+        self.writer.stop()
+        if self.log is not None:
+            self.log.stop()
+    
+    def create_room(self, room_id: str, room_data: dict) -> dict:
+        # If persistent mode, queue the database insert ahead of any messages
         if room_data.get('storage_mode') == 'persistent':
-            db = SessionLocal()
-            try:
-                db_room = Room(
-                    id=room_id,
-                    name=room_data['name'],
-                    passphrase_hash=room_data['passphrase_hash'],
-                    created_by=room_data.get('created_by'),
-                    storage_mode='persistent'
-                )
-                db.add(db_room)
-                db.commit()
-            finally:
-                db.close()
+            self.writer.insert(Room, {
+                'id': room_id,
+                'name': room_data['name'],
+                'passphrase_hash': room_data['passphrase_hash'],
+                'created_by': room_data.get('created_by'),
+                'storage_mode': StorageMode.PERSISTENT
+            }, key=room_id)
+            self.lru[room_id] = None
         
-        return result
+        return super().create_room(room_id, room_data)
     
     def get_room(self, room_id: str) -> Optional[dict]:
-        # Try memory first
+        # Memory only; load_room hydrates persistent rooms without blocking the event loop
         room = super().get_room(room_id)
-        if room:
-            return room
-        
-        # Fall back to database
-        db = SessionLocal()
-        try:
-            db_room = db.query(Room).filter(Room.id == room_id).first()
-            if db_room:
-                room_data = {
-                    'id': db_room.id,
-                    'name': db_room.name,
-                    'passphrase_hash': db_room.passphrase_hash,
-                    'created_at': db_room.created_at,
-                    'storage_mode': db_room.storage_mode,
-                    'created_by': db_room.created_by
-                }
-                # Cache in memory
-                self.rooms[room_id] = room_data
-                return room_data
-        finally:
-            db.close()
-        
-        return None
+        if room and room_id in self.lru:
+            self.lru.move_to_end(room_id)
+        return room
     
-    def add_message(self, room_id: str, message: dict) -> dict:
-        # Add to memory
-        result = super().add_message(room_id, message)
-        
-        # If room is persistent, save to database
+    def delete_room(self, room_id: str):
+        # Rehydrating a persistent room before its queued writes land would lose them;
+        # keep it in memory like any other recent room and let the LRU evict it later
+        if room_id in self.lru and self.writer.pending_for(room_id):
+            return
+        self.lru.pop(room_id, None)
+        super().delete_room(room_id)
+    
+    def is_persistent(self, room_id: str) -> bool:
         room = self.get_room(room_id)
-        if room and room.get('storage_mode') == 'persistent':
-            db = SessionLocal()
-            try:
-                db_message = Message(
-                    id=message['id'],
-                    room_id=room_id,
-                    user_id=message['userId'],
-                    username=message['username'],
-                    content=message['content'],  # Correct field name
-                    ttl_seconds=message.get('ttl'),  # Correct field name
-                    signature=message.get('signature'),
-                    public_key=message.get('publicKey'),
-                    verified=message.get('verified', False),
-                    is_system=message.get('isSystem', False)  # Correct field name
-                )
-                db.add(db_message)
-                db.commit()
-            finally:
-                db.close()
+        return bool(room and room.get('storage_mode') == 'persistent')
+    
+    def add_message(self, room_id: str, message: dict) -> dict:
+        store = self.messages.get(room_id)
+        if store is not None:
+            # Persist the timestamp memory will keep
+            message['timestamp'] = store.in_order(message['timestamp'])
+        # Queue the database write first so a full queue leaves memory untouched
+        if self.is_persistent(room_id) and self.log is not None:
+            self.writer.call(lambda db: self.log.append(room_id, message), key=room_id, transactional=False)
+        elif self.is_persistent(room_id):
+            self.writer.insert(Message, {
+                'id': message['id'],
+                'room_id': room_id,
+                'user_id': message['userId'],
+                'username': message['username'],
+                'content': message['content'],
+                'timestamp': datetime.utcfromtimestamp(message['timestamp'] / 1000),
+                'ttl_seconds': message.get('ttl'),
+                'expires_at': datetime.utcfromtimestamp(message['timestamp'] / 1000 + message['ttl']) if message.get('ttl') else None,
+                'signature': message.get('signature'),
+                'public_key': message.get('publicKey'),
+                'verified': message.get('verified', False),
+                'is_system': message.get('isSystem', False)
+            }, key=room_id)
         
-        return result
+        return super().add_message(room_id, message)
     
     def update_room_passphrase(self, room_id: str, passphrase_hash: str):
-        # Update in memory
+        if self.is_persistent(room_id):
+            def update(db: Session):
+                db.query(Room).filter(Room.id == room_id).update({Room.passphrase_hash: passphrase_hash})
+                # Clear messages from database
+                if self.log is None:
+                    db.query(Message).filter(Message.room_id == room_id).delete()
+            self.writer.call(update, key=room_id)
+            if self.log is not None:
+                self.writer.call(lambda db: self.log.clear(room_id), key=room_id, transactional=False)
+        
         super().update_room_passphrase(room_id, passphrase_hash)
+    
+    def delete_messages(self, room_id: str, message_ids: List[str]) -> List[str]:
+        # Evicted persistent rooms are not in memory but still have rows to purge
+        room = self.rooms.get(room_id)
+        # Segment logs skip expired messages on read and drop them when compacting
+        if self.log is None and (room is None or room.get('storage_mode') == 'persistent'):
+            def purge(db: Session):
+                db.query(Message).filter(Message.id.in_(message_ids)).delete(synchronize_session=False)
+            self.writer.call(purge, key=room_id)
         
-        # Update in database if persistent
-        room = self.get_room(room_id)
-        if room and room.get('storage_mode') == 'persistent':
-            db = SessionLocal()
-            try:
-                db_room = db.query(Room).filter(Room.id == room_id).first()
-                if db_room:
-                    db_room.passphrase_hash = passphrase_hash
-                    db.commit()
-                
-                # Clear messages from database
-                db.query(Message).filter(Message.room_id == room_id).delete()
-                db.commit()
-            finally:
-                db.close()
+        return super().delete_messages(room_id, message_ids)
     
-    def add_file_share(self, room_id: str, file_data: dict) -> dict:
-        # Add to memory
-        result = super().add_file_share(room_id, file_data)
+    async def load_pending_expiries(self) -> List[Tuple[str, str, float]]:
+        """(room id, message id, expires at) for every persisted self-destructing message still due."""
+        if self.log is not None:
+            return await asyncio.to_thread(self.log.pending_expiries)
+        # Both sides of `now` are range scans on ix_messages_expires_at
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(Message.room_id, Message.id, Message.expires_at).where(Message.expires_at > now)
+            )).all()
         
-        # If room is persistent, save to database
-        room = self.get_room(room_id)
-        if room and room.get('storage_mode') == 'persistent':
-            db = SessionLocal()
-            try:
-                db_file = FileShare(
-                    id=file_data['id'],
-                    room_id=room_id,
-                    user_id=file_data['userId'],
-                    username=file_data['username'],
-                    filename=file_data['filename'],
-                    encrypted_data=file_data['encryptedData'],
-                    mime_type=file_data['mimeType'],
-                    file_size=file_data['fileSize'],
-                    signature=file_data.get('signature')
-                )
-                db.add(db_file)
-                db.commit()
-            finally:
-                db.close()
+        # Already overdue: purge in one statement instead of arming a timer for each
+        def purge(db: Session):
+            db.query(Message).filter(Message.expires_at <= now).delete(synchronize_session=False)
+        self.writer.call(purge)
+        return [(room_id, message_id, utc_ms(expires_at) / 1000) for room_id, message_id, expires_at in rows]
+    
+    def release_blobs(self, blob_ids: List[str]):
+        # Persistent rooms' shares may still be queued; deciding on the writer thread sees them all
+        candidates = [blob_id for blob_id in set(blob_ids) if self.blob_unreferenced(blob_id)]
+        if not candidates:
+            return
+        
+        def release(db: Session):
+            shared = set(db.execute(
+                select(FileShare.blob_id).where(FileShare.blob_id.in_(candidates)).distinct()
+            ).scalars())
+            for blob_id in candidates:
+                if blob_id not in shared and self.blob_unreferenced(blob_id):
+                    blob_store.delete(blob_id)
         
-        return result
+        try:
+            self.writer.call(release)
+        except PersistenceQueueFull:
+            print(f"[BLOBS] Persistence queue full, keeping {len(candidates)} possibly unused blobs")
+    
+    def add_file_share(self, room_id: str, file_data: dict) -> dict:
+        if self.is_persistent(room_id):
+            self.writer.insert(FileShare, {
+                'id': file_data['id'],
+                'room_id': room_id,
+                'user_id': file_data['userId'],
+                'username': file_data['username'],
+                'filename': file_data['filename'],
+                'blob_id': file_data['blobId'],
+                'mime_type': file_data['mimeType'],
+                'file_size': file_data['fileSize'],
+                'timestamp': datetime.utcfromtimestamp(file_data['timestamp'] / 1000),
+                'signature': file_data.get('signature')
+            }, key=room_id)
+        
+        return super().add_file_share(room_id, file_data)
+
+
+def utc_ms(value) -> float:
+    """Milliseconds since the epoch for a naive UTC datetime column (rows are written with utcfromtimestamp)."""
+    if not hasattr(value, 'timestamp'):
+        return value
+    return value.replace(tzinfo=timezone.utc).timestamp() * 1000
+
+
+def room_from_row(room: Room) -> dict:
+    return {
+        'id': room.id,
+        'name': room.name,
+        'passphrase_hash': room.passphrase_hash,
+        'created_at': room.created_at,
+        'storage_mode': room.storage_mode.value if hasattr(room.storage_mode, 'value') else room.storage_mode,  # Convert enum to string
+        'created_by': room.created_by
+    }
+
+
+def message_from_row(msg: Message) -> dict:
+    # camelCase for the frontend
+    return {
+        'id': msg.id,
+        'roomId': msg.room_id,
+        'userId': msg.user_id,
+        'username': msg.username,
+        'content': msg.content,
+        'timestamp': utc_ms(msg.timestamp),
+        'ttl': msg.ttl_seconds,
+        'signature': msg.signature,
+        'publicKey': msg.public_key,
+        'verified': msg.verified if hasattr(msg, 'verified') else False,
+        'isSystem': msg.is_system
+    }
+
+
+def file_share_from_row(file: FileShare) -> dict:
+    file_share = {
+        'id': file.id,
+        'roomId': file.room_id,
+        'userId': file.user_id,
+        'username': file.username,
+        'filename': file.filename,
+        'blobId': file.blob_id,
+        'mimeType': file.mime_type,
+        'fileSize': file.file_size,
+        'signature': file.signature,
+        'timestamp': utc_ms(file.timestamp)
+    }
+    if file.blob_id is None:
+        # Inline upload from before the blob store that init_db could not move
+        file_share['encryptedData'] = file.encrypted_data
+    return file_share
+
 
+# Storage calls show up in slow-handler breakdowns (see app.profiling)
+instrument(DualStorage, "storage", (
+    'load_room', 'fetch_messages_page', 'create_room', 'delete_room', 'add_message', 'delete_messages',
+    'add_file_share', 'update_room_passphrase'
+))
 
-# Use DualStorage by default (supports both ephemeral and persistent modes)
+# Use DualStorage by default (supports both ephemeral and persistent modes).
+# Constructing it touches neither the database nor the disk; the app lifespan
+# starts it once tables exist.
 memory_storage = DualStorage()
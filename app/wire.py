@@ -0,0 +1,41 @@
+import base64
+import binascii
+import os
+from typing import Optional, Union
+
+# Ciphertext at least this long (as base64) goes out as a binary attachment.
+# Each attachment is one more WebSocket frame per recipient, which costs more
+# server CPU than the base64 overhead saves on short messages
+# (see benchmarks/bench_wire_format.py)
+WIRE_BINARY_MIN_BYTES = int(os.environ.get("WIRE_BINARY_MIN_BYTES", 4096))
+
+
+def wire_room(room_id: str, binary: bool) -> str:
+    """Socket.IO room for the members of `room_id` that chose this encoding."""
+    return f"{'bin' if binary else 'json'}:{room_id}"
+
+
+def b64_to_bytes(value: Optional[str]) -> Optional[Union[str, bytes]]:
+    """Decode canonical base64, or hand the value back unchanged if it is not."""
+    if not isinstance(value, str):
+        return value
+    try:
+        raw = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        return value
+    # Only a byte-exact round trip is safe: the signature covers the base64 text
+    return raw if base64.b64encode(raw).decode('ascii') == value else value
+
+
+def to_binary(message: dict, min_bytes: int = WIRE_BINARY_MIN_BYTES) -> dict:
+    """Binary form of a message broadcast.
+
+    The sender's public key is dropped; binary clients take it from the
+    member list. Long ciphertext travels as raw bytes, which Socket.IO sends
+    as a binary attachment instead of base64 inside the JSON text.
+    """
+    packed = {k: v for k, v in message.items() if k != 'publicKey'}
+    content = message.get('content')
+    if isinstance(content, str) and len(content) >= min_bytes:
+        packed['content'] = b64_to_bytes(content)
+    return packed
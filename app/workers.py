@@ -0,0 +1,63 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+from app.profiling import span
+
+
+class WorkerPoolBusy(Exception):
+    """Raised when a worker pool has no room left in its queue."""
+
+
+class WorkerPool:
+    """Thread pool with a concurrency cap and a bounded backlog.
+
+    CPU-heavy calls (bcrypt, signature checks) run here instead of on the
+    event loop. Once `max_queue` jobs are waiting behind the `max_workers`
+    running ones, new submissions fail fast with `WorkerPoolBusy` so callers
+    can ask the client to retry rather than piling up latency.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queued(self) -> int:
+        return max(0, self._in_flight - self.max_workers)
+
+    async def run(self, fn: Callable, *args):
+        if self._in_flight >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise WorkerPoolBusy(f"{self.name} pool is busy")
+
+        self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            # Queue wait included: that is what the caller experiences
+            with span(f"pool.{self.name}"):
+                return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self._in_flight -= 1
+            self.completed += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'in_flight': self._in_flight,
+            'queued': self.queued,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
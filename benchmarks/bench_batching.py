@@ -0,0 +1,91 @@
+"""Broadcast fan-out cost with and without the adaptive room batcher.
+
+Runs the server twice, with BROADCAST_BATCH_MAX_MS=0 (one frame per
+message) and with `--max-ms`. Each run joins `--receivers` clients to one
+room and has a sender push `--rate` messages per second for `--duration`
+seconds, then sends `--quiet` messages a second apart. Reports server CPU
+per delivered message and end-to-end latency for the busy burst and for the
+quiet tail, where the batcher should step aside.
+
+    python -m benchmarks.bench_batching [--receivers 100 --rate 200 --duration 5 --max-ms 20]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.bench_wire_format import cpu_seconds
+from benchmarks.common import BenchClient, create_room, run_server, summarize
+
+
+async def fan_out(url: str, pid: int, args) -> dict:
+    room_id = await create_room(url)
+    sender = BenchClient(url, room_id)
+    listeners = [BenchClient(url, room_id) for _ in range(args.receivers)]
+    samples = {'busy': [], 'quiet': []}
+    delivered = 0
+
+    async def on_message(msg):
+        nonlocal delivered
+        delivered += 1
+        sent = json.loads(msg['content'])
+        samples[sent['phase']].append((time.perf_counter() - sent['t']) * 1000)
+
+    for client in listeners:
+        client.on('message_broadcast', on_message)
+    clients = [sender] + listeners
+    await asyncio.gather(*(c.connect() for c in clients))
+    for client in clients:
+        await client.join()
+
+    async def send(phase: str):
+        await sender.send(json.dumps({'phase': phase, 't': time.perf_counter()}))
+
+    before = cpu_seconds(pid)
+    interval = 1 / args.rate
+    started = time.perf_counter()
+    sent = 0
+    while time.perf_counter() - started < args.duration:
+        await send('busy')
+        sent += 1
+        # Keep the average rate even when the event loop falls behind
+        await asyncio.sleep(max(0.0, started + sent * interval - time.perf_counter()))
+    expected = sent * args.receivers
+    deadline = time.perf_counter() + 60
+    while delivered < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    used = cpu_seconds(pid) - before
+
+    for _ in range(args.quiet):
+        await asyncio.sleep(1)
+        await send('quiet')
+    await asyncio.sleep(1)
+
+    await asyncio.gather(*(c.close() for c in clients))
+    return {
+        'sent': sent,
+        'delivered': delivered,
+        'server_cpu_us_per_delivery': round(used / max(delivered, 1) * 1e6, 2),
+        'busy_ms': summarize(samples['busy']),
+        'quiet_ms': summarize(samples['quiet'])
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--receivers", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=200, help="messages per second during the burst")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--quiet", type=int, default=5, help="messages sent a second apart afterwards")
+    parser.add_argument("--max-ms", type=float, default=20, help="BROADCAST_BATCH_MAX_MS for the batched run")
+    args = parser.parse_args()
+
+    results = {}
+    for name, max_ms in (('unbatched', 0), ('batched', args.max_ms)):
+        with run_server(env={"BROADCAST_BATCH_MAX_MS": str(max_ms)}) as (url, proc):
+            results[name] = asyncio.run(fan_out(url, proc.pid, args))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Broadcast latency in one room while another room absorbs a join storm.
+
+A sender/receiver pair in room A exchange a message every 20 ms while 200
+clients join room B concurrently. With bcrypt on the event loop each join
+stalls every room; with the passphrase worker pool room A stays responsive.
+
+    python -m benchmarks.bench_join_storm [--joins 200]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import BenchClient, create_room, run_server, summarize
+
+
+async def measure(url: str, joins: int) -> dict:
+    quiet_room = await create_room(url)
+    storm_room = await create_room(url)
+
+    sender = BenchClient(url, quiet_room)
+    receiver = BenchClient(url, quiet_room)
+    latencies = []
+    sent_at = {}
+
+    async def on_message(msg):
+        started = sent_at.pop(msg['content'], None)
+        if started is not None:
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    receiver.on('message_broadcast', on_message)
+    for client in (sender, receiver):
+        await client.connect()
+        await client.join()
+
+    storm_clients = [BenchClient(url, storm_room) for _ in range(joins)]
+    await asyncio.gather(*(c.connect() for c in storm_clients))
+
+    stop = asyncio.Event()
+
+    async def ping_loop():
+        seq = 0
+        while not stop.is_set():
+            content = f"ping-{seq}"
+            sent_at[content] = time.perf_counter()
+            await sender.send(content)
+            seq += 1
+            await asyncio.sleep(0.02)
+
+    pinger = asyncio.create_task(ping_loop())
+    await asyncio.sleep(0.5)
+    baseline_count = len(latencies)
+
+    storm_start = time.perf_counter()
+    join_times = await asyncio.gather(*(c.join() for c in storm_clients))
+    storm_seconds = time.perf_counter() - storm_start
+
+    stop.set()
+    await pinger
+    await asyncio.sleep(0.2)
+
+    for client in storm_clients + [sender, receiver]:
+        await client.close()
+
+    return {
+        'joins': joins,
+        'storm_seconds': round(storm_seconds, 3),
+        'join_latency_ms': summarize([t * 1000 for t in join_times]),
+        'baseline_broadcast_ms': summarize(latencies[:baseline_count]),
+        'storm_broadcast_ms': summarize(latencies[baseline_count:])
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--joins", type=int, default=200)
+    args = parser.parse_args()
+
+    with run_server() as (url, _):
+        result = asyncio.run(measure(url, args.joins))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
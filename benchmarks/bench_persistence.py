@@ -0,0 +1,100 @@
+"""Persistent-room write and history-read cost: SQL rows vs segment logs.
+
+Appends `--messages` messages to one persistent room through DualStorage
+with each backend, timing until the write-behind queue has drained, then
+hydrates the room in a fresh storage and pages through all its history.
+
+    python -m benchmarks.bench_persistence [--messages 20000] [--size 256]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+
+def run_backend(backend: str, messages: int, size: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f"zerochat-{backend}-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ["PERSISTENCE_BACKEND"] = backend
+    os.environ["LOG_DIR"] = os.path.join(workdir, "log")
+    os.environ["ROOM_MAX_MESSAGES"] = "1000"
+
+    from app.database import init_db, close_db
+    from app.expiry import now
+    from app.storage import DualStorage
+    init_db()
+
+    room_id = str(uuid.uuid4())
+    storage = DualStorage()
+    storage.start()
+    storage.create_room(room_id, {'id': room_id, 'name': 'bench', 'passphrase_hash': 'x', 'created_by': 'bench',
+                                  'storage_mode': 'persistent'})
+    content = base64.b64encode(os.urandom(size)).decode()
+    base = now() * 1000
+
+    start = time.perf_counter()
+    for i in range(messages):
+        storage.add_message(room_id, {
+            'id': uuid.uuid4().hex, 'roomId': room_id, 'userId': 'u', 'username': 'bench', 'content': content,
+            'timestamp': base + i, 'ttl': None, 'signature': None, 'publicKey': None, 'verified': False,
+            'isSystem': False
+        })
+    enqueue_seconds = time.perf_counter() - start
+    storage.shutdown()
+    write_seconds = time.perf_counter() - start
+
+    async def read_all() -> tuple:
+        fresh = DualStorage()
+        started = time.perf_counter()
+        await fresh.load_room(room_id)
+        hydrate = time.perf_counter() - started
+        seen, cursor = 0, None
+        started = time.perf_counter()
+        while True:
+            page, cursor = await fresh.fetch_messages_page(room_id, before=cursor, limit=200)
+            seen += len(page)
+            if cursor is None:
+                break
+        pages = time.perf_counter() - started
+        await close_db()
+        return hydrate, pages, seen
+
+    hydrate_seconds, page_seconds, seen = asyncio.run(read_all())
+    return {
+        'enqueue_per_sec': round(messages / enqueue_seconds),
+        'durable_writes_per_sec': round(messages / write_seconds),
+        'hydrate_ms': round(hydrate_seconds * 1000, 1),
+        'full_history_ms': round(page_seconds * 1000, 1),
+        'messages_read': seen
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=256, help="ciphertext bytes per message before base64")
+    parser.add_argument("--backend", choices=["sql", "log"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        print(json.dumps(run_backend(args.backend, args.messages, args.size)))
+        return
+
+    # Backends are chosen at import time, so each one runs in its own interpreter
+    import subprocess
+    results = {}
+    for backend in ("sql", "log"):
+        out = subprocess.run([sys.executable, "-m", "benchmarks.bench_persistence", "--backend", backend,
+                              "--messages", str(args.messages), "--size", str(args.size)],
+                             capture_output=True, text=True, check=True).stdout
+        results[backend] = json.loads(out.strip().splitlines()[-1])
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Connection registry lookups as the number of connected users grows.
+
+Compares the registry's indexed lookups with the full scans they replaced
+(room member listing, user -> sid, and removal) at increasing user counts.
+Rooms hold 10 users each, so an O(1)/O(room) lookup should stay flat.
+
+    python -m benchmarks.bench_registry [--sizes 1000 5000 20000]
+"""
+import argparse
+import json
+import time
+
+from app.registry import ConnectionRegistry
+
+ROOM_SIZE = 10
+
+
+def populate(count: int):
+    registry = ConnectionRegistry()
+    users, clients = {}, {}
+    for i in range(count):
+        user = {'id': f"user{i}", 'username': f"name{i}", 'room_id': f"room{i // ROOM_SIZE}", 'is_admin': False}
+        registry.add_user(f"sid{i}", user)
+        users[user['id']] = user
+        clients[f"sid{i}"] = {'user_id': user['id'], 'username': user['username'], 'room_id': user['room_id']}
+    return registry, users, clients
+
+
+def scan_users_by_room(users, room_id):
+    return [u for u in users.values() if u.get('room_id') == room_id]
+
+
+def scan_sid_for_user(clients, user_id):
+    for sid, data in clients.items():
+        if data.get('user_id') == user_id:
+            return sid
+    return None
+
+
+def timed(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def measure(count: int, iterations: int) -> dict:
+    registry, users, clients = populate(count)
+    rooms = count // ROOM_SIZE
+    return {
+        'users': count,
+        'users_by_room_us': {
+            'scan': timed(lambda i: scan_users_by_room(users, f"room{i % rooms}"), iterations),
+            'registry': timed(lambda i: registry.get_users_by_room(f"room{i % rooms}"), iterations)
+        },
+        'sid_for_user_us': {
+            'scan': timed(lambda i: scan_sid_for_user(clients, f"user{(i * 7919) % count}"), iterations),
+            'registry': timed(lambda i: registry.get_sid(f"user{(i * 7919) % count}"), iterations)
+        },
+        'remove_and_add_us': {
+            'registry': timed(lambda i: registry.add_user(f"sid{i % count}", registry.remove_user(f"user{i % count}")), iterations)
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps([measure(size, args.iterations) for size in args.sizes], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""How long a passphrase change takes to clear a crowded room.
+
+Joins `--members` clients and an admin to one room, has the admin change the
+passphrase, and reports when every member had the `passphrase_changed`
+notice, when every member socket was closed, and the completion time the
+server reported to the admin. The bcrypt hash of the new passphrase is part
+of all three.
+
+    python -m benchmarks.bench_rekey [--members 200]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import BenchClient, create_room, run_server
+
+
+class AdminClient(BenchClient):
+    async def join(self, timeout: float = 60.0, retries: int = 100) -> float:
+        await self.sio.emit('join_room', {
+            'roomId': self.room_id,
+            'username': self.username,
+            'passphrase': self.passphrase,
+            'userId': self.user_id,
+            'isAdmin': True,
+            'publicKey': None
+        })
+        await asyncio.wait_for(self.joined.wait(), timeout)
+        return 0.0
+
+
+async def rekey(url: str, members: int) -> dict:
+    room_id = await create_room(url)
+    admin = AdminClient(url, room_id)
+    clients = [BenchClient(url, room_id) for _ in range(members)]
+    await asyncio.gather(admin.connect(), *(c.connect() for c in clients))
+    await admin.join()
+    # Joins queue for bcrypt anyway; a few at a time keeps them under the pool's queue limit
+    for start in range(0, members, 32):
+        await asyncio.gather(*(c.join() for c in clients[start:start + 32]))
+
+    noticed = asyncio.Event()
+    closed = asyncio.Event()
+    counts = {'noticed': 0, 'closed': 0}
+    done = asyncio.get_running_loop().create_future()
+
+    def counter(name: str, event: asyncio.Event):
+        async def handler(*_):
+            counts[name] += 1
+            if counts[name] == members:
+                event.set()
+        return handler
+
+    for client in clients:
+        client.on('passphrase_changed', counter('noticed', noticed))
+        client.sio.on('disconnect', counter('closed', closed))
+
+    async def on_complete(data):
+        done.set_result(data)
+
+    admin.on('passphrase_change_complete', on_complete)
+
+    started = time.perf_counter()
+    await admin.sio.emit('change_passphrase', {
+        'roomId': room_id,
+        'userId': admin.user_id,
+        'newPassphrase': 'rotated-benchmark-passphrase'
+    })
+    await asyncio.wait_for(noticed.wait(), 120)
+    noticed_at = time.perf_counter()
+    await asyncio.wait_for(closed.wait(), 120)
+    closed_at = time.perf_counter()
+    report = await asyncio.wait_for(done, 120)
+
+    await admin.close()
+    return {
+        'members': members,
+        'all_noticed_ms': round((noticed_at - started) * 1000, 1),
+        'all_closed_ms': round((closed_at - started) * 1000, 1),
+        'server_reported_ms': report['ms'],
+        'evicted': report['evicted']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=200)
+    args = parser.parse_args()
+
+    with run_server() as (url, _):
+        print(json.dumps(asyncio.run(rekey(url, args.members)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Broadcast throughput as the number of uvicorn workers grows.
+
+Each room has one sender and several receivers, all connected over plain
+websockets so the kernel spreads them across workers. Every sender pushes
+its messages as fast as the server accepts them; the result is the rate at
+which broadcasts reach receivers, which have to cross workers through the
+bundled broker whenever sender and receiver landed on different processes.
+
+    python -m benchmarks.bench_scaleout [--workers 1 2 4] [--rooms 8] [--receivers 4] [--messages 200]
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.common import BenchClient, create_room, run_server
+
+
+async def measure(url: str, rooms: int, receivers: int, messages: int) -> dict:
+    room_ids = [await create_room(url) for _ in range(rooms)]
+    # Room creation is replicated to the other workers asynchronously
+    await asyncio.sleep(0.5)
+
+    senders = [BenchClient(url, room_id) for room_id in room_ids]
+    listeners = [BenchClient(url, room_id) for room_id in room_ids for _ in range(receivers)]
+    expected = rooms * receivers * messages
+    delivered = 0
+    done = asyncio.Event()
+
+    async def on_message(msg):
+        nonlocal delivered
+        delivered += 1
+        if delivered >= expected:
+            done.set()
+
+    for client in listeners:
+        client.on('message_broadcast', on_message)
+    clients = senders + listeners
+    await asyncio.gather(*(c.connect() for c in clients))
+    for client in clients:
+        await client.join()
+
+    async def send_all(sender: BenchClient):
+        for seq in range(messages):
+            await sender.send(f"msg-{seq}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send_all(s) for s in senders))
+    try:
+        await asyncio.wait_for(done.wait(), timeout=120)
+    except asyncio.TimeoutError:
+        pass
+    seconds = time.perf_counter() - start
+
+    for client in clients:
+        await client.close()
+
+    return {
+        'delivered': delivered,
+        'expected': expected,
+        'seconds': round(seconds, 3),
+        'deliveries_per_second': round(delivered / seconds, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--rooms", type=int, default=8)
+    parser.add_argument("--receivers", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+
+    results = {'cpus': os.cpu_count()}
+    for workers in args.workers:
+        broker = os.path.join(tempfile.mkdtemp(prefix="zerochat-broker-"), "broker.sock")
+        env = {"CLUSTER_BROKER": broker} if workers > 1 else {}
+        with run_server(env=env, workers=workers) as (url, _):
+            results[f"workers_{workers}"] = asyncio.run(measure(url, args.rooms, args.receivers, args.messages))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Ed25519 verification throughput: parsing the SPKI key per message vs a cached key.
+
+    python -m benchmarks.bench_signatures [--messages 20000] [--size 256]
+"""
+import argparse
+import base64
+import json
+import os
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+from app.crypto_utils import load_public_key, verify_ed25519_signature, verify_signature
+
+
+def make_messages(count: int, size: int):
+    private_key = Ed25519PrivateKey.generate()
+    spki = private_key.public_key().public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+    public_key_b64 = base64.b64encode(spki).decode()
+    messages = []
+    for _ in range(count):
+        content = base64.b64encode(os.urandom(size)).decode()
+        signature = base64.b64encode(private_key.sign(content.encode())).decode()
+        messages.append((content, signature))
+    return public_key_b64, messages
+
+
+def rate(fn, messages) -> float:
+    start = time.perf_counter()
+    for content, signature in messages:
+        assert fn(content, signature)
+    return len(messages) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=256, help="plaintext bytes per message before base64")
+    args = parser.parse_args()
+
+    public_key_b64, messages = make_messages(args.messages, args.size)
+    cached_key = load_public_key(public_key_b64)
+
+    before = rate(lambda c, s: verify_ed25519_signature(c, s, public_key_b64), messages)
+    after = rate(lambda c, s: verify_signature(cached_key, c, s), messages)
+    print(json.dumps({
+        'messages': args.messages,
+        'payload_bytes': args.size,
+        'parse_per_message_per_sec': round(before),
+        'cached_key_per_sec': round(after),
+        'speedup': round(after / before, 2)
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
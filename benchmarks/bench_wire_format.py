@@ -0,0 +1,155 @@
+"""Size and encode cost of one `message_broadcast`: JSON/base64 vs binary attachments.
+
+Encodes the same signed message the way the server emits it to each group:
+the JSON form (base64 ciphertext, signature and SPKI key in the text) and
+the binary form from `app.wire.to_binary` (no key; ciphertext as a Socket.IO
+binary attachment once it reaches `--min-bytes` of base64). Sizes are what a
+WebSocket carries; encode time includes `to_binary`. Encoding happens once
+per emit, while bytes and frames are paid per recipient, so `--receivers`
+also runs a server and compares its CPU time for broadcasting `--messages`
+messages to a room of JSON clients against a room of binary clients.
+
+    python -m benchmarks.bench_wire_format [--size 256] [--min-bytes 4096] [--receivers 20 --messages 500]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from socketio import packet
+
+from app.wire import WIRE_BINARY_MIN_BYTES, to_binary
+from benchmarks.common import BenchClient, create_room, run_server
+
+
+def make_message(size: int) -> dict:
+    private_key = Ed25519PrivateKey.generate()
+    spki = private_key.public_key().public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+    # AES-GCM output as the browser sends it: 12-byte IV + ciphertext + 16-byte tag
+    content = base64.b64encode(os.urandom(12 + size + 16)).decode()
+    return {
+        'id': '1700000000000',
+        'roomId': 'a1b2c3d4e5f60718',
+        'userId': 'f0e1d2c3-b4a5-4697-8879-6a5b4c3d2e1f',
+        'username': 'alice',
+        'content': content,
+        'timestamp': 1700000000000.0,
+        'isSystem': False,
+        'ttl': None,
+        'signature': base64.b64encode(private_key.sign(content.encode())).decode(),
+        'publicKey': base64.b64encode(spki).decode(),
+        'verified': True
+    }
+
+
+def encode(message: dict):
+    return packet.Packet(packet.EVENT, namespace='/', data=['message_broadcast', message]).encode()
+
+
+def wire_bytes(encoded) -> int:
+    parts = encoded if isinstance(encoded, list) else [encoded]
+    # Engine.IO prefixes each text frame with its packet type; binary frames go as-is
+    return sum(len(p) if isinstance(p, bytes) else len(p.encode()) + 1 for p in parts)
+
+
+def per_call_us(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime, in clock ticks
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def broadcast_cpu(url: str, pid: int, binary: bool, receivers: int, messages: int, template: dict) -> dict:
+    room_id = await create_room(url)
+    sender = BenchClient(url, room_id)
+    listeners = [BenchClient(url, room_id, binary=binary) for _ in range(receivers)]
+    expected = receivers * messages
+    delivered = 0
+    done = asyncio.Event()
+
+    async def on_message(msg):
+        nonlocal delivered
+        delivered += 1
+        if delivered >= expected:
+            done.set()
+
+    for client in listeners:
+        client.on('message_broadcast', on_message)
+    clients = [sender] + listeners
+    await asyncio.gather(*(c.connect() for c in clients))
+    for client in clients:
+        await client.join()
+
+    before = cpu_seconds(pid)
+    start = time.perf_counter()
+    for _ in range(messages):
+        await sender.send(template['content'], signature=template['signature'])
+    try:
+        await asyncio.wait_for(done.wait(), timeout=120)
+    except asyncio.TimeoutError:
+        pass
+    seconds = time.perf_counter() - start
+    used = cpu_seconds(pid) - before
+
+    await asyncio.gather(*(c.close() for c in clients))
+    return {
+        'delivered': delivered,
+        'seconds': round(seconds, 3),
+        'server_cpu_seconds': round(used, 3),
+        'server_cpu_us_per_delivery': round(used / max(delivered, 1) * 1e6, 2)
+    }
+
+
+async def compare_servers(url: str, pid: int, args, template: dict) -> dict:
+    results = {}
+    for name, binary in (('json', False), ('binary', True)):
+        results[name] = await broadcast_cpu(url, pid, binary, args.receivers, args.messages, template)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=256, help="plaintext bytes per message")
+    parser.add_argument("--min-bytes", type=int, default=WIRE_BINARY_MIN_BYTES,
+                        help="WIRE_BINARY_MIN_BYTES; 0 sends every ciphertext as an attachment")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--receivers", type=int, default=0, help="also measure server CPU with this many receivers")
+    parser.add_argument("--messages", type=int, default=500)
+    args = parser.parse_args()
+
+    message = make_message(args.size)
+    json_bytes = wire_bytes(encode(message))
+    binary_bytes = wire_bytes(encode(to_binary(message, args.min_bytes)))
+    json_us = per_call_us(lambda: encode(message), args.iterations)
+    binary_us = per_call_us(lambda: encode(to_binary(message, args.min_bytes)), args.iterations)
+
+    result = {
+        'plaintext_bytes': args.size,
+        'attached': isinstance(to_binary(message, args.min_bytes)['content'], bytes),
+        'json_wire_bytes': json_bytes,
+        'binary_wire_bytes': binary_bytes,
+        'bytes_saved_pct': round((json_bytes - binary_bytes) / json_bytes * 100, 1),
+        'json_encode_us': round(json_us, 2),
+        'binary_encode_us': round(binary_us, 2),
+        'encode_saved_pct': round((json_us - binary_us) / json_us * 100, 1)
+    }
+    if args.receivers:
+        with run_server(env={"WIRE_BINARY_MIN_BYTES": str(args.min_bytes)}) as (url, proc):
+            result['server'] = asyncio.run(compare_servers(url, proc.pid, args, message))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Shared helpers for ZeroChat benchmarks.
+
+The benchmarks drive a real server (uvicorn running `main:socket_app` in a
+subprocess) with `python-socketio` clients, so they need the client extras:
+
+    pip install aiohttp "python-socketio[asyncio_client]"
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import aiohttp
+import socketio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    return {
+        'count': len(samples),
+        'p50': round(percentile(samples, 50), 3),
+        'p99': round(percentile(samples, 99), 3),
+        'max': round(max(samples), 3) if samples else 0.0
+    }
+
+
+@contextmanager
+def run_server(env: Optional[Dict[str, str]] = None, workers: int = 1, app: str = "main:socket_app"):
+    """Start uvicorn on a free localhost port with a throwaway SQLite DB."""
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="zerochat-bench-")
+    server_env = dict(os.environ)
+    server_env["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    # Benchmark senders push far past the per-client limits real users get
+    for name in ("INBOUND_MESSAGES_PER_SEC", "INBOUND_FILES_PER_SEC", "INBOUND_SIGNALS_PER_SEC"):
+        server_env[name] = "1000000"
+    server_env.update(env or {})
+
+    # Create the schema once up front; with --workers every worker runs init_db at startup and they would race on it
+    subprocess.run(
+        [sys.executable, "-c", "from app.database import init_db; init_db()"],
+        cwd=ROOT, env=server_env, check=True
+    )
+
+    cmd = [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1",
+           "--port", str(port), "--log-level", "warning", "--workers", str(workers)]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=server_env)
+    try:
+        url = f"http://127.0.0.1:{port}"
+        deadline = time.time() + 20
+        while time.time() < deadline:
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                    break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError("server did not start")
+        yield url, proc
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+async def create_room(url: str, passphrase: str = "benchmark-passphrase", storage_mode: str = "ephemeral") -> str:
+    async with aiohttp.ClientSession() as http:
+        async with http.post(f"{url}/api/rooms/create", json={
+            "roomName": "bench",
+            "passphrase": passphrase,
+            "createdBy": "bench",
+            "storageMode": storage_mode
+        }) as resp:
+            resp.raise_for_status()
+            return (await resp.json())["roomId"]
+
+
+class BenchClient:
+    """A Socket.IO client joined to one room."""
+
+    def __init__(self, url: str, room_id: str, passphrase: str = "benchmark-passphrase", binary: bool = False):
+        self.url = url
+        self.room_id = room_id
+        self.passphrase = passphrase
+        self.binary = binary
+        self.user_id = f"user_{uuid.uuid4().hex}"
+        self.username = f"u{uuid.uuid4().hex[:8]}"
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.joined = asyncio.Event()
+        self.errors: List[dict] = []
+
+        @self.sio.on('members_snapshot')
+        async def on_members(data):
+            if any(u.get('id') == self.user_id for u in data.get('members', [])):
+                self.joined.set()
+
+        @self.sio.on('error')
+        async def on_error(data):
+            self.errors.append(data)
+
+        # With BROADCAST_BATCH_MAX_MS set, busy rooms deliver room events in batches
+        @self.sio.on('message_batch')
+        async def on_batch(data):
+            for event, payload in data['events']:
+                handler = self.handlers.get(event)
+                if handler:
+                    await handler(payload)
+
+        self.handlers: Dict[str, object] = {}
+
+    def on(self, event: str, handler):
+        self.handlers[event] = handler
+        self.sio.on(event, handler)
+
+    async def connect(self):
+        await self.sio.connect(self.url, transports=['websocket'], socketio_path='/socket.io')
+
+    async def join(self, timeout: float = 60.0, retries: int = 100) -> float:
+        """Join the room, retrying when the server sheds load. Returns seconds taken."""
+        start = time.perf_counter()
+        for _ in range(retries):
+            self.errors.clear()
+            await self.sio.emit('join_room', {
+                'roomId': self.room_id,
+                'username': self.username,
+                'passphrase': self.passphrase,
+                'userId': self.user_id,
+                'isAdmin': False,
+                'publicKey': None,
+                'binary': self.binary
+            })
+            while not self.joined.is_set() and not self.errors:
+                if time.perf_counter() - start > timeout:
+                    raise TimeoutError("join timed out")
+                await asyncio.sleep(0.005)
+            if self.joined.is_set():
+                return time.perf_counter() - start
+            if not any(e.get('retry') for e in self.errors):
+                raise RuntimeError(self.errors[0].get('message'))
+            await asyncio.sleep(0.05)
+        raise RuntimeError("join kept being rejected as busy")
+
+    async def send(self, content: str, **extra):
+        await self.sio.emit('send_message', {
+            'roomId': self.room_id,
+            'userId': self.user_id,
+            'username': self.username,
+            'content': content,
+            **extra
+        })
+
+    async def close(self):
+        await self.sio.disconnect()
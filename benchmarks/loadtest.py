@@ -0,0 +1,279 @@
+"""Configurable load test: rooms, join storms, chat traffic, TTL, files, WebRTC.
+
+Starts the server through `benchmarks.probe` (or targets `--url`), joins
+`--rooms` rooms of `--room-size` clients in one storm, then for
+`--duration` seconds each room sends `--rate` messages per second (a
+`--ttl-fraction` of them self-destructing), `--files-per-min` file shares
+and `--signals` WebRTC signals per second. Prints one JSON document with
+join latency, broadcast p50/p99, message throughput, TTL lateness, file and
+signal latency, server event-loop lag and RSS; `--output` also writes it
+to a file and `--compare` diffs the headline numbers against an earlier run.
+
+    python -m benchmarks.loadtest --rooms 10 --room-size 20 --rate 5 --duration 20 --output run.json
+    python -m benchmarks.loadtest ... --compare run.json
+
+All clients run in this one process, so on a small machine the client side
+can saturate before the server does; compare runs made on the same box.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from typing import Dict, List
+
+import aiohttp
+
+from benchmarks.common import BenchClient, create_room, run_server, summarize
+from benchmarks.probe import read_rss_kb
+
+# (section, key) pairs compared by --compare; lower is better for all but throughput
+HEADLINE = [
+    ('joins', 'p99'),
+    ('broadcast_ms', 'p50'),
+    ('broadcast_ms', 'p99'),
+    ('messages', 'delivered_per_sec'),
+    ('server', 'loop_lag_p99_ms'),
+    ('server', 'peak_rss_mb'),
+]
+
+
+class Recorder:
+    """Latency samples and counters shared by every simulated client."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {
+            'broadcast': [], 'ttl_lateness': [], 'file_share': [], 'upload': [], 'signal': []
+        }
+        self.sent = 0
+        self.delivered = 0
+        self.ttl_due: Dict[str, float] = {}
+        self.files_started: Dict[str, float] = {}
+
+    def add(self, kind: str, started: float):
+        self.samples[kind].append((time.perf_counter() - started) * 1000)
+
+
+def wire(client: BenchClient, rec: Recorder):
+    async def on_message(msg):
+        rec.delivered += 1
+        rec.add('broadcast', json.loads(msg['content'])['t'])
+
+    async def on_deleted(data):
+        for message_id in data.get('messageIds', []):
+            due = rec.ttl_due.pop(message_id, None)
+            if due is not None:
+                rec.add('ttl_lateness', due)
+
+    async def on_file(share):
+        started = rec.files_started.get(share['blobId'])
+        if started is not None and share['userId'] != client.user_id:
+            rec.add('file_share', started)
+
+    async def on_signal(data):
+        rec.add('signal', data['data']['t'])
+
+    client.on('message_broadcast', on_message)
+    client.on('message_deleted', on_deleted)
+    client.on('file_shared', on_file)
+    client.on('webrtc_signal', on_signal)
+
+
+async def every(rate: float, stop: asyncio.Event, action):
+    """Call `action` `rate` times per second (jittered) until `stop` is set."""
+    if rate <= 0:
+        return
+    while not stop.is_set():
+        await asyncio.sleep(random.expovariate(rate))
+        if not stop.is_set():
+            await action()
+
+
+async def room_traffic(url: str, members: List[BenchClient], args, rec: Recorder, http: aiohttp.ClientSession,
+                       stop: asyncio.Event):
+    async def send_message():
+        sender = random.choice(members)
+        message_id = uuid.uuid4().hex
+        ttl = 1 if random.random() < args.ttl_fraction else None
+        if ttl:
+            rec.ttl_due[message_id] = time.perf_counter() + ttl
+        rec.sent += 1
+        await sender.send(json.dumps({'t': time.perf_counter()}), id=message_id, ttl=ttl)
+
+    async def share_file():
+        sharer = random.choice(members)
+        started = time.perf_counter()
+        payload = os.urandom(args.file_bytes)
+        async with http.post(f"{url}/api/rooms/{sharer.room_id}/blobs", params={'userId': sharer.user_id},
+                             data=payload) as resp:
+            blob = await resp.json()
+        rec.add('upload', started)
+        rec.files_started[blob['blobId']] = started
+        await sharer.sio.emit('share_file', {
+            'roomId': sharer.room_id,
+            'userId': sharer.user_id,
+            'username': sharer.username,
+            'filename': 'load.bin',
+            'blobId': blob['blobId'],
+            'mimeType': 'application/octet-stream',
+            'fileSize': args.file_bytes
+        })
+
+    async def signal():
+        if len(members) < 2:
+            return
+        caller, callee = random.sample(members, 2)
+        await caller.sio.emit('webrtc_signal', {
+            'targetUserId': callee.user_id,
+            'type': 'offer',
+            'data': {'t': time.perf_counter()},
+            'senderId': caller.user_id
+        })
+
+    await asyncio.gather(
+        every(args.rate, stop, send_message),
+        every(args.files_per_min / 60, stop, share_file),
+        every(args.signals, stop, signal)
+    )
+
+
+async def run_load(url: str, args) -> dict:
+    rec = Recorder()
+    room_ids = [await create_room(url) for _ in range(args.rooms)]
+    await asyncio.sleep(0.2)
+
+    rooms = {room_id: [BenchClient(url, room_id) for _ in range(args.room_size)] for room_id in room_ids}
+    clients = [c for members in rooms.values() for c in members]
+    for client in clients:
+        wire(client, rec)
+
+    gate = asyncio.Semaphore(args.join_concurrency)
+
+    async def connect_and_join(client: BenchClient) -> float:
+        async with gate:
+            await client.connect()
+            return await client.join()
+
+    storm_start = time.perf_counter()
+    join_times = await asyncio.gather(*(connect_and_join(c) for c in clients))
+    storm_seconds = time.perf_counter() - storm_start
+
+    stop = asyncio.Event()
+    window_start = time.time()
+    async with aiohttp.ClientSession() as http:
+        traffic = [asyncio.create_task(room_traffic(url, members, args, rec, http, stop))
+                   for members in rooms.values()]
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*traffic)
+    # Let in-flight broadcasts and the last TTL deletions arrive
+    await asyncio.sleep(1.5 if args.ttl_fraction else 0.5)
+    window_end = time.time()
+
+    errors = sum(len(c.errors) for c in clients)
+    await asyncio.gather(*(c.close() for c in clients))
+
+    return {
+        'joins': {**summarize([t * 1000 for t in join_times]), 'storm_seconds': round(storm_seconds, 3)},
+        'broadcast_ms': summarize(rec.samples['broadcast']),
+        'messages': {
+            'sent': rec.sent,
+            'delivered': rec.delivered,
+            'sent_per_sec': round(rec.sent / args.duration, 1),
+            'delivered_per_sec': round(rec.delivered / args.duration, 1)
+        },
+        'ttl_lateness_ms': summarize(rec.samples['ttl_lateness']),
+        'file_upload_ms': summarize(rec.samples['upload']),
+        'file_share_ms': summarize(rec.samples['file_share']),
+        'signal_ms': summarize(rec.samples['signal']),
+        'client_errors': errors,
+        'window': (window_start, window_end)
+    }
+
+
+def server_health(probe_dir: str, window) -> dict:
+    lag, rss, peak = [], 0, 0
+    for path in glob.glob(os.path.join(probe_dir, "*.json")):
+        with open(path) as f:
+            report = json.load(f)
+        lag.extend(ms for at, ms in report['lag'] if window[0] <= at <= window[1])
+        rss += report['rss_kb']
+        peak += report['peak_rss_kb']
+    summary = summarize(lag)
+    return {
+        'loop_lag_p50_ms': round(summary['p50'], 3),
+        'loop_lag_p99_ms': round(summary['p99'], 3),
+        'loop_lag_max_ms': round(summary['max'], 3),
+        'rss_mb': round(rss / 1024, 1),
+        'peak_rss_mb': round(peak / 1024, 1)
+    }
+
+
+def compare(current: dict, baseline: dict) -> dict:
+    diff = {}
+    for section, key in HEADLINE:
+        before = baseline.get(section, {}).get(key)
+        after = current.get(section, {}).get(key)
+        if before is None or after is None:
+            continue
+        diff[f"{section}.{key}"] = {
+            'before': before,
+            'after': after,
+            'change_pct': round((after - before) / before * 100, 1) if before else None
+        }
+    return diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Target a running server instead of starting one (no server metrics)")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--rooms", type=int, default=5)
+    parser.add_argument("--room-size", type=int, default=10)
+    parser.add_argument("--join-concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--rate", type=float, default=5, help="messages per second per room")
+    parser.add_argument("--ttl-fraction", type=float, default=0.1)
+    parser.add_argument("--files-per-min", type=float, default=6, help="file shares per minute per room")
+    parser.add_argument("--file-bytes", type=int, default=64 * 1024)
+    parser.add_argument("--signals", type=float, default=1, help="WebRTC signals per second per room")
+    parser.add_argument("--output", help="Also write the JSON report here")
+    parser.add_argument("--compare", help="Earlier JSON report to compare the headline numbers against")
+    args = parser.parse_args()
+
+    config = {k: v for k, v in vars(args).items() if k not in ('output', 'compare')}
+    if args.url:
+        result = asyncio.run(run_load(args.url, args))
+        result.pop('window')
+        result['server'] = {}
+    else:
+        probe_dir = tempfile.mkdtemp(prefix="zerochat-probe-")
+        env = {"BENCH_PROBE_DIR": probe_dir}
+        if args.workers > 1:
+            env["CLUSTER_BROKER"] = os.path.join(probe_dir, "broker.sock")
+        try:
+            with run_server(env=env, workers=args.workers, app="benchmarks.probe:app") as (url, _):
+                result = asyncio.run(run_load(url, args))
+                # Give the probes a moment to write their last samples
+                time.sleep(1.2)
+                result['server'] = server_health(probe_dir, result.pop('window'))
+        finally:
+            shutil.rmtree(probe_dir, ignore_errors=True)
+
+    report = {'config': config, 'client_rss_mb': round(read_rss_kb()['peak_rss_kb'] / 1024, 1), **result}
+    if args.compare:
+        with open(args.compare) as f:
+            report['comparison'] = compare(report, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
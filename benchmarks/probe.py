@@ -0,0 +1,67 @@
+"""ASGI wrapper around `main:socket_app` that records server-side health.
+
+Run uvicorn with `benchmarks.probe:app` and `BENCH_PROBE_DIR` set; every
+worker then samples its event-loop lag and writes `<pid>.json` (lag samples
+with wall-clock timestamps, current and peak RSS) into that directory once
+a second and on shutdown.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+
+from main import socket_app
+
+PROBE_DIR = os.environ.get("BENCH_PROBE_DIR", "")
+PROBE_INTERVAL = float(os.environ.get("BENCH_PROBE_INTERVAL_MS", 50)) / 1000
+
+_samples: "deque[tuple]" = deque(maxlen=20000)
+_task = None
+
+
+def read_rss_kb(pid: int = None) -> dict:
+    """VmRSS and VmHWM (peak) from /proc, in KiB."""
+    result = {'rss_kb': 0, 'peak_rss_kb': 0}
+    try:
+        with open(f"/proc/{pid or os.getpid()}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    result['rss_kb'] = int(line.split()[1])
+                elif line.startswith("VmHWM:"):
+                    result['peak_rss_kb'] = int(line.split()[1])
+    except OSError:
+        pass
+    return result
+
+
+def dump():
+    path = os.path.join(PROBE_DIR, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump({'pid': os.getpid(), 'lag': list(_samples), **read_rss_kb()}, f)
+    os.replace(path + ".tmp", path)
+
+
+async def sample_loop_lag():
+    loop = asyncio.get_running_loop()
+    last_dump = loop.time()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(PROBE_INTERVAL)
+        now = loop.time()
+        _samples.append((time.time(), (now - started - PROBE_INTERVAL) * 1000))
+        if now - last_dump >= 1:
+            dump()
+            last_dump = now
+
+
+async def app(scope, receive, send):
+    global _task
+    if scope['type'] == 'lifespan' and PROBE_DIR and _task is None:
+        _task = asyncio.ensure_future(sample_loop_lag())
+    try:
+        await socket_app(scope, receive, send)
+    finally:
+        if scope['type'] == 'lifespan' and _task is not None:
+            _task.cancel()
+            dump()
@@ -1,20 +1,66 @@
 import os
+import asyncio
+import signal
 from fastapi import FastAPI, Request
 from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import uvicorn
-from app.database import init_db
-from app.routes import rooms
-from app.routes.websocket import sio
+from app.database import init_db, close_db
+from app.routes import rooms, files, metrics, assets, admin
+from app.routes.websocket import sio, expire_messages, handle_peer_down, send_typing_state, send_batch
+from app.storage import memory_storage
+from app.blobstore import blob_store
+from app.snapshot import open_snapshot
+from app.registry import registry
+from app.expiry import expiry_scheduler
+from app.cluster import cluster
+from app.presence import typing_aggregator
+from app.batcher import broadcast_batcher
+from app.assets import asset_pipeline
+from app.sessions import sessions
+from app.metrics import loop_lag_monitor
+from app.profiling import profiler
 import socketio
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # init_db moves legacy inline uploads into the blob store
+    blob_store.start()
     init_db()
+    # Fingerprint and precompress static files, render the pages once
+    asset_pipeline.build()
+    loop_lag_monitor.start()
+    memory_storage.start()
+    # Share rooms, members and broadcasts with sibling workers (no-op without CLUSTER_BROKER)
+    await cluster.start(memory_storage, registry, {'presence': typing_aggregator, 'sessions': sessions},
+                        on_peer_down=handle_peer_down)
+    # Warm restart: ephemeral rooms saved at the last shutdown (no-op without SNAPSHOT_PATH).
+    # In a cluster the broker host restores them and replicates them to the others.
+    snapshot = open_snapshot() if not cluster.enabled or cluster.broker.is_host else None
+    if snapshot is not None:
+        expiry_scheduler.arm(memory_storage.restore_snapshot(snapshot))
+    # Self-destruct timers survive restarts: re-arm them from the database
+    expiry_scheduler.arm(await memory_storage.load_pending_expiries())
+    expiry_scheduler.start(expire_messages)
+    typing_aggregator.start(send_typing_state)
+    # Coalesces busy rooms' broadcasts (no-op without BROADCAST_BATCH_MAX_MS)
+    broadcast_batcher.start(send_batch)
+    # `kill -USR2 <pid>` profiles that worker for PROFILE_SIGNAL_SECONDS
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR2, profiler.start_from_signal)
+    except (NotImplementedError, AttributeError):
+        pass
     yield
+    await broadcast_batcher.stop()
+    await typing_aggregator.stop()
+    await expiry_scheduler.stop()
+    await cluster.stop()
+    memory_storage.save_snapshot()
+    # Flush queued writes before the process exits
+    memory_storage.shutdown()
+    await close_db()
+    await loop_lag_monitor.stop()
 
 app = FastAPI(lifespan=lifespan, title="ZeroChat - Secure Encrypted Chat")
 
@@ -26,22 +72,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-try:
-    app.mount("/static", StaticFiles(directory="static"), name="static")
-except:
-    pass
-
-templates = Jinja2Templates(directory="templates")
-
 app.include_router(rooms.router, prefix="/api", tags=["rooms"])
+app.include_router(files.router, prefix="/api", tags=["files"])
+app.include_router(metrics.router, tags=["metrics"])
+app.include_router(assets.router, tags=["assets"])
+app.include_router(admin.router, tags=["admin"])
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return asset_pipeline.page("index.html", request)
 
 @app.get("/chat", response_class=HTMLResponse)
 async def chat(request: Request):
-    return templates.TemplateResponse("chat.html", {"request": request})
+    return asset_pipeline.page("chat.html", request)
 
 socket_app = socketio.ASGIApp(sio, app, socketio_path='/socket.io')
 
@@ -4,11 +4,16 @@ let socket;
 let session;
 let messages = [];
 let users = [];
+let membersVersion = 0;
+let resumeToken = null;
 let peerConnections = {};
 let passphraseChanging = false;
 let typingTimeout;
 let typingUsers = new Set();
 let lastTypingEmit = 0;
+let historyCursor = null;
+
+const EMPTY_MESSAGES_HTML = '<div style="text-align: center; color: var(--text-tertiary); font-size: 0.85rem;">No messages yet. Start the conversation!</div>';
 
 // Initialize on page load
 document.addEventListener('DOMContentLoaded', async () => {
@@ -19,6 +24,8 @@ document.addEventListener('DOMContentLoaded', async () => {
     }
     
     session = JSON.parse(sessionData);
+    // A reload reclaims the seat this tab already holds instead of joining again
+    resumeToken = storedResumeToken();
     
     // Display room info
     document.getElementById('room-name').textContent = session.roomName;
@@ -66,14 +73,38 @@ function connectWebSocket() {
         console.log('[WS] Connected');
         updateConnectionStatus(true);
         
-        // Join room
-        socket.emit('join_room', {
-            roomId: session.roomId,
-            username: session.username,
-            passphrase: session.passphrase,
-            userId: session.userId,
-            isAdmin: session.isAdmin,
-            publicKey: session.publicKey
+        // After a network blip or a reload, reattach to our seat instead of joining again
+        if (resumeToken) {
+            socket.emit('resume_session', { resumeToken, lastMessageId: lastMessageId() });
+        } else {
+            joinRoom();
+        }
+    });
+    
+    socket.on('session_token', (data) => {
+        saveResumeToken(data.resumeToken);
+    });
+    
+    socket.on('resume_failed', () => {
+        saveResumeToken(null);
+        joinRoom();
+    });
+    
+    socket.on('session_resumed', async (data) => {
+        saveResumeToken(data.resumeToken);
+        const batch = await Promise.all(data.messages.map(prepareMessage));
+        
+        if (!data.replay) {
+            // Missed too much to replay: start over from the newest page
+            messages = [];
+            document.getElementById('messages').innerHTML = EMPTY_MESSAGES_HTML;
+            historyCursor = data.cursor;
+            updateLoadOlderButton();
+        }
+        batch.forEach(message => {
+            if (messages.some(m => m.id === message.id)) return;
+            messages.push(message);
+            displayMessage(message);
         });
     });
     
@@ -85,29 +116,33 @@ function connectWebSocket() {
     socket.on('message_broadcast', async (msg) => {
         if (passphraseChanging) return;
         
-        const decrypted = await cryptoManager.decryptMessage(msg.content, session.passphrase);
-        
-        // Verify signature if present
-        let verified = false;
-        if (msg.signature && msg.publicKey) {
-            verified = await cryptoManager.verifySignature(msg.content, msg.signature, msg.publicKey);
-        }
-        
-        const message = {
-            ...msg,
-            content: decrypted,
-            verified
-        };
-        
+        const message = await prepareMessage(fromWire(msg));
         messages.push(message);
         displayMessage(message);
+    });
+    
+    socket.on('history_batch', async (data) => {
+        if (passphraseChanging) return;
         
-        // Handle self-destruct
-        if (msg.ttl && msg.ttl > 0) {
-            setTimeout(() => {
-                removeMessage(msg.id);
-            }, msg.ttl * 1000);
+        const batch = await Promise.all(data.messages.map(prepareMessage));
+        
+        if (data.before === null) {
+            // Initial page on join: newest messages, appended in order
+            batch.forEach(message => {
+                if (messages.some(m => m.id === message.id)) return;
+                messages.push(message);
+                displayMessage(message);
+            });
+        } else {
+            // Older page: prepend, newest of the page last
+            messages = batch.concat(messages);
+            for (let i = batch.length - 1; i >= 0; i--) {
+                displayMessage(batch[i], true);
+            }
         }
+        
+        historyCursor = data.cursor;
+        updateLoadOlderButton();
     });
     
     socket.on('user_joined', (data) => {
@@ -120,51 +155,100 @@ function connectWebSocket() {
         addSystemMessage(`<< ${data.username} left the room`);
     });
     
-    socket.on('user_list_update', (data) => {
-        users = data.users;
+    socket.on('members_snapshot', (data) => {
+        if (data.version < membersVersion) return;
+        users = data.members;
+        membersVersion = data.version;
         updateUsersList();
     });
     
-    socket.on('user_typing', (data) => {
-        if (data.userId !== session.userId) {
-            typingUsers.add(data.username);
-            updateTypingIndicator();
-            
-            // Remove after 3 seconds
-            setTimeout(() => {
-                typingUsers.delete(data.username);
-                updateTypingIndicator();
-            }, 3000);
+    socket.on('members_delta', (data) => {
+        if (data.version <= membersVersion) return;
+        if (data.version !== membersVersion + 1) {
+            // Missed an update: ask for the full list again
+            socket.emit('resync_members', { roomId: session.roomId });
+            return;
+        }
+        membersVersion = data.version;
+        if (data.removed) {
+            users = users.filter(u => !data.removed.includes(u.id));
+        }
+        if (data.added) {
+            const addedIds = data.added.map(u => u.id);
+            users = users.filter(u => !addedIds.includes(u.id)).concat(data.added);
         }
+        updateUsersList();
     });
     
-    socket.on('clear_history', () => {
-        messages = [];
-        document.getElementById('messages').innerHTML = '<div style="text-align: center; color: var(--text-tertiary); font-size: 0.85rem;">No messages yet. Start the conversation!</div>';
-        passphraseChanging = false;
+    // The server sends the full set of typists whenever it changes
+    socket.on('typing_state', (data) => {
+        typingUsers = new Set(
+            data.users.filter(u => u.userId !== session.userId).map(u => u.username)
+        );
+        updateTypingIndicator();
     });
     
+    socket.on('clear_history', clearHistory);
+    
     socket.on('passphrase_changed', () => {
         showToast('Room passphrase changed by admin. Disconnecting...', 'error');
         sessionStorage.removeItem('chat-session');
+        saveResumeToken(null);
         setTimeout(() => {
             window.location.href = '/';
         }, 2000);
     });
     
+    socket.on('passphrase_change_complete', (data) => {
+        const who = data.evicted === 1 ? '1 member' : `${data.evicted} members`;
+        showToast(`Passphrase changed. History cleared and ${who} disconnected.`, 'success');
+    });
+    
     socket.on('message_deleted', (data) => {
-        removeMessage(data.messageId);
+        // Expirations arrive grouped per room
+        (data.messageIds || [data.messageId]).forEach(removeMessage);
     });
     
     socket.on('file_shared', async (file) => {
         displayFileShare(file);
     });
+
+    // Busy rooms coalesce broadcasts into one frame; apply them in the order sent
+    socket.on('message_batch', async (data) => {
+        // A rekey's clear_history keeps its place in the batch: drop what came before it, keep what follows
+        const changing = passphraseChanging;
+        const cleared = data.events.findIndex(([event]) => event === 'clear_history');
+        const shown = (i) => !changing || (cleared !== -1 && i > cleared);
+        const prepared = await Promise.all(data.events.map(([event, payload], i) =>
+            event === 'message_broadcast' && shown(i) ? prepareMessage(fromWire(payload)) : payload));
+        let skipping = changing;
+        data.events.forEach(([event], i) => {
+            if (event === 'clear_history') {
+                clearHistory();
+                skipping = false;
+            } else if (event === 'message_broadcast') {
+                if (skipping) return;
+                messages.push(prepared[i]);
+                displayMessage(prepared[i]);
+            } else if (event === 'message_deleted') {
+                prepared[i].messageIds.forEach(removeMessage);
+            } else if (event === 'file_shared') {
+                displayFileShare(prepared[i]);
+            }
+        });
+    });
     
     socket.on('webrtc_signal', async (data) => {
         handleWebRTCSignal(data);
     });
     
     socket.on('error', (data) => {
+        // Server is shedding load: retry the join shortly instead of failing
+        if (data.retry === 'join_room') {
+            setTimeout(joinRoom, 1000 + Math.random() * 2000);
+            return;
+        }
+        
         showToast(data.message, 'error');
         if (data.fatal) {
             setTimeout(() => {
@@ -174,6 +258,43 @@ function connectWebSocket() {
     });
 }
 
+function lastMessageId() {
+    for (let i = messages.length - 1; i >= 0; i--) {
+        if (!messages[i].isSystem) return messages[i].id;
+    }
+    return null;
+}
+
+function joinRoom() {
+    // A fresh join always starts from the server's snapshot
+    membersVersion = 0;
+    socket.emit('join_room', {
+        roomId: session.roomId,
+        username: session.username,
+        passphrase: session.passphrase,
+        userId: session.userId,
+        isAdmin: session.isAdmin,
+        publicKey: session.publicKey,
+        // Receive broadcasts with raw binary ciphertext and without the sender's key
+        binary: true
+    });
+}
+
+function fromWire(msg) {
+    // Long binary broadcasts carry an ArrayBuffer; the crypto helpers work on base64 text
+    const out = { ...msg };
+    for (const field of ['content', 'signature']) {
+        if (out[field] && typeof out[field] !== 'string') {
+            out[field] = cryptoManager.arrayBufferToBase64(out[field]);
+        }
+    }
+    if (!out.publicKey) {
+        const sender = users.find(u => u.id === out.userId);
+        if (sender) out.publicKey = sender.publicKey;
+    }
+    return out;
+}
+
 async function sendMessage() {
     const input = document.getElementById('message-input');
     const content = input.value.trim();
@@ -188,7 +309,6 @@ async function sendMessage() {
     const ttl = parseInt(document.getElementById('ttl-select').value);
     
     const messageData = {
-        id: Date.now().toString(),
         roomId: session.roomId,
         userId: session.userId,
         username: session.username,
@@ -202,6 +322,59 @@ async function sendMessage() {
     input.value = '';
 }
 
+async function prepareMessage(msg) {
+    const decrypted = await cryptoManager.decryptMessage(msg.content, session.passphrase);
+    
+    // Verify signature if present
+    let verified = false;
+    if (msg.signature && msg.publicKey) {
+        verified = await cryptoManager.verifySignature(msg.content, msg.signature, msg.publicKey);
+    }
+    
+    // Handle self-destruct
+    if (msg.ttl && msg.ttl > 0) {
+        setTimeout(() => {
+            removeMessage(msg.id);
+        }, msg.ttl * 1000);
+    }
+    
+    return {
+        ...msg,
+        content: decrypted,
+        verified
+    };
+}
+
+function loadOlderMessages() {
+    if (historyCursor === null) return;
+    
+    socket.emit('fetch_history', {
+        roomId: session.roomId,
+        before: historyCursor
+    });
+}
+
+function updateLoadOlderButton() {
+    const container = document.getElementById('messages');
+    let button = document.getElementById('load-older');
+    
+    if (historyCursor === null) {
+        if (button) button.remove();
+        return;
+    }
+    
+    if (!button) {
+        button = document.createElement('button');
+        button.id = 'load-older';
+        button.className = 'btn btn-secondary';
+        button.style.cssText = 'display: block; margin: 0 auto 1rem; font-size: 0.75rem;';
+        button.dataset.testid = 'button-load-older';
+        button.textContent = '⬆ LOAD OLDER MESSAGES';
+        button.onclick = loadOlderMessages;
+    }
+    container.prepend(button);
+}
+
 function handleMessageKeydown(e) {
     if (e.key === 'Enter' && !e.shiftKey) {
         e.preventDefault();
@@ -209,7 +382,7 @@ function handleMessageKeydown(e) {
     }
 }
 
-function displayMessage(msg) {
+function displayMessage(msg, prepend = false) {
     const container = document.getElementById('messages');
     
     // Remove placeholder
@@ -238,16 +411,25 @@ function displayMessage(msg) {
         <div class="message-content">${escapeHtml(msg.content)}</div>
     `;
     
-    container.appendChild(messageDiv);
-    
-    // Move typing indicator to bottom if it exists
-    const typingIndicator = document.getElementById('typing-indicator');
-    if (typingIndicator) {
-        container.appendChild(typingIndicator);
+    if (prepend) {
+        const loadOlder = document.getElementById('load-older');
+        if (loadOlder) {
+            loadOlder.after(messageDiv);
+        } else {
+            container.prepend(messageDiv);
+        }
+    } else {
+        container.appendChild(messageDiv);
+        
+        // Move typing indicator to bottom if it exists
+        const typingIndicator = document.getElementById('typing-indicator');
+        if (typingIndicator) {
+            container.appendChild(typingIndicator);
+        }
+        
+        container.scrollTop = container.scrollHeight;
     }
     
-    container.scrollTop = container.scrollHeight;
-    
     // Update timer
     if (msg.ttl) {
         startMessageTimer(msg.id, msg.ttl);
@@ -415,12 +597,23 @@ async function handleFileSelect(event) {
         const encrypted = await cryptoManager.encryptFile(arrayBuffer, session.passphrase);
         const signature = await cryptoManager.signMessage(encrypted);
         
+        // Upload the ciphertext over HTTP; the socket event only carries metadata
+        const response = await fetch(blobUrl(), {
+            method: 'POST',
+            headers: { ...authHeaders(), 'Content-Type': 'application/octet-stream' },
+            body: encrypted
+        });
+        if (!response.ok) {
+            throw new Error('Upload failed');
+        }
+        const { blobId } = await response.json();
+        
         socket.emit('share_file', {
             roomId: session.roomId,
             userId: session.userId,
             username: session.username,
             filename: file.name,
-            encryptedData: encrypted,
+            blobId,
             mimeType: file.type,
             fileSize: file.size,
             signature
@@ -467,9 +660,73 @@ async function displayFileShare(file) {
     container.scrollTop = container.scrollHeight;
 }
 
+function blobUrl(blobId = '') {
+    return `/api/rooms/${encodeURIComponent(session.roomId)}/blobs${blobId ? '/' + blobId : ''}`;
+}
+
+function clearHistory() {
+    messages = [];
+    historyCursor = null;
+    document.getElementById('messages').innerHTML = EMPTY_MESSAGES_HTML;
+    passphraseChanging = false;
+}
+
+// Kept per tab next to the session, tagged with its room so another room's token is never tried
+function storedResumeToken() {
+    const stored = JSON.parse(sessionStorage.getItem('chat-resume') || 'null');
+    return stored && stored.roomId === session.roomId ? stored.token : null;
+}
+
+function saveResumeToken(token) {
+    resumeToken = token;
+    if (token) {
+        sessionStorage.setItem('chat-resume', JSON.stringify({ roomId: session.roomId, token }));
+    } else {
+        sessionStorage.removeItem('chat-resume');
+    }
+}
+
+// File routes identify members by their resume token, which only this tab knows
+function authHeaders() {
+    return resumeToken ? { Authorization: `Bearer ${resumeToken}` } : {};
+}
+
+async function fetchBlob(blobId, expectedSize) {
+    // Resume with a Range request if the connection drops mid-download
+    const url = blobUrl(blobId);
+    const chunks = [];
+    let received = 0;
+    
+    for (let attempt = 0; attempt < 5; attempt++) {
+        try {
+            const headers = received > 0 ? { ...authHeaders(), Range: `bytes=${received}-` } : authHeaders();
+            const response = await fetch(url, { headers });
+            if (!response.ok) {
+                throw new Error(`Download failed (${response.status})`);
+            }
+            
+            const reader = response.body.getReader();
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                chunks.push(value);
+                received += value.length;
+            }
+            
+            if (!expectedSize || received >= expectedSize) break;
+        } catch (error) {
+            if (attempt === 4) throw error;
+        }
+    }
+    
+    return new TextDecoder().decode(await new Blob(chunks).arrayBuffer());
+}
+
 async function downloadFile(file) {
     try {
-        const decrypted = await cryptoManager.decryptFile(file.encryptedData, session.passphrase);
+        // Files shared before the blob store arrive inline
+        const encrypted = file.encryptedData || await fetchBlob(file.blobId, file.blobSize);
+        const decrypted = await cryptoManager.decryptFile(encrypted, session.passphrase);
         const blob = new Blob([decrypted], { type: file.mimeType });
         const url = URL.createObjectURL(blob);
         
@@ -618,7 +875,6 @@ async function changePassphrase() {
     document.getElementById('passphrase-display').value = newPass;
     
     closePassphraseModal();
-    showToast('Passphrase changed. Message history cleared.', 'success');
 }
 
 // Utility Functions
@@ -655,6 +911,7 @@ function leaveRoom() {
         userId: session.userId
     });
     sessionStorage.removeItem('chat-session');
+    saveResumeToken(null);
     window.location.href = '/';
 }
 
@@ -112,6 +112,10 @@ document.getElementById('join-form').addEventListener('submit', async (e) => {
             })
         });
         
+        if (response.status === 503) {
+            throw new Error('Server busy, please retry');
+        }
+        
         if (!response.ok) {
             throw new Error('Room not found');
         }
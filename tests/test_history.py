@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from app import persistence
+from app.message_store import RoomMessageStore, format_cursor, parse_cursor
+from app.segment_log import SegmentLogStore, now_ms
+from app.storage import DualStorage
+
+
+class NullSession:
+    def execute(self, *args, **kwargs):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_first_page_reaches_history_memory_dropped(tmp_path, monkeypatch):
+    monkeypatch.setattr(persistence, "SessionLocal", NullSession)
+    storage = DualStorage()
+    storage.log = SegmentLogStore(str(tmp_path))
+    # A persistent room whose memory keeps only its newest 30 messages
+    storage.rooms["room"] = {'name': 'room', 'storage_mode': 'persistent'}
+    storage.messages["room"] = RoomMessageStore(max_messages=30)
+    storage.lru["room"] = None
+    start = now_ms()
+    for n in range(120):
+        storage.add_message("room", {'id': f"m{n:04d}", 'roomId': 'room', 'userId': 'u', 'username': 'alice',
+                                     'content': 'hi', 'timestamp': start + n})
+    storage.writer.stop()
+    assert storage.get_messages_page("room", None, 50)[1] is None
+
+    async def read_all():
+        pages = []
+        messages, cursor = await storage.fetch_messages_page("room", None, 50)
+        pages.append(messages)
+        while cursor is not None:
+            messages, cursor = await storage.fetch_messages_page("room", cursor, 50)
+            pages.append(messages)
+        return [m['id'] for page in reversed(pages) for m in page]
+
+    assert asyncio.run(read_all()) == [f"m{n:04d}" for n in range(120)]
+    storage.log.stop()
+
+
+@pytest.mark.parametrize("cursor", ["", "soon", "nan:m0001", "inf", "1e300:m0001", "-1:m0001", True, ["1"], {"ts": 1}])
+def test_malformed_cursors_parse_as_none(cursor):
+    assert parse_cursor(cursor) is None
+
+
+def test_cursors_round_trip():
+    assert parse_cursor(format_cursor((1700000000000.5, "a:b"))) == (1700000000000.5, "a:b")
+    assert parse_cursor(1700000000000) == (1700000000000.0, "")
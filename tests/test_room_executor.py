@@ -0,0 +1,57 @@
+import asyncio
+
+from app.profiling import HandlerTracer, _spans, span
+from app.room_executor import RoomExecutor
+
+
+def test_jobs_record_spans_for_the_handler_that_submitted_them():
+    executor = RoomExecutor()
+    tracer = HandlerTracer(slow_ms=1)
+    tables = {}
+
+    async def handler(name: str):
+        token = tracer.begin()
+        tables[name] = _spans.get()
+
+        async def job():
+            with span(f"job.{name}"):
+                await asyncio.sleep(0)
+
+        await executor.run("room", job)
+        tracer.end(token, name, 0)
+
+    async def main():
+        # The first handler starts the room's worker; the others queue behind it
+        await asyncio.gather(*(handler(f"h{n}") for n in range(3)))
+
+    asyncio.run(main())
+    for name, spans in tables.items():
+        assert list(spans) == [f"job.{name}"]
+
+
+def test_nested_run_executes_inline_and_spawned_tasks_queue():
+    executor = RoomExecutor()
+    order = []
+
+    async def main():
+        async def inner():
+            order.append("inner")
+            return 1
+
+        async def spawned():
+            order.append("spawned")
+
+        async def outer():
+            order.append("outer")
+            later = asyncio.create_task(executor.run("room", spawned))
+            result = await executor.run("room", inner)
+            order.append("outer done")
+            return result, later
+
+        result, later = await executor.run("room", outer)
+        await later
+        return result
+
+    assert asyncio.run(main()) == 1
+    assert order == ["outer", "inner", "outer done", "spawned"]
+    assert len(executor) == 0
@@ -0,0 +1,185 @@
+import os
+
+import pytest
+
+from app import persistence, segment_log
+from app.persistence import WriteBehindQueue
+from app.segment_log import HEADER, RoomLog, SegmentLogStore, now_ms
+
+
+def message(n: int, timestamp: float, ttl=None) -> dict:
+    return {'id': f"m{n:04d}", 'roomId': 'room', 'userId': 'u', 'username': 'alice',
+            'content': 'x' * 40, 'timestamp': timestamp, 'ttl': ttl}
+
+
+def ids(messages) -> list:
+    return [m['id'] for m in messages]
+
+
+def log_files(directory) -> list:
+    return sorted(name for name in os.listdir(directory) if name.endswith(".log"))
+
+
+@pytest.fixture
+def small_segments(monkeypatch):
+    # A few records per segment, so tests roll and seal segments quickly
+    monkeypatch.setattr(segment_log, "LOG_SEGMENT_BYTES", 4 * (HEADER.size + 150))
+    monkeypatch.setattr(segment_log, "LOG_INDEX_INTERVAL_BYTES", 1)
+
+
+def test_torn_tail_is_dropped_on_reopen(tmp_path, small_segments):
+    directory = str(tmp_path / "room")
+    start = now_ms()
+    log = RoomLog(directory)
+    for n in range(10):
+        log.append(message(n, start + n))
+    log.close()
+
+    # A crash mid-append leaves half a record at the end of the active segment
+    active = os.path.join(directory, log_files(directory)[-1])
+    intact_size = os.path.getsize(active)
+    with open(active, "ab") as f:
+        f.write(HEADER.pack(500, 0, start + 10, 0) + b"{\"id\":")
+
+    reopened = RoomLog(directory)
+    assert os.path.getsize(active) == intact_size
+    page, _ = reopened.page(None, 50, now_ms())
+    assert ids(page) == [f"m{n:04d}" for n in range(10)]
+
+    # Appends continue right after the last intact record
+    reopened.append(message(10, start + 10))
+    reopened.close()
+    page, _ = RoomLog(directory).page(None, 50, now_ms())
+    assert ids(page) == [f"m{n:04d}" for n in range(11)]
+
+
+def test_interrupted_compaction_keeps_newest_generation(tmp_path, small_segments):
+    directory = str(tmp_path / "room")
+    start = now_ms()
+    log = RoomLog(directory)
+    for n in range(10):
+        log.append(message(n, start + n))
+    log.close()
+
+    sealed = log.segments[0]
+    # The rewrite finished but the old generation was never removed, and a temp file was left behind
+    newer = sealed.path.replace("-0000.log", "-0001.log")
+    with open(sealed.path, "rb") as src, open(newer, "wb") as dst:
+        dst.write(src.read())
+    open(newer + ".tmp", "wb").close()
+
+    reopened = RoomLog(directory)
+    assert os.path.basename(newer) in log_files(directory)
+    assert os.path.basename(sealed.path) not in log_files(directory)
+    assert not any(name.endswith(".tmp") for name in os.listdir(directory))
+    page, _ = reopened.page(None, 50, now_ms())
+    assert ids(page) == [f"m{n:04d}" for n in range(10)]
+
+
+def test_compaction_drops_expired_messages_and_keeps_offsets(tmp_path, small_segments):
+    directory = str(tmp_path / "room")
+    start = now_ms() - 60_000
+    log = RoomLog(directory)
+    for n in range(12):
+        # Every other message self-destructed long ago
+        log.append(message(n, start + n, ttl=1 if n % 2 else None))
+    next_offset = log.next_offset()
+    sealed_bytes = sum(segment.size for segment in log.segments[:-1])
+
+    reclaimed = log.compact(now_ms(), 0.3)
+    assert 0 < reclaimed < sealed_bytes
+    assert log.next_offset() == next_offset
+    assert all(name.endswith("-0001.log") for name in log_files(directory)[:-1])
+
+    expected = [f"m{n:04d}" for n in range(12) if n % 2 == 0]
+    page, _ = log.page(None, 50, now_ms())
+    assert ids(page) == expected
+
+    # The compacted segments and their indexes load back the same way
+    log.append(message(12, start + 12))
+    log.close()
+    reopened = RoomLog(directory)
+    assert reopened.next_offset() == next_offset + 1
+    page, _ = reopened.page(None, 50, now_ms())
+    assert ids(page) == expected + ["m0012"]
+
+
+def test_store_evicts_least_recently_used_logs(tmp_path):
+    store = SegmentLogStore(str(tmp_path), max_open=2)
+    start = now_ms()
+    for n in range(6):
+        store.append(f"room{n % 3}", message(n, start + n))
+    assert len(store.rooms) == 2
+
+    evicted = RoomLog(str(tmp_path / "spare"))
+    evicted.retire()
+    assert evicted.append(message(99, start)) is False
+
+    for room in range(3):
+        page, _ = store.page(f"room{room}", None, 50)
+        assert ids(page) == [f"m{n:04d}" for n in range(6) if n % 3 == room]
+    store.stop()
+
+
+def test_idle_files_are_closed(tmp_path):
+    store = SegmentLogStore(str(tmp_path))
+    store.append("room", message(0, now_ms()))
+    log = store.rooms["room"]
+    assert log._file is not None
+    store.close_idle(idle=-1)
+    assert log._file is None
+    store.append("room", message(1, now_ms() + 1))
+    page, _ = store.page("room", None, 50)
+    assert ids(page) == ["m0000", "m0001"]
+    store.stop()
+
+
+def test_pending_expiries_does_not_load_rooms(tmp_path):
+    store = SegmentLogStore(str(tmp_path))
+    start = now_ms()
+    store.append("a", message(0, start, ttl=3600))
+    store.append("a", message(1, start - 60_000, ttl=1))
+    store.append("b", message(2, start))
+    store.stop()
+
+    fresh = SegmentLogStore(str(tmp_path))
+    pending = fresh.pending_expiries()
+    assert [(room_id, message_id) for room_id, message_id, _ in pending] == [("a", "m0000")]
+    assert pending[0][2] == pytest.approx(start / 1000 + 3600)
+    assert not fresh.rooms
+
+
+class FlakySession:
+    """Fails the first commit, as a constraint violation elsewhere in a batch would."""
+
+    failures = 1
+
+    def execute(self, *args, **kwargs):
+        pass
+
+    def commit(self):
+        if FlakySession.failures:
+            FlakySession.failures -= 1
+            raise RuntimeError("batch rejected")
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_retried_batch_does_not_append_twice(tmp_path, monkeypatch):
+    monkeypatch.setattr(persistence, "SessionLocal", FlakySession)
+    store = SegmentLogStore(str(tmp_path))
+    writer = WriteBehindQueue()
+    start = now_ms()
+    writer.call(lambda db: store.append("room", message(0, start)), key="room", transactional=False)
+    writer.call(lambda db: store.append("room", message(1, start + 1)), key="room", transactional=False)
+    writer.stop()
+
+    assert FlakySession.failures == 0
+    assert writer.failures == 0
+    page, _ = store.page("room", None, 50)
+    assert ids(page) == ["m0000", "m0001"]
+    store.stop()
@@ -0,0 +1,43 @@
+import time
+
+from app.snapshot import open_snapshot, room_state, write_snapshot
+from app.storage import InMemoryStorage
+
+
+def saved_room(n: int, active_at: float):
+    room = {'name': f"room{n}", 'storage_mode': 'ephemeral'}
+    message = {'id': f"m{n}", 'content': 'x', 'timestamp': active_at * 1000, 'ttl': 3600 * 24}
+    return f"room{n}", room_state(room, [message], [], active_at)
+
+
+def test_rooms_idle_past_max_age_are_dropped(tmp_path):
+    path = str(tmp_path / "snapshot")
+    now = time.time()
+    write_snapshot(path, [saved_room(0, now), saved_room(1, now - 7200)])
+
+    snapshot = open_snapshot(path, max_age=3600)
+    assert "room0" in snapshot and "room1" not in snapshot
+    assert snapshot.expired == 1
+    assert [room_id for room_id, _, _ in snapshot.expiries] == ["room0"]
+    snapshot.close()
+
+
+def test_restarts_do_not_refresh_rooms_nobody_rejoined(tmp_path):
+    path = str(tmp_path / "snapshot")
+    idle_since = time.time() - 1800
+    write_snapshot(path, [saved_room(0, idle_since)])
+
+    # Restored, then saved again at the next shutdown without anyone joining
+    storage = InMemoryStorage()
+    storage.restore_snapshot(open_snapshot(path, max_age=3600))
+    assert storage.save_snapshot(path) == 1
+
+    snapshot = open_snapshot(path, max_age=3600)
+    assert snapshot.take("room0")['activeAt'] == idle_since
+    snapshot.close()
+
+    # Half an hour idle is past a 20 minute limit, however recently the file was saved
+    write_snapshot(path, [saved_room(0, idle_since)])
+    snapshot = open_snapshot(path, max_age=1200)
+    assert len(snapshot) == 0 and snapshot.expired == 1
+    snapshot.close()